@@ -0,0 +1,298 @@
+# @file bdd.py
+# @author Evan Brody
+# @brief Computes exact DepGraph risks by compiling the graph into a binary decision diagram
+
+import os, sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph.dep_graph import DepGraph
+
+# A reduced ordered binary decision diagram. Nodes are integers:
+# 0 and 1 are the terminals, and node k > 1 tests variable var[k],
+# going to hi[k] if it's true and lo[k] if it's false. Children are
+# always created before their parents, so ids are in topological order
+class BDD:
+    FALSE = 0
+    TRUE = 1
+
+    def __init__(self, num_vars: int) -> None:
+        self.num_vars = num_vars
+        # Terminals test a variable past the last one, so they sort last
+        self.var = [num_vars, num_vars]
+        self.lo = [0, 1]
+        self.hi = [0, 1]
+        # Maps (var, lo, hi) to the node testing it, so no node is built twice
+        self.unique = {}
+        # Maps (op, u, v) to the result of apply
+        self.cache = {}
+
+    def __len__(self) -> int:
+        return len(self.var)
+
+    # The node testing v with children lo and hi
+    def mk(self, v: int, lo: int, hi: int) -> int:
+        if lo == hi:
+            return lo
+
+        key = (v, lo, hi)
+        node = self.unique.get(key)
+        if node is None:
+            node = self.unique[key] = len(self.var)
+            self.var.append(v)
+            self.lo.append(lo)
+            self.hi.append(hi)
+        return node
+
+    def var_node(self, v: int) -> int:
+        return self.mk(v, self.FALSE, self.TRUE)
+
+    # u AND v if op is "and", u OR v if op is "or"
+    def apply(self, op: str, u: int, v: int) -> int:
+        # Terminal cases
+        if "and" == op:
+            if self.FALSE == u or self.FALSE == v:
+                return self.FALSE
+            if self.TRUE == u or u == v:
+                return v
+            if self.TRUE == v:
+                return u
+        else:
+            if self.TRUE == u or self.TRUE == v:
+                return self.TRUE
+            if self.FALSE == u or u == v:
+                return v
+            if self.FALSE == v:
+                return u
+
+        # Both operations are commutative, so one cache entry covers both orders
+        key = (op, u, v) if u < v else (op, v, u)
+        res = self.cache.get(key)
+        if res is not None:
+            return res
+
+        var_u, var_v = self.var[u], self.var[v]
+        top = min(var_u, var_v)
+        u_lo, u_hi = (self.lo[u], self.hi[u]) if var_u == top else (u, u)
+        v_lo, v_hi = (self.lo[v], self.hi[v]) if var_v == top else (v, v)
+
+        res = self.cache[key] = self.mk(
+            top, self.apply(op, u_lo, v_lo), self.apply(op, u_hi, v_hi)
+        )
+        return res
+
+    # Probability of each node being true when variable k is true with
+    # probability p[..., k]. p may hold a batch of assignments in its
+    # leading axes. Nodes of equal height are evaluated together
+    def probabilities(self, p: np.ndarray, levels: list[np.ndarray]) -> np.ndarray:
+        var, lo, hi = (np.array(x) for x in (self.var, self.lo, self.hi))
+        probs = np.zeros(p.shape[:-1] + (len(var),), np.double)
+        probs[..., self.TRUE] = 1
+
+        for nodes in levels:
+            p_var = p[..., var[nodes]]
+            probs[..., nodes] = p_var * probs[..., hi[nodes]] + (1 - p_var) * probs[..., lo[nodes]]
+        return probs
+
+    # Internal nodes grouped by height above the terminals
+    def levels(self) -> list[np.ndarray]:
+        height = np.zeros(len(self.var), int)
+        for k in range(2, len(self.var)):
+            height[k] = 1 + max(height[self.lo[k]], height[self.hi[k]])
+
+        order = np.argsort(height[2:], kind="stable") + 2
+        bounds = np.searchsorted(height[order], np.arange(1, height.max(initial=0) + 2))
+        return [order[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+# Exact failure probabilities for every vertex of a DepGraph, under
+# the model graph/monte_carlo.py samples from:
+#   a component fails directly with probability r0
+#   a failure crosses each edge a -> b with probability equal to its weight
+#   a component fails if it fails directly or a failure reaches it
+#   an AND gate fails if failures reach it through all of its in-edges
+#   a k-of-n gate fails if failures reach it through k or more in-edges
+# Shared inputs and reconvergent paths are handled exactly. Compiling
+# can take time and memory exponential in the size of the graph, but
+# once compiled, evaluating new direct risks is linear in the BDD size
+class BDDEvaluator:
+    def __init__(self, dg: DepGraph) -> None:
+        n = dg.n
+        self.n = n
+        self.iref = dg.iref[:n].copy()
+        self.is_AND = dg.is_AND[:n].copy()
+        self.vote_k = dg.vote_k[:n].copy()
+        self.is_component = np.logical_and(dg.active[:n], np.logical_not(self.is_AND))
+        self.r0 = np.where(self.is_AND, 0, dg.r0[:n])
+
+        # Edges a -> b, sorted by b so each vertex's in-edges are contiguous.
+        # Edges of weight 1 always carry failures, so they get no variable
+        b, a, w = dg.storage.edge_coo(n)
+        order = np.argsort(b, kind="stable")
+        self.src, self.dst, self.weight = a[order], b[order], w[order]
+        self.in_start = np.searchsorted(self.dst, np.arange(n + 1))
+
+        self.var_order()
+        self.compile()
+
+    # Variables are numbered so related events sit close together: a
+    # depth-first walk up the in-edges from each sink, giving each edge
+    # its variable right after everything upstream of it. This keeps
+    # the BDD small for tree-like graphs
+    def var_order(self) -> None:
+        n = self.n
+        has_out = np.zeros(n, bool)
+        has_out[self.src] = True
+        roots = np.flatnonzero(np.logical_not(has_out)).tolist()
+        roots += np.flatnonzero(has_out).tolist()
+
+        uncertain = self.weight < 1
+        self.vertex_var = np.full(n, -1, int)
+        self.edge_var = np.full(len(self.weight), -1, int)
+        num_vars = 0
+        visited = np.zeros(n, bool)
+        for root in roots:
+            if visited[root]:
+                continue
+
+            # (vertex, next in-edge to visit)
+            visited[root] = True
+            stack = [(root, self.in_start[root])]
+            while stack:
+                v, e = stack.pop()
+                # Finished the subtree through in-edge -e - 1
+                if e < 0:
+                    e = -e - 1
+                    if uncertain[e]:
+                        self.edge_var[e] = num_vars
+                        num_vars += 1
+                    continue
+
+                if e < self.in_start[v + 1]:
+                    stack.append((v, e + 1))
+                    u = self.src[e]
+                    if not visited[u]:
+                        visited[u] = True
+                        stack.append((v, -e - 1))
+                        stack.append((u, self.in_start[u]))
+                    elif uncertain[e]:
+                        self.edge_var[e] = num_vars
+                        num_vars += 1
+                    continue
+
+                if not self.is_AND[v]:
+                    self.vertex_var[v] = num_vars
+                    num_vars += 1
+
+        self.num_vars = num_vars
+
+    # Builds the BDD for each vertex's failure. With cycles, failures
+    # are the least fixed point, reached by sweeping until nothing changes
+    def compile(self) -> None:
+        n = self.n
+        bdd = self.bdd = BDD(self.num_vars)
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, 4 * self.num_vars + 1000))
+
+        fails = np.zeros(n, int)
+        direct = [bdd.var_node(self.vertex_var[v]) if self.vertex_var[v] >= 0 else bdd.FALSE for v in range(n)]
+        order = self.sweep_order()
+        changed = True
+        try:
+            while changed:
+                changed = False
+                for v in order:
+                    new = bdd.TRUE if self.is_AND[v] else bdd.FALSE
+                    op = "and" if self.is_AND[v] else "or"
+                    # at_least[c] is whether c of the in-edges so far delivered a failure
+                    at_least = [bdd.TRUE] + [bdd.FALSE] * self.vote_k[v]
+                    for e in range(self.in_start[v], self.in_start[v + 1]):
+                        reached = fails[self.src[e]]
+                        if self.edge_var[e] >= 0:
+                            reached = bdd.apply("and", reached, bdd.var_node(self.edge_var[e]))
+                        if not self.vote_k[v]:
+                            new = bdd.apply(op, new, reached)
+                        for c in range(self.vote_k[v], 0, -1):
+                            at_least[c] = bdd.apply("or", at_least[c], bdd.apply("and", reached, at_least[c - 1]))
+
+                    if self.vote_k[v]:
+                        new = at_least[-1]
+                    elif not self.is_AND[v]:
+                        new = bdd.apply("or", new, direct[v])
+                    elif self.in_start[v] == self.in_start[v + 1]:
+                        new = bdd.FALSE
+
+                    if new != fails[v]:
+                        fails[v] = new
+                        changed = True
+        finally:
+            sys.setrecursionlimit(limit)
+
+        self.roots = fails
+        self.levels = bdd.levels()
+
+    # Vertices in topological order where the graph allows
+    def sweep_order(self) -> list[int]:
+        n = self.n
+        in_degree = np.diff(self.in_start).copy()
+        out_edges = [[] for _ in range(n)]
+        for a, b in zip(self.src.tolist(), self.dst.tolist()):
+            out_edges[a].append(b)
+
+        ready = np.flatnonzero(0 == in_degree).tolist()
+        order = []
+        while ready:
+            v = ready.pop()
+            order.append(v)
+            for b in out_edges[v]:
+                in_degree[b] -= 1
+                if 0 == in_degree[b]:
+                    ready.append(b)
+
+        placed = np.zeros(n, bool)
+        placed[order] = True
+        return order + np.flatnonzero(np.logical_not(placed)).tolist()
+
+    # Variable probabilities for direct risks R0, which may be s x n
+    def var_probs(self, R0: np.ndarray) -> np.ndarray:
+        p = np.zeros(R0.shape[:-1] + (self.num_vars,), np.double)
+        has_var = self.vertex_var >= 0
+        p[..., self.vertex_var[has_var]] = R0[..., has_var]
+        has_var = self.edge_var >= 0
+        p[..., self.edge_var[has_var]] = self.weight[has_var]
+        return p
+
+    # Exact total risk of every vertex, for direct risks r0 (by default,
+    # the ones the graph had when compiled). Unlike calc_r, AND gates
+    # get their real failure probability
+    def evaluate(self, r0: np.ndarray=None) -> np.ndarray:
+        r0 = self.r0 if r0 is None else np.asarray(r0, np.double)
+        return self.evaluate_batch(r0[np.newaxis])[0]
+
+    # evaluate for each row of the s x n matrix R0
+    def evaluate_batch(self, R0: np.ndarray) -> np.ndarray:
+        R0 = np.asarray(R0, np.double)
+        if R0.ndim != 2 or R0.shape[1] != self.n:
+            raise ValueError(f"R0 must have shape (s, {self.n}), not {R0.shape}")
+
+        probs = self.bdd.probabilities(self.var_probs(R0), self.levels)
+        return probs[:, self.roots]
+
+    # Maps components to their exact total risk, like DepGraph.get_r_dict
+    def get_r_dict(self, r0: np.ndarray=None) -> dict:
+        r = self.evaluate(r0)
+        return { self.iref[i] : r[i] for i in np.flatnonzero(self.is_component) }
+
+if __name__ == "__main__":
+    # Two components feeding an AND gate share the upstream component s.
+    # calc_r multiplies their risks as if they were independent
+    dg = DepGraph()
+    dg.add_vertices(['s', 'a', 'b', 'out'], [0.5, 0.1, 0.1, 0.0])
+    dg.add_AND_gate('AND')
+    dg.add_edges([('s', 'a'), ('s', 'b'), ('a', 'AND'), ('b', 'AND'), ('AND', 'out')], [1, 1, 1, 1, 1])
+    print("calc_r:", dg.get_r_dict()['out'])
+
+    ev = BDDEvaluator(dg)
+    # P(s OR (a AND b)) = 0.5 + 0.5 * 0.01
+    print("BDD:   ", ev.get_r_dict()['out'], "exact:", 0.5 + 0.5 * 0.01)
+    print("nodes: ", len(ev.bdd))
@@ -0,0 +1,105 @@
+# @file bench_dep_graph.py
+# @author Evan Brody
+# @brief Times the loop and vectorized versions of calc_Ac_full and update_AND_weights
+
+import os, sys, time
+import numpy as np
+from itertools import product
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph.dep_graph import DepGraph
+
+SIZES = (64, 256, 512)
+EDGES_PER_VERTEX = 2
+AND_FRACTION = 0.1
+REPEATS = 5
+
+# calc_Ac_full as a Python loop over every pair
+def loop_calc_Ac_full(dg: DepGraph) -> np.ndarray:
+    n = dg.n
+    A_collapse, one_count = dg.A_collapse, dg.one_count
+    Ac_full = np.empty((n, n), np.double)
+    for i, j in product(range(n), repeat=2):
+        Ac_full[i, j] = max(A_collapse[i, j], int(bool(one_count[i, j])))
+
+    return Ac_full
+
+# update_AND_weights as nested Python loops over AND gates and vertices.
+# Returns the new r0 instead of storing it
+def loop_update_AND_weights(dg: DepGraph) -> np.ndarray:
+    n = dg.n
+    r0 = dg.r0[:n].copy()
+    Ac_full = loop_calc_Ac_full(dg)
+
+    AND_indices = [i for i in range(n) if dg.is_AND[i]]
+    comp_indices = [j for j in range(n) if not dg.is_AND[j]]
+    connected = {}
+    for i in AND_indices:
+        connected[i] = any(Ac_full[i, j] for j in comp_indices)
+        if not connected[i]:
+            r0[i] = 0
+            continue
+
+        r0[i] = 1
+        for j in comp_indices:
+            if Ac_full[i, j] > 0:
+                r0[i] *= Ac_full[i, j] * r0[j]
+
+    r0_comps = r0.copy()
+    for i, j in product(AND_indices, repeat=2):
+        if i == j or not connected[j]:
+            continue
+
+        if Ac_full[i, j] > 0:
+            r0[i] *= r0_comps[j] * Ac_full[i, j]
+
+    return r0
+
+# A random graph with n vertices, a tenth of them AND gates
+def random_graph(n: int, rng: np.random.Generator) -> DepGraph:
+    and_flags = rng.random(n) < AND_FRACTION
+    edges = set()
+    while len(edges) < EDGES_PER_VERTEX * n:
+        a, b = rng.choice(n, 2, replace=False)
+        edges.add((int(a), int(b)))
+
+    edges = sorted(edges)
+    weights = rng.choice([1, 0.5, 0.75], len(edges))
+    return DepGraph.build(
+        list(range(n)), edges, weights.tolist(), and_flags=and_flags.tolist(),
+        direct_risks=rng.uniform(0.05, 0.5, n).tolist(), storage="dense"
+    )
+
+# Best of REPEATS wall-clock times for f()
+def best_time(f) -> float:
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+def vec_update_AND_weights(dg: DepGraph) -> np.ndarray:
+    r0 = dg.r0.copy()
+    dg.update_AND_weights()
+    new_r0 = dg.r0[:dg.n].copy()
+    dg.r0 = r0
+    return new_r0
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    print(f"{'n':>5} {'function':<20} {'loop (ms)':>10} {'numpy (ms)':>11} {'speedup':>8}")
+    for n in SIZES:
+        dg = random_graph(n, rng)
+        assert np.array_equal(loop_calc_Ac_full(dg), dg.calc_Ac_full())
+        assert np.allclose(loop_update_AND_weights(dg), vec_update_AND_weights(dg))
+
+        for name, loop_f, vec_f in (
+            ("calc_Ac_full", loop_calc_Ac_full, DepGraph.calc_Ac_full),
+            ("update_AND_weights", loop_update_AND_weights, vec_update_AND_weights),
+        ):
+            loop_t = best_time(lambda: loop_f(dg))
+            vec_t = best_time(lambda: vec_f(dg))
+            print(f"{n:>5} {name:<20} {1e3 * loop_t:>10.2f} {1e3 * vec_t:>11.3f} {loop_t / vec_t:>7.0f}x")
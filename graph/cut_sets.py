@@ -0,0 +1,201 @@
+# @file cut_sets.py
+# @author Evan Brody
+# @brief Enumerates the minimal cut sets behind each vertex's total risk
+
+import os, sys
+import numpy as np
+from collections import ChainMap
+from collections.abc import Hashable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph.dep_graph import DepGraph
+
+# A set of basic events that together make a vertex fail: components
+# failing directly, and failures crossing edges of weight below 1.
+# Edges of weight 1 always carry failures, so they never appear
+class CutSet:
+    def __init__(self, vertices: tuple[Hashable], edges: tuple[tuple[Hashable]], probability: float) -> None:
+        self.vertices = vertices
+        self.edges = edges
+        # Probability that every event in the set happens
+        self.probability = probability
+
+    def __len__(self) -> int:
+        return len(self.vertices) + len(self.edges)
+
+    def __repr__(self) -> str:
+        events = [repr(v) for v in self.vertices] + [f"{a!r}->{b!r}" for a, b in self.edges]
+        return f"CutSet({{{', '.join(events)}}}, p={self.probability:.6g})"
+
+# MOCUS-style enumeration over the model graph/monte_carlo.py samples
+# from: each vertex's failure is expanded top-down into the failures
+# of the vertices upstream of it, ORing over the in-edges of components,
+# ANDing over the in-edges of AND gates, and taking every k in-edges
+# of k-of-n gates. Each vertex's cut sets
+# are memoized, so shared subtrees are only expanded once.
+# Cut sets less likely than cutoff or with more than max_order events
+# are pruned as soon as they appear. Adding events can only make a
+# set less likely and larger, so nothing pruned could have come back
+class CutSetEngine:
+    def __init__(self, dg: DepGraph, cutoff: float=0.0, max_order: int=None) -> None:
+        n = dg.n
+        self.n = n
+        self.refi = dict(dg.refi)
+        self.iref = dg.iref[:n].copy()
+        self.is_AND = dg.is_AND[:n].copy()
+        self.vote_k = dg.vote_k[:n].copy()
+        self.is_component = np.logical_and(dg.active[:n], np.logical_not(self.is_AND))
+        self.cutoff = cutoff
+        self.max_order = max_order
+
+        # Edges a -> b, sorted by b so each vertex's in-edges are contiguous
+        b, a, w = dg.storage.edge_coo(n)
+        order = np.argsort(b, kind="stable")
+        self.src, self.dst, self.weight = a[order], b[order], w[order]
+        self.in_start = np.searchsorted(self.dst, np.arange(n + 1))
+
+        # Basic events are bits of an int, so a cut set is a bitmask
+        self.vertex_bit = np.zeros(n, object)
+        self.edge_bit = np.zeros(len(self.weight), object)
+        self.event_prob = []
+        self.event_ref = []
+        for v in np.flatnonzero(self.is_component):
+            self.vertex_bit[v] = 1 << len(self.event_prob)
+            self.event_prob.append(float(dg.r0[v]))
+            self.event_ref.append((True, self.iref[v]))
+        for e in np.flatnonzero(self.weight < 1):
+            self.edge_bit[e] = 1 << len(self.event_prob)
+            self.event_prob.append(float(self.weight[e]))
+            self.event_ref.append((False, (self.iref[self.src[e]], self.iref[self.dst[e]])))
+
+        # Vertex index to its minimal cut sets, as (mask, probability) pairs
+        self.memo = {}
+
+    def mask_prob(self, mask: int) -> float:
+        p = 1.0
+        while mask:
+            low = mask & -mask
+            p *= self.event_prob[low.bit_length() - 1]
+            mask ^= low
+        return p
+
+    # Drops pruned and non-minimal sets from cuts
+    def minimize(self, cuts: list[tuple[int, float]]) -> list[tuple[int, float]]:
+        kept = []
+        for mask, p in sorted(set(cuts), key=lambda cut: (cut[0].bit_count(), cut[0])):
+            if p < self.cutoff or (self.max_order is not None and mask.bit_count() > self.max_order):
+                continue
+            if not any(k & mask == k for k, _ in kept):
+                kept.append((mask, p))
+        return kept
+
+    # Minimal cut sets of both a and b happening
+    def and_cuts(self, a: list[tuple[int, float]], b: list[tuple[int, float]]) -> list[tuple[int, float]]:
+        cuts = []
+        for mask_a, _ in a:
+            for mask_b, p_b in b:
+                mask = mask_a | mask_b
+                cuts.append((mask, self.mask_prob(mask)))
+        return self.minimize(cuts)
+
+    # Minimal cut sets of v, given the current cut sets of the vertices
+    # upstream of it
+    def vertex_cuts(self, v: int, cuts: dict) -> list[tuple[int, float]]:
+        terms = []
+        for e in range(self.in_start[v], self.in_start[v + 1]):
+            term = cuts[self.src[e]]
+            if self.edge_bit[e]:
+                term = self.and_cuts(term, [(self.edge_bit[e], self.mask_prob(self.edge_bit[e]))])
+            terms.append(term)
+
+        if self.vote_k[v]:
+            # at_least[c] holds the cut sets for c of the terms so far
+            at_least = [[(0, 1.0)]] + [[] for _ in range(self.vote_k[v])]
+            for term in terms:
+                for c in range(self.vote_k[v], 0, -1):
+                    at_least[c] = self.minimize(at_least[c] + self.and_cuts(term, at_least[c - 1]))
+            return at_least[-1]
+
+        if self.is_AND[v]:
+            res = terms[0] if terms else []
+            for term in terms[1:]:
+                res = self.and_cuts(res, term)
+            return res
+
+        res = [cut for term in terms for cut in term]
+        if self.vertex_bit[v]:
+            res.append((self.vertex_bit[v], self.mask_prob(self.vertex_bit[v])))
+        return self.minimize(res)
+
+    # Fills in self.memo for v and every vertex upstream of it. The
+    # vertices not memoized yet are found top-down from v, then
+    # solved sources first. With cycles, cut sets are the least fixed
+    # point, reached by sweeping until nothing changes
+    def expand(self, v: int) -> None:
+        if v in self.memo:
+            return
+
+        # Depth-first, each vertex after everything upstream of it
+        # where the graph allows
+        order = []
+        seen = {v}
+        stack = [(v, self.in_start[v])]
+        while stack:
+            u, e = stack.pop()
+            if e == self.in_start[u + 1]:
+                order.append(u)
+                continue
+
+            stack.append((u, e + 1))
+            w = self.src[e]
+            if w not in self.memo and w not in seen:
+                seen.add(w)
+                stack.append((w, self.in_start[w]))
+
+        cuts = ChainMap({ u : [] for u in order }, self.memo)
+        changed = True
+        while changed:
+            changed = False
+            for u in order:
+                new = self.vertex_cuts(u, cuts)
+                if new != cuts[u]:
+                    cuts[u] = new
+                    changed = True
+
+        self.memo.update(cuts.maps[0])
+
+    def to_cut_set(self, mask: int, p: float) -> CutSet:
+        vertices, edges = [], []
+        while mask:
+            low = mask & -mask
+            is_vertex, ref = self.event_ref[low.bit_length() - 1]
+            (vertices if is_vertex else edges).append(ref)
+            mask ^= low
+        return CutSet(tuple(vertices), tuple(edges), p)
+
+    # Minimal cut sets of ref, most likely first
+    def cut_sets(self, ref: Hashable) -> list[CutSet]:
+        v = self.refi[ref]
+        self.expand(v)
+        cuts = sorted(self.memo[v], key=lambda cut: (-cut[1], cut[0].bit_count()))
+        return [self.to_cut_set(mask, p) for mask, p in cuts]
+
+    # Maps components to their minimal cut sets, like DepGraph.get_r_dict
+    def get_cut_sets_dict(self) -> dict:
+        return { self.iref[i] : self.cut_sets(self.iref[i]) for i in np.flatnonzero(self.is_component) }
+
+if __name__ == "__main__":
+    # 'out' fails if it fails directly or both 'a' and 'b' do, and
+    # 's' can take down both
+    dg = DepGraph()
+    dg.add_vertices(['s', 'a', 'b', 'out'], [0.5, 0.1, 0.2, 0.01])
+    dg.add_AND_gate('AND')
+    dg.add_edges([('s', 'a'), ('s', 'b'), ('a', 'AND'), ('b', 'AND'), ('AND', 'out')], [0.5, 1, 1, 1, 1])
+
+    for cut in CutSetEngine(dg).cut_sets('out'):
+        print(cut)
+
+    print("\ncutoff=0.02:")
+    for cut in CutSetEngine(dg, cutoff=0.02).cut_sets('out'):
+        print(cut)
@@ -1,201 +1,607 @@
 # @file dep_graph.py
 # @author Evan Brody
 # @brief Provides backend graph functionality for dependency analysis
+# Vertices can be any hashable key. This module doesn't depend on Qt,
+# see DepQGraph in gui.py for the adapter the GUI uses
 
+import os, sys, zipfile, zlib
 import numpy as np
-from itertools import chain, compress, product
-from PyQt5.QtWidgets import QGraphicsRectItem
+from collections.abc import Hashable
+from itertools import compress
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph.storage import DenseStorage, SparseStorage, scl_or_scl, or_inv
 
 class DepGraph:
-    MAX_VERTICES = 512
+    # Per-vertex storage starts this large and doubles as needed
+    INITIAL_CAPACITY = 16
+    # delete_vertices shrinks storage to fit once fewer than this
+    # fraction of the capacity is in use. None disables shrinking
+    SHRINK_BELOW = 0.25
+    # Deleted vertices leave free slots behind, which are compacted
+    # away once they make up more than this fraction of the n slots
+    COMPACT_ABOVE = 0.25
     DEFAULT_EDGE_WEIGHT = 1
     DEFAULT_DR = 0.25
-    J = np.ones((MAX_VERTICES, MAX_VERTICES), np.uint8)
-    I = np.identity(MAX_VERTICES, np.uint8)
 
-    def __init__(self) -> None:
-        self.refi = {} # Maps QGraphicsRectItems to indices
-        self.iref = np.empty((self.MAX_VERTICES,), QGraphicsRectItem) # Maps indices to QGraphicsRectItems
-
-        # How many vertices we have
+    # With storage="auto", graphs this large switch to SparseStorage
+    # when fewer than SPARSE_BELOW of their vertex pairs are connected,
+    # and back to DenseStorage when more than DENSE_ABOVE are
+    SPARSE_MIN_VERTICES = 1024
+    SPARSE_BELOW = 0.02
+    DENSE_ABOVE = 0.08
+
+    # mat_or_mat evaluates operands this small with the exact stacked path
+    OR_STACK_MAX_N = 64
+    # Most terms the stacked path holds in memory at once
+    OR_STACK_MAX_ELEMS = 1 << 22
+    # Truncation error allowed in the series path of mat_or_mat
+    OR_SERIES_TOL = 1e-13
+    OR_SERIES_MAX_TERMS = 48
+    # calc_r recomputes everything once more than this fraction of
+    # the rows would need updating
+    RECALC_ALL_ABOVE = 0.5
+    # Whether acyclic graphs are evaluated by a forward sweep instead
+    # of through the closure, see calc_r_sweep. The sweep is a separate
+    # risk model and gives different risks than the closure, so this is
+    # opt-in. It only applies while the whole graph is acyclic, so
+    # adding a cycle anywhere switches every risk back to the closure
+    SWEEP_DAGS = False
+
+    # storage is "dense", "sparse" or "auto", see SPARSE_MIN_VERTICES
+    def __init__(self, capacity: int=INITIAL_CAPACITY, storage: str="auto") -> None:
+        self.refi = {} # Maps vertex keys to indices
+        self.iref = np.empty((capacity,), object) # Maps indices to vertex keys
+
+        # How many slots are in use, including free ones. Indices
+        # stay stable until compact() runs
         self.n = 0
+        # self.active[i] stores whether slot i holds a vertex.
+        # Free slots have no edges, paths or direct risk
+        self.active = np.zeros((capacity,), bool)
+        # Free slots below n, reused before n grows
+        self.free = []
+        # How many vertices we have room for
+        self.capacity = capacity
         # Direct risk vector
-        self.r0 = np.empty((self.MAX_VERTICES,), np.double)
+        self.r0 = np.zeros((capacity,), np.double)
         # Full risk vector
-        self.r = np.empty((self.MAX_VERTICES,), np.double)
-        # self.is_AND[i] stores whether vi is an AND gate
-        self.is_AND = np.empty((self.MAX_VERTICES,), bool)
-        # Adjacency matrix
-        self.A = np.empty((self.MAX_VERTICES, self.MAX_VERTICES), np.double)
-        # Transitive closure of A
-        self.A_collapse = np.empty((self.MAX_VERTICES, self.MAX_VERTICES), np.double)
-        # [i, j] = Count of paths j -> i with weight = 1
-        # Probably doesn't need to be 64-bit but that can be figured out later
-        self.one_count = np.empty((self.MAX_VERTICES, self.MAX_VERTICES), np.uint64)
+        self.r = np.zeros((capacity,), np.double)
+        # self.is_AND[i] stores whether vi is a gate, AND or k-of-n
+        self.is_AND = np.zeros((capacity,), bool)
+        # self.vote_k[i] is k if vi is a k-of-n gate, which fails if k
+        # or more of its inputs do, and 0 otherwise. An AND gate with
+        # n inputs is an n-of-n gate
+        self.vote_k = np.zeros((capacity,), int)
+        # While the graph is acyclic, a -> b implies
+        # topo_rank[a] < topo_rank[b]. acyclic is None when
+        # edges were deleted from a cyclic graph, so it's unknown
+        self.topo_rank = np.zeros((capacity,), np.int64)
+        self.next_rank = 0
+        self.acyclic = True
+        # Adjacency matrix A, its transitive closure A_collapse,
+        # and one_count, see storage.py
+        self.storage_kind = storage
+        if "sparse" == storage or ("auto" == storage and capacity >= self.SPARSE_MIN_VERTICES):
+            self.storage = SparseStorage()
+        else:
+            self.storage = DenseStorage(capacity)
+        # Snapshots still reading self.storage. While there are any,
+        # storage is copied before it changes, see own_storage
+        self.storage_readers = set()
+
+        # Created on first use, see the J and I properties
+        self._J = None
+        self._I = None
+
+        # Bumped by every change to the graph, see invalidate
+        self.version = 0
+        # Vertices whose direct risk changed since self.r was computed,
+        # or None if anything else changed
+        self.dirty = None
+        # Versions that self.r and self.r_dict were computed at
+        self.r_version = None
+        self.r_dict = None
+        self.r_dict_version = None
+        # Levels for calc_r_sweep, rebuilt when the edges change
+        self.sweep_plan = None
+
+    # Matrix of ones, at least as large as the graph
+    @property
+    def J(self) -> np.ndarray:
+        if self._J is None or len(self._J) < self.n:
+            self._J = np.ones((self.capacity, self.capacity), np.uint8)
+        return self._J
+
+    # Identity matrix, at least as large as the graph
+    @property
+    def I(self) -> np.ndarray:
+        if self._I is None or len(self._I) < self.n:
+            self._I = np.identity(self.capacity, np.uint8)
+        return self._I
+
+    # Adjacency matrix, [b, a] = weight of a -> b
+    # With sparse storage this is a dense copy, for inspection only
+    @property
+    def A(self) -> np.ndarray:
+        return self.storage.dense("A", self.n)
+
+    # Transitive closure of A
+    @property
+    def A_collapse(self) -> np.ndarray:
+        return self.storage.dense("A_collapse", self.n)
+
+    # [i, j] = Count of paths j -> i with weight = 1
+    @property
+    def one_count(self) -> np.ndarray:
+        return self.storage.dense("one_count", self.n)
+
+    # Moves the graph to DenseStorage ("dense") or SparseStorage ("sparse")
+    def set_storage(self, kind: str) -> None:
+        if kind == ("sparse" if self.storage.sparse else "dense"):
+            return
+
+        new_storage = SparseStorage() if "sparse" == kind else DenseStorage(self.capacity)
+        new_storage.load(self.storage.export(self.n))
+        self.storage = new_storage
+        self.storage_readers = set()
+
+    # Gives the graph its own copy of storage if a snapshot still
+    # reads it. Called before anything changes storage
+    def own_storage(self) -> None:
+        if not self.storage_readers:
+            return
+
+        storage = SparseStorage() if self.storage.sparse else DenseStorage(self.capacity)
+        storage.load(self.storage.export(self.n))
+        self.storage = storage
+        self.storage_readers = set()
+
+    # Picks a backend by density when storage="auto"
+    # size is how many vertices to plan for, by default n
+    def check_storage(self, size: int=None) -> None:
+        if "auto" != self.storage_kind:
+            return
+
+        n = size or self.n
+        if n < self.SPARSE_MIN_VERTICES:
+            self.set_storage("dense")
+            return
+
+        density = self.storage.nnz(self.n) / (n * n)
+        if self.storage.sparse and density > self.DENSE_ABOVE:
+            self.set_storage("dense")
+        elif not self.storage.sparse and density < self.SPARSE_BELOW:
+            self.set_storage("sparse")
+
+    # Reallocates per-vertex storage to hold capacity vertices,
+    # keeping the first n
+    def resize(self, capacity: int) -> None:
+        n = self.n
+        if capacity < n:
+            raise ValueError(f"Capacity {capacity} can't hold {n} vertices")
+
+        def resized(old: np.ndarray) -> np.ndarray:
+            new = np.zeros((capacity,) * old.ndim, old.dtype)
+            keep = min(n, len(old))
+            new[(slice(keep),) * old.ndim] = old[(slice(keep),) * old.ndim]
+            return new
+
+        self.iref = resized(self.iref)
+        self.r0 = resized(self.r0)
+        self.r = resized(self.r)
+        self.is_AND = resized(self.is_AND)
+        self.vote_k = resized(self.vote_k)
+        self.topo_rank = resized(self.topo_rank)
+        self.active = resized(self.active)
+        self.capacity = capacity
+
+        # Switch backends before resizing, in case we'd be
+        # resizing dense storage that's about to be dropped
+        self.check_storage(capacity)
+        self.own_storage()
+        self.storage.resize(capacity, n)
+
+        self._J = None
+        self._I = None
+
+    # Makes room for size vertices, doubling capacity as needed
+    def reserve(self, size: int) -> None:
+        if size <= self.capacity:
+            return
+
+        capacity = max(self.capacity, 1)
+        while capacity < size:
+            capacity *= 2
+        self.resize(capacity)
+
+    # Number of vertices, not counting free slots
+    @property
+    def n_vertices(self) -> int:
+        return len(self.refi)
+
+    # Takes d slots for new vertices, reusing free ones first
+    def take_slots(self, d: int) -> np.ndarray:
+        reused = [self.free.pop() for _ in range(min(d, len(self.free)))]
+
+        n = self.n
+        k = d - len(reused)
+        self.reserve(n + k)
+        self.own_storage()
+        self.storage.clear(n, n + k)
+        # Reused slots start out as empty as new ones
+        if reused:
+            self.storage.clear_slots(np.array(reused, int))
+        self.n += k
+
+        slots = np.array(reused + list(range(n, n + k)), int)
+        # New vertices have no edges, so they can go last
+        self.topo_rank[slots] = self.next_rank + np.arange(d)
+        self.next_rank += d
+        return slots
+
+    # Moves every vertex down into the lowest slots, dropping free ones.
+    # This renumbers vertices, so it only runs between operations
+    def compact(self) -> None:
+        n = self.n
+        keep = np.flatnonzero(self.active[:n])
+        m = len(keep)
+        if m == n:
+            return
+
+        self.own_storage()
+        self.storage.compact(keep, n)
+        for arr in (self.iref, self.r0, self.is_AND, self.vote_k, self.topo_rank, self.active):
+            arr[:m] = arr[keep]
+            arr[m:n] = arr.dtype.type(0) if arr.dtype != object else None
+
+        self.refi = { ref: i for i, ref in enumerate(self.iref[:m]) }
+        self.n = m
+        self.free = []
+        self.invalidate()
+
+    # Compacts once free slots pass COMPACT_ABOVE of n
+    def check_compact(self) -> None:
+        if len(self.free) > self.COMPACT_ABOVE * self.n:
+            self.compact()
+
+    # Shrinks storage to the smallest power-of-two multiple
+    # of INITIAL_CAPACITY that holds the graph
+    def shrink_to_fit(self) -> None:
+        capacity = self.INITIAL_CAPACITY
+        while capacity < self.n:
+            capacity *= 2
+        if capacity < self.capacity:
+            self.resize(capacity)
 
     # P(a U b)
     def scl_or_scl(self, a: float, b: float) -> float:
-        return 1 - (1 - a) * (1 - b)
+        return scl_or_scl(a, b)
     
     # a is the probability of OR{b, ...}
     # b is the event to remove
     def or_inv(self, a: float, b: float) -> float:
-        return (a - b) / (1 - b)
+        return or_inv(a, b)
     
     def vec_or_vec(self, v1: np.ndarray, v2: np.ndarray) -> np.ndarray:
         n = self.n
         return self.J[0, :n] - np.multiply(self.J[0, :n] - v1, self.J[0, :n] - v2)
 
+    # [i] = P(OR_j {a[i, j] AND v[j]})
+    # Computed as a sum of log1p(-a[i, j] * v[j]), which is exact for
+    # small probabilities where 1 - prod(1 - ...) cancels badly.
+    # Rows containing a certain event (a[i, j] * v[j] = 1) are exactly 1
     def mat_or_vec(self, a: np.ndarray, v: np.ndarray) -> np.ndarray:
-        lenv = len(v)
-        return self.J[0, :lenv] - np.prod(self.J[:lenv, :lenv] - np.multiply(a, v), axis=1)
+        terms = np.multiply(a, v)
+        certain = 1 == terms
+        terms[certain] = 0
 
-    def mat_or_mat(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        res = -np.expm1(np.sum(np.log1p(-terms), axis=1))
+        res[np.any(certain, axis=1)] = 1
+        return res
+
+    # mat_or_vec for an n x n matrix given by its nonzero entries
+    # a[rows[k], cols[k]] = vals[k]. Costs O(len(vals)) instead of O(n^2)
+    def coo_or_vec(self, rows: np.ndarray, cols: np.ndarray, vals: np.ndarray, v: np.ndarray) -> np.ndarray:
+        n = len(v)
+        terms = vals * v[cols]
+        certain = 1 == terms
+        terms[certain] = 0
+
+        res = -np.expm1(np.bincount(rows, np.log1p(-terms), n))
+        res[np.bincount(rows, certain, n) > 0] = 1
+        return res
+
+    # [i, j] = P(OR_k {a[i, k] AND b[k, j]}), exactly, by broadcasting
+    # a 3-D stack of terms. Rows of a are processed in chunks so the
+    # stack never holds more than OR_STACK_MAX_ELEMS terms
+    def mat_or_mat_stacked(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
         res = np.empty((a.shape[0], b.shape[1]), np.double)
-        
-        for i, j in product(range(a.shape[0]), range(b.shape[1])):
-            res[i, j] = 1 - np.prod(self.J[0, :a.shape[1]] - np.multiply(a[i], b.T[j]))
-        
+        chunk = max(1, self.OR_STACK_MAX_ELEMS // max(1, b.size))
+        for start in range(0, a.shape[0], chunk):
+            stack = np.multiply(a[start:start + chunk, :, np.newaxis], b[np.newaxis, :, :])
+            res[start:start + chunk] = 1 - np.prod(1 - stack, axis=1)
+
+        return res
+
+    # [i, j] = P(OR_k {a[i, k] AND b[k, j]})
+    # Small operands go through mat_or_mat_stacked. Otherwise the sum over
+    # k of log1p(-a[i, k] * b[k, j]) is split by which factors equal 1:
+    #   a = 1, b = 1: the entry is certain, so it's exactly 1
+    #   a = 1, b < 1: (a == 1) @ log1p(-b)
+    #   a < 1, b = 1: log1p(-a) @ (b == 1)
+    #   a < 1, b < 1: -sum_m (a^m @ b^m) / m, the series for log1p
+    # so every part is a BLAS matrix product. The series is truncated once
+    # its tail is below OR_SERIES_TOL; if that takes more than
+    # OR_SERIES_MAX_TERMS terms we fall back to the stacked path
+    def mat_or_mat(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        a = np.asarray(a, np.double)
+        b = np.asarray(b, np.double)
+        if max(a.shape[0], a.shape[1], b.shape[1]) <= self.OR_STACK_MAX_N:
+            return self.mat_or_mat_stacked(a, b)
+
+        a_one = (1 == a).astype(np.double)
+        b_one = (1 == b).astype(np.double)
+        a_frac = np.where(a_one, 0, a)
+        b_frac = np.where(b_one, 0, b)
+
+        # Largest term in the series, and the number of terms needed
+        # to bring sum_k sum_{m > M} rho^m / m below tolerance
+        rho = a_frac.max(initial=0) * b_frac.max(initial=0)
+        terms = 0
+        if rho > 0:
+            tail = a.shape[1] * rho / (1 - rho)
+            while tail > self.OR_SERIES_TOL:
+                terms += 1
+                if terms > self.OR_SERIES_MAX_TERMS:
+                    return self.mat_or_mat_stacked(a, b)
+                tail *= rho * terms / (terms + 1)
+
+        # The parts with factors equal to 1 are skipped when there are none,
+        # which is the usual case for b when it's a batch of direct risks
+        a_has_one, b_has_one = np.any(a_one), np.any(b_one)
+        log_res = np.zeros((a.shape[0], b.shape[1]), np.double)
+        if a_has_one:
+            log_res += a_one @ np.log1p(-b_frac)
+        if b_has_one:
+            log_res += np.log1p(-a_frac) @ b_one
+
+        # 1 / m goes on the a side, which is usually the smaller one
+        a_pow, b_pow = a_frac.copy(), b_frac.copy()
+        for m in range(1, terms + 1):
+            log_res -= (a_pow / m) @ b_pow
+            if m < terms:
+                a_pow *= a_frac
+                b_pow *= b_frac
+
+        res = -np.expm1(log_res)
+        if a_has_one and b_has_one:
+            res[(a_one @ b_one) > 0] = 1
         return res
     
+    # [i, j] = max(A_collapse[i, j], 1 if one_count[i, j] else 0)
     def calc_Ac_full(self) -> np.ndarray:
-        n = self.n
-        Ac_full = np.empty((n, n), np.double)
-        for i, j in product(range(n), repeat=2):
-            Ac_full[i, j] = max(self.A_collapse[i, j], int(bool(self.one_count[i, j])))
-        
-        return Ac_full
+        return self.storage.Ac_full_rows(np.arange(self.n), self.n)
     
-    def add_vertices(self, refs: list[QGraphicsRectItem], direct_risks: list[float]=None) -> None:
-        n = self.n
-        d = len(refs)
-
-        for i, ref in enumerate(refs):
-            self.refi[ref] = n + i
-            self.iref[n + i] = ref
+    def add_vertices(self, refs: list[Hashable], direct_risks: list[float]=None) -> None:
+        slots = self.take_slots(len(refs))
+        for vi, ref in zip(slots, refs):
+            self.refi[ref] = vi
+            self.iref[vi] = ref
 
         if direct_risks:
-            self.r0[n:n + d] = direct_risks
+            self.r0[slots] = direct_risks
         else:
-            self.r0[n:n + d] = self.DEFAULT_DR
-
-        self.is_AND[n:n + d] = False
-
-        self.A[n:n + d, :n + d] = 0
-        self.A[:n, n:n + d] = 0
-
-        self.A_collapse[n:n + d, :n + d] = 0
-        self.A_collapse[:n, n:n + d] = 0
-
-        self.one_count[n:n + d, :n + d] = 0
-        self.one_count[:n, n:n + d] = 0
-
-        self.n += d
-
-    def add_vertex(self, ref: QGraphicsRectItem, direct_risk: float=DEFAULT_DR) -> None:
+            self.r0[slots] = self.DEFAULT_DR
+
+        self.is_AND[slots] = False
+        self.vote_k[slots] = 0
+        self.active[slots] = True
+        self.invalidate()
+
+    def add_vertex(self, ref: Hashable, direct_risk: float=DEFAULT_DR) -> None:
+        vi = self.take_slots(1)[0]
+        self.refi[ref] = vi
+        self.iref[vi] = ref
+
+        self.r0[vi] = direct_risk
+        self.is_AND[vi] = False
+        self.vote_k[vi] = 0
+        self.active[vi] = True
+        self.invalidate()
+
+    def add_AND_gate(self, ref: Hashable) -> None:
+        vi = self.take_slots(1)[0]
+        self.refi[ref] = vi
+        self.iref[vi] = ref
+
+        self.r0[vi] = 0
+        self.is_AND[vi] = True
+        self.vote_k[vi] = 0
+        self.active[vi] = True
+        self.invalidate()
+
+    # A gate that fails once k or more of its inputs fail
+    def add_vote_gate(self, ref: Hashable, k: int) -> None:
+        if k < 1:
+            raise ValueError(f"A k-of-n gate needs k >= 1, not {k}")
+
+        self.add_AND_gate(ref)
+        self.vote_k[self.refi[ref]] = k
+
+    # Marks the risk vector stale. If vi is given, only its direct
+    # risk changed and calc_r can update the rows it reaches.
+    # Otherwise everything is recomputed
+    def invalidate(self, vi: int=None) -> None:
+        self.version += 1
+        if vi is None:
+            self.dirty = None
+            self.sweep_plan = None
+        elif self.dirty is not None:
+            self.dirty.add(vi)
+
+    # Vertices reachable from v along out-edges, or along in-edges if
+    # not forward, without passing a vertex ranked past bound
+    def reach(self, v: int, bound: int, forward: bool) -> list[int]:
         n = self.n
-        self.refi[ref] = n
-        self.iref[n] = ref
-
-        self.r0[n] = direct_risk
-        self.is_AND[n] = False
-
-        self.A[n, :n + 1] = 0
-        self.A[:n, n] = 0
-
-        self.A_collapse[n, :n + 1] = 0
-        self.A_collapse[:n, n] = 0
+        seen = {v}
+        stack = [v]
+        while stack:
+            u = stack.pop()
+            for w in (self.storage.out_edges(u, n) if forward else self.storage.in_edges(u, n)).tolist():
+                in_bound = self.topo_rank[w] <= bound if forward else self.topo_rank[w] >= bound
+                if in_bound and w not in seen:
+                    seen.add(w)
+                    stack.append(w)
+        return list(seen)
+
+    # Keeps topo_rank a topological order after a -> b is added, or
+    # marks the graph cyclic. Only vertices ranked between b and a
+    # are visited, and only they are reranked, reusing their own ranks
+    # (Pearce and Kelly's dynamic topological sort). Only the sweep
+    # needs the order, so with SWEEP_DAGS off it's just marked unknown
+    # and is_acyclic rebuilds it if anything asks
+    def order_edge(self, a: int, b: int) -> None:
+        if not self.SWEEP_DAGS and self.acyclic:
+            self.acyclic = None
+        if not self.acyclic:
+            return
 
-        self.one_count[n, :n + 1] = 0
-        self.one_count[:n, n] = 0
+        lo, hi = self.topo_rank[b], self.topo_rank[a]
+        if hi < lo:
+            return
 
-        self.n += 1
+        forward = self.reach(b, hi, True)
+        if a in forward:
+            self.acyclic = False
+            return
 
-    def add_AND_gate(self, ref: QGraphicsRectItem) -> None:
+        backward = self.reach(a, lo, False)
+        moved = sorted(backward, key=self.topo_rank.__getitem__) + sorted(forward, key=self.topo_rank.__getitem__)
+        self.topo_rank[moved] = np.sort(self.topo_rank[moved])
+
+    # Called when an edge is deleted. A cyclic graph might not be anymore
+    def unorder_edge(self) -> None:
+        if self.acyclic is False:
+            self.acyclic = None
+
+    # Whether the graph has no cycles. If that's unknown, finds out
+    # and renumbers topo_rank from scratch
+    @property
+    def is_acyclic(self) -> bool:
+        if self.acyclic is None:
+            levels = self.topological_levels()
+            self.acyclic = levels is not None
+            if self.acyclic:
+                order = np.argsort(levels, kind="stable")
+                self.topo_rank[order] = np.arange(self.n)
+                self.next_rank = self.n
+        return self.acyclic
+
+    # Each vertex's level, the length of the longest path into it, or
+    # None if the graph has a cycle. Kahn's algorithm, a level at a time.
+    # edges are (heads, tails, weights) as edge_coo gives them, by
+    # default the graph's own
+    def topological_levels(self, edges: tuple[np.ndarray]=None) -> np.ndarray:
         n = self.n
-        self.refi[ref] = n
-        self.iref[n] = ref
-
-        self.r0[n] = 0
-        self.is_AND[n] = True
-
-        self.A[n, :n + 1] = 0
-        self.A[:n, n] = 0
-
-        self.A_collapse[n, :n + 1] = 0
-        self.A_collapse[:n, n] = 0
-
-        self.n += 1
-
-    # edge is a tuple (a, b) where a -> b
-    def add_edge(self, edge: tuple[QGraphicsRectItem], weight: float=DEFAULT_EDGE_WEIGHT) -> None:
+        b, a, _ = edges if edges is not None else self.storage.edge_coo(n)
+        order = np.argsort(a, kind="stable")
+        a, b = a[order], b[order]
+        out_start = np.searchsorted(a, np.arange(n + 1))
+
+        in_degree = np.bincount(b, minlength=n)
+        levels = np.full(n, -1, np.int64)
+        frontier = np.flatnonzero(0 == in_degree)
+        level = 0
+        while len(frontier):
+            levels[frontier] = level
+            # Out-edges of the frontier, as one index array
+            counts = out_start[frontier + 1] - out_start[frontier]
+            firsts = np.repeat(out_start[frontier] - np.cumsum(counts) + counts, counts)
+            heads = b[firsts + np.arange(counts.sum())]
+            np.subtract.at(in_degree, heads, 1)
+            frontier = np.unique(heads[0 == in_degree[heads]])
+            level += 1
+
+        return levels if np.all(levels >= 0) else None
+
+    # Column j of calc_Ac_full(), without building the whole matrix
+    def calc_Ac_full_col(self, j: int) -> np.ndarray:
+        return self.storage.Ac_full_col(j, self.n)
+
+    # Row i of calc_Ac_full(), without building the whole matrix
+    def calc_Ac_full_row(self, i: int) -> np.ndarray:
+        return self.storage.Ac_full_row(i, self.n)
+
+    # edge is a tuple of integers (a, b) where a -> b
+    def add_edge_i(self, edge: tuple[int], weight: float=DEFAULT_EDGE_WEIGHT) -> None:
         n = self.n
-        a, b = self.refi[edge[0]], self.refi[edge[1]]
-        self.A[b, a] = weight
+        a, b = edge
+        self.invalidate()
+        self.order_edge(a, b)
+        self.own_storage()
+        self.storage.set_edge(b, a, weight)
 
         # Add to A-collapse by combining with existing connections
-        if 1 == weight:
-            self.one_count[b, a] += 1
-        else:
-            self.A_collapse[b, a] = self.scl_or_scl(
-                self.A_collapse[b, a], weight
-            )
+        self.storage.combine_path(b, a, weight)
 
-        Ac_full = self.calc_Ac_full()
+        # Only these slices of calc_Ac_full() are needed below
+        Ac_full_to_a = self.calc_Ac_full_row(a)
+        Ac_full_from_a = self.calc_Ac_full_col(a)
+        Ac_full_from_b = self.calc_Ac_full_col(b)
 
         # Collapse paths starting at a and passing through b
         # If we're dealing with an AND gate as B, we should
         # only collapse paths leading to other AND gates
         # Skip b because we don't care about loops
-        to_update_to = np.copy(self.is_AND[:n]) if self.is_AND[b] else [True] * n
+        to_update_to = np.copy(self.is_AND[:n]) if self.is_AND[b] else np.ones(n, bool)
         to_update_to[b] = False
-        for i in compress(range(n), to_update_to):
-            # When a != AND & b = AND don't incorporate
-            # (b -> i) in (a -> b -> i)_c
-            new_path = weight
-            if not self.is_AND[b] or self.is_AND[a]:
-                new_path *= Ac_full[i, b]
-
-            if 1 == new_path:
-                self.one_count[i, a] += 1
-            else:
-                # a -> i OR (a -> b AND b -> i)
-                self.A_collapse[i, a] = self.scl_or_scl(
-                    self.A_collapse[i, a], new_path
-                )
-
-        # Make sure a doesn't loop on itself
-        self.A_collapse[a, a] = 0
-        self.one_count[a, a] = 0
-        
+        to_update_from = np.zeros(n, bool)
+        to_update_from[a] = True
+
+        # a -> i OR (a -> b AND b -> i)
+        # When a != AND & b = AND don't incorporate
+        # (b -> i) in (a -> b -> i)_c
+        # The storage never writes the diagonal, so a doesn't loop on itself
+        weights = np.zeros(n, np.double)
+        weights[a] = weight
+        through_b = np.full(n, not self.is_AND[b] or self.is_AND[a])
+        self.storage.combine_outer(to_update_to, to_update_from, weights, Ac_full_from_b, through_b)
+
+        # If nothing reaches a yet, there are no other paths through
+        # a to collapse. add_edges_bulk relies on this to build the
+        # closure in a single sweep
+        if not np.any(Ac_full_to_a):
+            if self.storage.sparse:
+                self.check_storage()
+            return
+
         # Collapse other paths that pass through a to b
         # Skip a's and b's columns. A's because we already
         # calculated its values, b's because we don't care
         # about loops
         # If we're dealing with an AND gate as a, we only want to
         # collapse paths of the form (i -> a -> AND)
-        to_update_to = np.copy(self.is_AND[:n]) if self.is_AND[a] else [True] * n
+        to_update_to = np.copy(self.is_AND[:n]) if self.is_AND[a] else np.ones(n, bool)
         to_update_to[a] = False
-        to_update_from = [True] * n
+        to_update_from = np.ones(n, bool)
         to_update_from[a] = False
         to_update_from[b] = False
-        for j in compress(range(n), to_update_from):
-            for i in compress(range(n), to_update_to):
-                # j -> i OR (j -> a AND a -> i)
-                new_path = Ac_full[a, j]
-                if not self.is_AND[a] or self.is_AND[j]:
-                    new_path *= Ac_full[i, a]
-                
-                if 1 == new_path:
-                    self.one_count[i, j] += 1
-                else:
-                    self.A_collapse[i, j] = self.scl_or_scl(self.A_collapse[i, j], new_path)
-
-        # Remove any loops we've created
-        np.fill_diagonal(self.A_collapse[:n, :n], 0)
-        np.fill_diagonal(self.one_count[:n, :n], 0)
+
+        # j -> i OR (j -> a AND a -> i)
+        # (a -> i) is only incorporated when a isn't an AND gate or j is
+        through_a = np.logical_or(not self.is_AND[a], self.is_AND[:n])
+        self.storage.combine_outer(to_update_to, to_update_from, Ac_full_to_a, Ac_full_from_a, through_a)
+
+        if self.storage.sparse:
+            self.check_storage()
+
+    # edge is a tuple (a, b) where a -> b
+    def add_edge(self, edge: tuple[Hashable], weight: float=DEFAULT_EDGE_WEIGHT) -> None:
+        self.add_edge_i((self.refi[edge[0]], self.refi[edge[1]]), weight)
     
-    def add_edges(self, edges: list[tuple[QGraphicsRectItem]], weights: list[float]=None) -> None:
+    def add_edges(self, edges: list[tuple[Hashable]], weights: list[float]=None) -> None:
         if None == weights:
             for e in edges:
                 self.add_edge(e)
@@ -203,76 +609,137 @@ class DepGraph:
             for e, w in zip(edges, weights):
                 self.add_edge(e, w)
 
+    # Adds many edges with a single sweep over the closure.
+    # Edges are added sinks first, in reverse topological order of
+    # their sources, so each source's column of the closure is built
+    # once from its finished successors and no paths through it need
+    # collapsing. The result is exactly what add_edges gives for the
+    # edges in that order. Edges on cycles are added last, falling back
+    # to the full incremental update where it's needed
+    def add_edges_bulk(self, edges: list[tuple[Hashable]], weights: list[float]=None) -> None:
+        if None == weights:
+            weights = [self.DEFAULT_EDGE_WEIGHT] * len(edges)
+
+        edges_i = [(self.refi[a], self.refi[b]) for a, b in edges]
+        for k in self.bulk_edge_order(edges_i):
+            self.add_edge_i(edges_i[k], weights[k])
+
+    # Positions in edges_i, sorted so sources come in reverse topological
+    # order of the graph the edges form. Within one source, the input
+    # order is kept
+    def bulk_edge_order(self, edges_i: list[tuple[int]]) -> list[int]:
+        out_edges = {}
+        in_degree = {}
+        for k, (a, b) in enumerate(edges_i):
+            out_edges.setdefault(a, []).append(k)
+            in_degree[b] = in_degree.get(b, 0) + 1
+
+        # Kahn's algorithm, then reversed. Anything left over is on a cycle
+        ready = [v for v in out_edges if v not in in_degree]
+        topo = []
+        while ready:
+            v = ready.pop()
+            topo.append(v)
+            for k in out_edges.get(v, ()):
+                b = edges_i[k][1]
+                in_degree[b] -= 1
+                if 0 == in_degree[b]:
+                    ready.append(b)
+
+        placed = set(topo)
+        sources = [v for v in reversed(topo) if v in out_edges]
+        sources += [v for v in out_edges if v not in placed]
+        return [k for v in sources for k in out_edges[v]]
+
+    # Builds a graph in one go. and_flags marks which vertices are AND gates
+    @classmethod
+    def build(cls, vertices: list[Hashable],
+              edges: list[tuple[Hashable]],
+              weights: list[float]=None,
+              and_flags: list[bool]=None,
+              direct_risks: list[float]=None,
+              storage: str="auto") -> "DepGraph":
+        capacity = cls.INITIAL_CAPACITY
+        while capacity < len(vertices):
+            capacity *= 2
+
+        dg = cls(capacity, storage)
+        dg.add_vertices(vertices, direct_risks)
+        if and_flags is not None:
+            is_AND = np.asarray(and_flags, bool)
+            dg.is_AND[:dg.n] = is_AND
+            dg.r0[:dg.n][is_AND] = 0
+            dg.invalidate()
+
+        dg.add_edges_bulk(edges, weights)
+        return dg
+
     # edge is a tuple of integers (a, b) where (a -> b)
     def update_edge_i(self, edge: tuple[int], new_weight: float) -> None:
         n = self.n
         a, b = edge
 
-        # We need to add the identity matrix so our calculations
-        # for broken_path_weight are accurate when i or j = a or b
-        Ac_full = self.I[:n, :n] + self.calc_Ac_full()
-        old_weight = Ac_full[b, a]
+        old_weight = self.storage.Ac_full_entry(b, a)
         if old_weight == new_weight:
             return
-        self.A[b, a] = new_weight
+        self.invalidate()
+        if 0 == new_weight:
+            self.unorder_edge()
+        elif 0 == self.storage.get_edge(b, a):
+            self.order_edge(a, b)
+        self.own_storage()
+        self.storage.set_edge(b, a, new_weight)
 
         # Handle the edge itself directly if a is an AND gate
-        # In all other cases, this is handled in the for-loop below
+        # In all other cases, this is handled by the block updates below
         if self.is_AND[a]:
-            if 1 == old_weight:
-                self.one_count[b, a] -= 1
-            else:
-                self.A_collapse[b, a] = self.or_inv(
-                    self.A_collapse[b, a], old_weight
-                )
-            
-            if 1 == new_weight:
-                self.one_count[b, a] += 1
-            else:
-                self.A_collapse[b, a] = self.scl_or_scl(
-                    self.A_collapse[b, a], new_weight
-                )
+            self.storage.remove_path(b, a, old_weight)
+            self.storage.combine_path(b, a, new_weight)
+
+        # We need to add the identity so our calculations
+        # for broken paths are accurate when i or j = a or b
+        Ac_full_to_a = self.calc_Ac_full_row(a)
+        Ac_full_to_a[a] += 1
+        Ac_full_from_b = self.calc_Ac_full_col(b)
+        Ac_full_from_b[b] += 1
         
         # Remove influence of deleted edge on other paths
         # then add influence of new edge weight
         # Skip diagonal because we don't allow those edges
         # If the edge involves an AND gate, we should only update
         # connections through it to other AND gates
-        to_update_to = self.is_AND[:n] if self.is_AND[a] or self.is_AND[b] else [True] * n
-        rangen = range(n)
-        for i, j in filter(lambda t: t[0] != t[1], product(rangen, compress(rangen, to_update_to))):
-            # (i -> a) AND (a -> b) AND (b -> j)
-            # Note that (a -> b) is not all possible paths (a -> b),
-            # but the specific edge we're updating
-            broken_path_weight = Ac_full[a, i] * old_weight * Ac_full[j, b]
-            # Remove influence of (a -> b) on (i -> j)
-            if 1 == broken_path_weight:
-                self.one_count[j, i] -= 1
-            else:
-                self.A_collapse[j, i] = self.or_inv(
-                    self.A_collapse[j, i], broken_path_weight
-                )
-
-            # Add influence of new weight
-            if 1 == new_weight:
-                self.one_count[j, i] += 1
-            else:
-                self.A_collapse[j, i] = self.scl_or_scl(
-                    self.A_collapse[j, i], new_weight
-                )
+        # Free slots are left out, so they never pick up paths
+        active = self.active[:n]
+        to_update_to = np.logical_and(self.is_AND[:n] if self.is_AND[a] or self.is_AND[b] else True, active)
+        to_update_from = np.copy(active)
+
+        # [j, i] = (i -> a) AND (a -> b) AND (b -> j)
+        # Note that (a -> b) is not all possible paths (a -> b),
+        # but the specific edge we're updating
+        self.storage.remove_outer(
+            to_update_to, to_update_from, Ac_full_to_a * old_weight, Ac_full_from_b, np.ones(n, bool)
+        )
+        self.storage.combine_outer(
+            to_update_to, to_update_from, Ac_full_to_a * new_weight, Ac_full_from_b, np.ones(n, bool)
+        )
+
+        if self.storage.sparse:
+            self.check_storage()
 
     # edge is a tuple of references (a, b) where (a -> b)
-    def update_edge(self, edge: tuple[QGraphicsRectItem], new_weight: float) -> None:
+    def update_edge(self, edge: tuple[Hashable], new_weight: float) -> None:
         self.update_edge_i((self.refi[edge[0]], self.refi[edge[1]]), new_weight)
 
-    def update_edges(self, edges: list[tuple[QGraphicsRectItem]], new_weights: list[float]) -> None:
+    def update_edges(self, edges: list[tuple[Hashable]], new_weights: list[float]) -> None:
         for e, w in zip(edges, new_weights):
             self.update_edge(e, w)
 
-    def update_vertex(self, ref: QGraphicsRectItem, new_weight: float) -> None:
-        self.r0[self.refi[ref]] = new_weight
+    def update_vertex(self, ref: Hashable, new_weight: float) -> None:
+        vi = self.refi[ref]
+        self.r0[vi] = new_weight
+        self.invalidate(vi)
 
-    def update_vertices(self, refs: list[QGraphicsRectItem], new_weights: list[float]) -> None:
+    def update_vertices(self, refs: list[Hashable], new_weights: list[float]) -> None:
         for ref, nw in zip(refs, new_weights):
             self.update_vertex(ref, nw)
 
@@ -281,105 +748,675 @@ class DepGraph:
         self.update_edge_i(edge, 0)
             
     # edge is a tuple of references (a, b) where (a -> b)
-    def delete_edge(self, edge: tuple[QGraphicsRectItem]) -> None:
+    def delete_edge(self, edge: tuple[Hashable]) -> None:
         self.delete_edge_i((self.refi[edge[0]], self.refi[edge[1]]))
 
-    def delete_edges(self, edges: list[tuple[QGraphicsRectItem]]) -> None:
+    def delete_edges(self, edges: list[tuple[Hashable]]) -> None:
         for e in edges:
             self.delete_edge(e)
 
-    # This works for AND gates too
-    def delete_vertex(self, ref: QGraphicsRectItem) -> None:
+    # Frees the slots of refs. Other vertices keep their indices
+    def free_vertices(self, refs: list[Hashable]) -> None:
         n = self.n
-        vi = self.refi[ref]
+        slots = np.array([self.refi[ref] for ref in refs], int)
+        deleted = np.zeros(n, bool)
+        deleted[slots] = True
+
+        # Delete edges before we lose their information. Paths between
+        # the remaining vertices have to enter the deleted ones through
+        # an edge from outside, so edges among them can just be dropped
+        for vi in slots:
+            for j in self.storage.in_edges(vi, n):
+                if not deleted[j]:
+                    self.delete_edge_i((j, vi))
+            for i in self.storage.out_edges(vi, n):
+                if not deleted[i]:
+                    self.delete_edge_i((vi, i))
 
-        # Delete edges before we lose their information
-        for i, j in chain(product((vi,), range(n)), product(range(n), (vi,))):
-            if self.A[i, j]:
-                self.delete_edge_i((j, i))
+        for ref in refs:
+            del self.refi[ref]
+
+        self.iref[slots] = None
+        self.r0[slots] = 0
+        self.is_AND[slots] = False
+        self.vote_k[slots] = 0
+        self.active[slots] = False
+        self.own_storage()
+        self.storage.clear_slots(slots)
+        self.free.extend(slots.tolist())
+        self.unorder_edge()
+        self.invalidate()
 
-        del self.refi[ref]
-        for key in self.refi.keys():
-            index = self.refi[key]
-            if index > vi:
-                self.refi[key] = index - 1
+    # This works for AND gates too
+    def delete_vertex(self, ref: Hashable) -> None:
+        self.free_vertices([ref])
+        self.check_compact()
 
-        self.iref[vi:n - 1] = self.iref[vi + 1:n]
-        self.r0[vi:n - 1] = self.r0[vi + 1:n]
-        self.is_AND[vi:n - 1] = self.is_AND[vi + 1:n]
+    # Deletes refs together, clearing all their rows and columns at once
+    def delete_vertices(self, refs: list[Hashable]) -> None:
+        self.free_vertices(refs)
 
-        self.A[vi:n - 1, :n] = self.A[vi + 1:n, :n]
-        self.A[:n - 1, vi:n - 1] = self.A[:n - 1, vi + 1:n]
+        if self.SHRINK_BELOW is not None and self.n_vertices < self.SHRINK_BELOW * self.capacity:
+            self.compact()
+            self.shrink_to_fit()
+        else:
+            self.check_compact()
+            self.check_storage()
+
+    # P(at least k[g] of the events in row g of P happen), for
+    # independent events with probabilities P[..., g, :]. Counts
+    # failures one input at a time, stopping at max(k), so it takes
+    # O(inputs * k) steps instead of enumerating every combination
+    def at_least_k(self, P: np.ndarray, k: np.ndarray) -> np.ndarray:
+        K = k.max(initial=0)
+        # dist[..., g, c] = P(c inputs so far happened), with c = K
+        # standing for K or more
+        dist = np.zeros(P.shape[:-1] + (K + 1,), np.double)
+        dist[..., 0] = 1
+        for j in np.flatnonzero(np.any(P > 0, axis=tuple(range(P.ndim - 1)))):
+            p = P[..., j, np.newaxis]
+            happened = dist * p
+            dist *= 1 - p
+            dist[..., 1:] += happened[..., :-1]
+            dist[..., K] += happened[..., K]
+
+        tail = np.cumsum(dist[..., ::-1], axis=-1)[..., ::-1]
+        return np.take_along_axis(tail, np.broadcast_to(k[:, np.newaxis], tail.shape[:-1] + (1,)), -1)[..., 0]
+
+    def update_AND_weights(self) -> None:
+        n = self.n
+        # Only the rows of AND gates are needed
+        AND_rows = np.flatnonzero(self.is_AND[:n])
+        if not len(AND_rows):
+            return
 
-        self.A_collapse[vi:n - 1, :n] = self.A_collapse[vi + 1:n, :n]
-        self.A_collapse[:n - 1, vi:n - 1] = self.A_collapse[:n - 1, vi + 1:n]
+        Ac_full = self.storage.Ac_full_rows(AND_rows, n)
+        comp_bools = np.logical_not(self.is_AND[:n])
 
-        self.one_count[vi:n - 1, :n] = self.one_count[vi + 1:n, :n]
-        self.one_count[:n - 1, vi:n - 1] = self.one_count[:n - 1, vi + 1:n]
+        # (j -> i) for components j, including the weight of j.
+        # Only components with a path to the gate count towards the
+        # product, and one that can't fail makes the whole product 0
+        comp_paths = Ac_full[:, comp_bools]
+        comp_weights = comp_paths * self.r0[:n][comp_bools]
+        r0_AND = np.prod(comp_weights, axis=1, where=comp_paths > 0)
+        # k-of-n gates count failures instead
+        vote_k = self.vote_k[AND_rows]
+        vote = vote_k > 0
+        if np.any(vote):
+            r0_AND[vote] = self.at_least_k(comp_weights[vote], vote_k[vote])
+
+        # If an AND gate isn't connected to any components,
+        # we calculate its risk separately and mark it as 0
+        # for now
+        connected = np.any(comp_paths, axis=1)
+        r0_AND[np.logical_not(connected)] = 0
+
+        # Only consider risk from AND gates that are
+        # connected to a component. AND gates that
+        # have no connected components drop out of the product
+        AND_paths = Ac_full[:, AND_rows] * connected
+        np.fill_diagonal(AND_paths, 0)
+        AND_weights = AND_paths * r0_AND
+        if np.any(vote):
+            r0_vote = self.at_least_k(np.hstack((comp_weights[vote], AND_weights[vote])), vote_k[vote])
+        r0_AND *= np.prod(AND_weights, axis=1, where=AND_paths > 0)
+        if np.any(vote):
+            r0_AND[vote] = r0_vote
+
+        self.r0[AND_rows] = r0_AND
+
+    # Note: through the closure, self.r values for AND gates are garbage
+    # values. The sweep gives them their failure probability
+    # Returns the cached vector if nothing changed since the last call,
+    # and only updates the affected rows if just direct risks changed
+    def calc_r(self) -> np.ndarray:
+        if self.version == self.r_version:
+            return self.r
 
-        self.n -= 1
+        n = self.n
+        if self.use_sweep():
+            self.r = self.calc_r_sweep(self.r0[:n][np.newaxis])[0]
+            # Like update_AND_weights, gates keep their weight in r0
+            self.r0[:n][self.is_AND[:n]] = self.r[self.is_AND[:n]]
+        elif self.dirty is not None and len(self.r) == self.n:
+            self.calc_r_dirty()
+        else:
+            self.calc_r_all()
 
-    def delete_vertices(self, refs: list[QGraphicsRectItem]) -> None:
-        for ref in refs:
-            self.delete_vertex(ref)
+        self.r_version = self.version
+        self.dirty = set()
+        return self.r
 
-    def update_AND_weights(self) -> None:
+    # Whether calc_r and calc_r_batch use calc_r_sweep, only if
+    # SWEEP_DAGS is on
+    def use_sweep(self) -> bool:
+        return self.SWEEP_DAGS and self.is_acyclic
+
+    # get_sweep_plan for the graph's own edges, cached until they change
+    def get_sweep_plan(self) -> list[tuple[np.ndarray]]:
+        if self.sweep_plan is None:
+            self.sweep_plan = self.make_sweep_plan(self.storage.edge_coo(self.n))
+        return self.sweep_plan
+
+    # edges, given as edge_coo gives them, grouped by the level of their
+    # heads, as (heads, tails, weights, starts) for each level past
+    # the first. Each head's in-edges start at its entry in starts.
+    # None if the edges form a cycle
+    def make_sweep_plan(self, edges: tuple[np.ndarray]) -> list[tuple[np.ndarray]]:
+        levels = self.topological_levels(edges)
+        if levels is None:
+            return None
+
+        b, a, w = edges
+        order = np.lexsort((b, levels[b]))
+        b, a, w = b[order], a[order], w[order]
+        level_starts = np.searchsorted(levels[b], np.arange(1, levels.max(initial=0) + 2))
+
+        plan = []
+        for lo, hi in zip(level_starts[:-1], level_starts[1:]):
+            heads, starts = np.unique(b[lo:hi], return_index=True)
+            plan.append((heads, a[lo:hi], w[lo:hi], starts))
+        return plan
+
+    # Total risk for each row of R0 on an acyclic graph, in one pass
+    # over its levels, without the closure. Each vertex treats the
+    # failures coming in through its in-edges as independent:
+    #   a component fails if it fails directly or through any in-edge
+    #   an AND gate fails if it fails through all of its in-edges
+    #   a k-of-n gate fails if it fails through k or more
+    # This is exact unless two in-edges of a vertex share an upstream
+    # vertex. The closure treats paths as independent instead, so it
+    # overcounts even a chain's shared edges.
+    # plan is from make_sweep_plan, by default the graph's own
+    def calc_r_sweep(self, R0: np.ndarray, plan: list[tuple[np.ndarray]]=None) -> np.ndarray:
         n = self.n
-        Ac_full = self.calc_Ac_full()
+        R = np.array(R0, np.double)
+        R[:, self.is_AND[:n]] = 0
+        for heads, tails, weights, starts in plan if plan is not None else self.get_sweep_plan():
+            terms = weights * R[:, tails]
+            direct = R[:, heads]
+
+            # Components, the same way as coo_or_vec
+            certain = 1 == terms
+            log_miss = np.add.reduceat(np.log1p(-np.where(certain, 0, terms)), starts, axis=1)
+            log_miss += np.log1p(-np.where(1 == direct, 0, direct))
+            res = -np.expm1(log_miss)
+            res[np.logical_or(np.add.reduceat(certain, starts, axis=1), 1 == direct)] = 1
+
+            is_AND = self.is_AND[heads]
+            if np.any(is_AND):
+                res[:, is_AND] = np.multiply.reduceat(terms, starts, axis=1)[:, is_AND]
+
+            # k-of-n gates, with their terms padded out with zeros
+            vote = np.flatnonzero(self.vote_k[heads])
+            if len(vote):
+                counts = np.diff(np.append(starts, len(tails)))[vote]
+                gate = np.repeat(np.arange(len(vote)), counts)
+                slot = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                P = np.zeros((len(R), len(vote), counts.max()), np.double)
+                P[:, gate, slot] = terms[:, np.repeat(starts[vote], counts) + slot]
+                res[:, vote] = self.at_least_k(P, self.vote_k[heads[vote]])
+
+            R[:, heads] = res
+        return R
+
+    def calc_r_all(self) -> None:
+        n = self.n
+        self.update_AND_weights()
+        if self.storage.sparse:
+            rows, cols, vals = self.storage.Ac_full_coo(n)
+            # Each vertex's own direct risk, as the identity would add
+            diag = np.arange(n)
+            rows, cols = np.concatenate((rows, diag)), np.concatenate((cols, diag))
+            vals = np.concatenate((vals, np.ones(n)))
+            self.r = self.coo_or_vec(rows, cols, vals, self.r0[:n])
+        else:
+            self.r = self.mat_or_vec(self.I[:n, :n] + self.calc_Ac_full(), self.r0[:n])
 
-        AND_indices = compress(range(n), self.is_AND[:n])
-        comp_bools = np.logical_not(self.is_AND[:n])
-        comp_indices = compress(range(n), comp_bools)
-        for i in AND_indices:
-            # If an AND gate isn't connected to any components,
-            # we calculate its risk separately and mark it as 0
-            # for now
-            if not np.any(Ac_full[i, comp_bools]):
-                self.r0[i] = 0
-                continue
-
-            self.r0[i] = 1
-            for j in comp_indices:
-                # (j -> i)
-                path_weight = Ac_full[i, j]
-                # Include vertex weight if j is a component
-                if not self.is_AND[j]:
-                    path_weight *= self.r0[j]
-                if path_weight:
-                    self.r0[i] *= path_weight
-
-        for i, j in filter(lambda t: t[0] != t[1], product(AND_indices, repeat=2)):
-            # Only consider risk from AND gates that are
-            # connected to a component. AND gates that
-            # have no connected components will have an r0
-            # value of 0
-            path_weight = self.r0[j] * Ac_full[i, j]
-            if path_weight:
-                self.r0[i] *= path_weight
-
-    # Note: self.r values for AND gates are garbage values
-    def calc_r(self) -> None:
+    # Recomputes the rows of self.r reachable from a vertex in self.dirty
+    def calc_r_dirty(self) -> None:
         n = self.n
+        if not self.dirty:
+            return
+
+        # AND gate weights depend on the components upstream of them,
+        # so any that changed spread like dirty vertices
+        AND_rows = np.flatnonzero(self.is_AND[:n])
+        old_AND_r0 = self.r0[AND_rows]
         self.update_AND_weights()
-        self.r = self.mat_or_vec(self.I[:n, :n] + self.calc_Ac_full(), self.r0[:n])
-        return self.r
-    
-    def get_edge_weight_A(self, edge: tuple[QGraphicsRectItem]) -> float:
-        return self.A_collapse[self.refi[edge[1]], self.refi[edge[0]]]
+        sources = set(self.dirty)
+        sources.update(AND_rows[self.r0[AND_rows] != old_AND_r0].tolist())
+
+        rows = np.zeros(n, bool)
+        rows[list(sources)] = True
+        for j in sources:
+            rows[self.calc_Ac_full_col(j) > 0] = True
+
+        rows = np.flatnonzero(rows)
+        if len(rows) > self.RECALC_ALL_ABOVE * n:
+            self.calc_r_all()
+            return
+
+        Ac_full = self.storage.Ac_full_rows(rows, n)
+        Ac_full[np.arange(len(rows)), rows] += 1
+        self.r[rows] = self.mat_or_vec(Ac_full, self.r0[:n])
+
+    # AND gate weights for each row of R0, as update_AND_weights computes
+    # them for self.r0. The products over paths with nonzero weight are
+    # taken as sums of logs, so each one is a matrix product
+    def calc_AND_weights_batch(self, R0: np.ndarray, AND_rows: np.ndarray) -> np.ndarray:
+        n = self.n
+        Ac_full = self.storage.Ac_full_rows(AND_rows, n)
+        comp_bools = np.logical_not(self.is_AND[:n])
 
-    def get_edge_weight_Ac(self, edge: tuple[QGraphicsRectItem]) -> float:
-        return self.A_collapse[self.refi[edge[1]], self.refi[edge[0]]]
+        # log of prod_{j : a[i, j] > 0} a[i, j] * v[s, j], which is
+        # -inf once any of those v[s, j] is 0
+        def log_masked_prod(a: np.ndarray, v: np.ndarray) -> np.ndarray:
+            a_pos, v_pos = a > 0, v > 0
+            log_a = np.log(a, out=np.zeros_like(a), where=a_pos)
+            log_v = np.log(v, out=np.zeros_like(v), where=v_pos)
+            res = log_a.sum(axis=1) + log_v @ a_pos.T
+            res[np.logical_not(v_pos).astype(np.double) @ a_pos.T > 0] = -np.inf
+            return res
+
+        # (j -> i) for components j, including the weight of j
+        R0_AND = np.exp(log_masked_prod(Ac_full[:, comp_bools], R0[:, comp_bools]))
+        # k-of-n gates count failures instead, s x gates x components
+        vote_k = self.vote_k[AND_rows]
+        vote = vote_k > 0
+        if np.any(vote):
+            comp_weights = Ac_full[vote][:, comp_bools] * R0[:, np.newaxis, comp_bools]
+            R0_AND[:, vote] = self.at_least_k(comp_weights, vote_k[vote])
+        connected = np.any(Ac_full[:, comp_bools], axis=1)
+        R0_AND[:, np.logical_not(connected)] = 0
+
+        # AND gates with no connected components drop out
+        Ac_AND = Ac_full[:, AND_rows] * connected
+        np.fill_diagonal(Ac_AND, 0)
+        if np.any(vote):
+            AND_weights = Ac_AND[vote] * R0_AND[:, np.newaxis, :]
+            R0_vote = self.at_least_k(np.concatenate((comp_weights, AND_weights), axis=-1), vote_k[vote])
+        R0_AND *= np.exp(log_masked_prod(Ac_AND, R0_AND))
+        if np.any(vote):
+            R0_AND[:, vote] = R0_vote
+        return R0_AND
+
+    # calc_r for many direct risk vectors at once. Row s of R0 is used in
+    # place of self.r0[:n], and row s of the result is the matching r.
+    # The closure is read once and shared by every row
+    def calc_r_batch(self, R0: np.ndarray) -> np.ndarray:
+        n = self.n
+        R0 = np.array(R0, np.double, ndmin=2)
+        if R0.ndim != 2 or R0.shape[1] != n:
+            raise ValueError(f"R0 must have shape (s, {n}), not {R0.shape}")
+
+        if self.use_sweep():
+            return self.calc_r_sweep(R0)
+
+        AND_rows = np.flatnonzero(self.is_AND[:n])
+        if len(AND_rows):
+            R0[:, AND_rows] = self.calc_AND_weights_batch(R0, AND_rows)
+
+        if not self.storage.sparse:
+            return self.mat_or_mat(self.I[:n, :n] + self.calc_Ac_full(), R0.T).T
+
+        # Same as coo_or_vec, for chunks of rows of R0 at a time
+        rows, cols, vals = self.storage.Ac_full_coo(n)
+        diag = np.arange(n)
+        rows, cols = np.concatenate((rows, diag)), np.concatenate((cols, diag))
+        vals = np.concatenate((vals, np.ones(n)))
+        order = np.argsort(rows, kind="stable")
+        rows, cols, vals = rows[order], cols[order], vals[order]
+        # Every row has its diagonal entry, so no segment is empty
+        starts = np.searchsorted(rows, diag)
+
+        res = np.empty_like(R0)
+        chunk = max(1, self.OR_STACK_MAX_ELEMS // len(vals))
+        for start in range(0, len(R0), chunk):
+            terms = vals * R0[start:start + chunk, cols]
+            certain = 1 == terms
+            terms[certain] = 0
+
+            res[start:start + chunk] = -np.expm1(np.add.reduceat(np.log1p(-terms), starts, axis=1))
+            res[start:start + chunk][np.add.reduceat(certain, starts, axis=1) > 0] = 1
+        return res
 
-    def get_vertex_weight(self, ref: QGraphicsRectItem) -> float:
+    # Importance of each component for the total risk r_t of target:
+    #   birnbaum:       r_t(r0_j = 1) - r_t(r0_j = 0)
+    #   criticality:    birnbaum * r0_j / r_t
+    #   fussell_vesely: (r_t - r_t(r0_j = 0)) / r_t
+    # Returns a dict mapping each measure to a dict like get_r_dict.
+    # The r0_j = 1 and r0_j = 0 scenarios of every component that can
+    # reach target, through gates or not, are stacked into batches of
+    # direct risk vectors for calc_r_batch
+    def importance(self, target: Hashable) -> dict:
+        n = self.n
+        t = self.refi[target]
+        r_t = self.calc_r()[t]
+
+        components = np.logical_and(self.active[:n], np.logical_not(self.is_AND[:n]))
+        # The closure has no paths through gates' in-edges, so the
+        # components that can affect target are found by walking back
+        # along every in-edge as well as every closure entry
+        upstream = np.zeros(n, bool)
+        upstream[t] = True
+        stack = [t]
+        while stack:
+            u = stack.pop()
+            preds = np.union1d(self.storage.in_edges(u, n), np.flatnonzero(self.calc_Ac_full_row(u)))
+            preds = preds[np.logical_not(upstream[preds])]
+            upstream[preds] = True
+            stack.extend(preds.tolist())
+        comps = np.flatnonzero(np.logical_and(components, upstream))
+
+        r_t_hi = np.empty(len(comps), np.double)
+        r_t_lo = np.empty(len(comps), np.double)
+        chunk = max(1, self.OR_STACK_MAX_ELEMS // (2 * n))
+        for start in range(0, len(comps), chunk):
+            part = comps[start:start + chunk]
+            m = len(part)
+            R0 = np.tile(self.r0[:n], (2 * m, 1))
+            R0[np.arange(m), part] = 1
+            R0[m + np.arange(m), part] = 0
+            r_t_batch = self.calc_r_batch(R0)[:, t]
+            r_t_hi[start:start + m] = r_t_batch[:m]
+            r_t_lo[start:start + m] = r_t_batch[m:]
+
+        birnbaum = np.zeros(n, np.double)
+        birnbaum[comps] = r_t_hi - r_t_lo
+        criticality = np.zeros(n, np.double)
+        fussell_vesely = np.zeros(n, np.double)
+        if r_t > 0:
+            criticality[comps] = birnbaum[comps] * self.r0[comps] / r_t
+            fussell_vesely[comps] = (r_t - r_t_lo) / r_t
+
+        measures = { "birnbaum" : birnbaum, "criticality" : criticality, "fussell_vesely" : fussell_vesely }
+        return {
+            name : { self.iref[i] : values[i] for i in np.flatnonzero(components) }
+            for name, values in measures.items()
+        }
+
+    def get_edge_weight_A(self, edge: tuple[Hashable]) -> float:
+        return self.storage.get_edge(self.refi[edge[1]], self.refi[edge[0]])
+
+    def get_edge_weight_Ac(self, edge: tuple[Hashable]) -> float:
+        return self.storage.get_path(self.refi[edge[1]], self.refi[edge[0]])[0]
+
+    def get_vertex_weight(self, ref: Hashable) -> float:
         return self.r0[self.refi[ref]]
     
-    def get_total_risk(self, ref: QGraphicsRectItem) -> float:
+    def get_total_risk(self, ref: Hashable) -> float:
         return self.r[self.refi[ref]]
     
+    # Cached until the graph changes, so don't modify the result
     def get_r_dict(self) -> dict:
+        if self.version == self.r_dict_version:
+            return self.r_dict
+
         n = self.n
         self.calc_r()
-        return { self.iref[i] : risk for i, risk in compress(enumerate(self.r), np.logical_not(self.is_AND[:n])) }
+        components = np.logical_and(self.active[:n], np.logical_not(self.is_AND[:n]))
+        self.r_dict = { self.iref[i] : risk for i, risk in compress(enumerate(self.r), components) }
+        self.r_dict_version = self.version
+        return self.r_dict
+
+    # An independent copy of the graph, closure included
+    def copy(self) -> "DepGraph":
+        dg = DepGraph(self.capacity, "sparse" if self.storage.sparse else "dense")
+        dg.storage_kind = self.storage_kind
+        dg.storage.load(self.storage.export(self.n))
+
+        for name in ("iref", "r0", "r", "is_AND", "vote_k", "topo_rank", "active"):
+            setattr(dg, name, getattr(self, name).copy())
+        dg.refi = dict(self.refi)
+        dg.n = self.n
+        dg.free = list(self.free)
+        dg.next_rank = self.next_rank
+        dg.acyclic = self.acyclic
+        return dg
+
+    # A copy of the graph as it is now that's safe to read from another
+    # thread while this one changes. Only the per-vertex arrays are
+    # copied, and storage is shared until this graph next changes it.
+    # The snapshot is for reading, and release() has to be called
+    # once it's no longer needed
+    def snapshot(self) -> "DepGraph":
+        dg = type(self).__new__(type(self))
+        dg.__dict__.update(self.__dict__)
+        for name in ("iref", "r0", "r", "is_AND", "vote_k", "topo_rank", "active"):
+            setattr(dg, name, getattr(self, name).copy())
+        dg.refi = dict(self.refi)
+        dg.free = list(self.free)
+        dg.dirty = None if self.dirty is None else set(self.dirty)
+        self.storage_readers.add(id(dg))
+        return dg
+
+    # Stops a snapshot from holding back changes to the graph it came from
+    def release(self) -> None:
+        self.storage_readers.discard(id(self))
+
+    # The graph as a dict of plain arrays, closure included, so
+    # from_arrays can restore it without recomputing anything.
+    # Vertex keys have to be numbers or strings
+    def to_arrays(self) -> dict:
+        n = self.n
+        slots = np.flatnonzero(self.active[:n])
+        keys = self.iref[slots].tolist()
+        # numpy would turn numbers mixed in with strings into strings,
+        # which don't load back as the same keys
+        n_str = sum(isinstance(key, str) for key in keys)
+        if 0 < n_str < len(keys):
+            raise ValueError("Graphs keyed by both strings and other types can't be saved")
+        keys = np.array(keys)
+        if object == keys.dtype:
+            raise ValueError("Only graphs keyed by numbers or strings can be saved")
+
+        entries = self.storage.export(n)
+        A_rows, A_cols, A_vals = entries["A"]
+        P_rows, P_cols, P_Ac, P_ones = entries["paths"]
+        return {
+            "dg_n" : np.array(n),
+            "dg_storage" : np.array(self.storage_kind),
+            "dg_sparse" : np.array(self.storage.sparse),
+            "dg_slots" : slots,
+            "dg_keys" : keys,
+            "dg_r0" : self.r0[:n],
+            "dg_is_AND" : self.is_AND[:n],
+            "dg_vote_k" : self.vote_k[:n],
+            "dg_A_rows" : A_rows,
+            "dg_A_cols" : A_cols,
+            "dg_A_vals" : A_vals,
+            "dg_P_rows" : P_rows,
+            "dg_P_cols" : P_cols,
+            "dg_P_Ac" : P_Ac,
+            "dg_P_ones" : P_ones.astype(np.uint64),
+        }
+
+    # Restores a graph from to_arrays
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> "DepGraph":
+        n = int(arrays["dg_n"])
+        capacity = cls.INITIAL_CAPACITY
+        while capacity < n:
+            capacity *= 2
+
+        dg = cls(capacity, "sparse" if arrays["dg_sparse"] else "dense")
+        dg.storage_kind = str(arrays["dg_storage"])
+        dg.n = n
+        slots = arrays["dg_slots"]
+        for vi, ref in zip(slots.tolist(), arrays["dg_keys"].tolist()):
+            dg.refi[ref] = vi
+            dg.iref[vi] = ref
+        dg.active[slots] = True
+        dg.free = np.flatnonzero(np.logical_not(dg.active[:n])).tolist()
+
+        dg.r0[:n] = arrays["dg_r0"]
+        dg.is_AND[:n] = arrays["dg_is_AND"]
+        dg.vote_k[:n] = arrays["dg_vote_k"]
+        dg.storage.load({
+            "A" : (arrays["dg_A_rows"], arrays["dg_A_cols"], arrays["dg_A_vals"]),
+            "paths" : (arrays["dg_P_rows"], arrays["dg_P_cols"], arrays["dg_P_Ac"], arrays["dg_P_ones"]),
+        })
+
+        # Ranks are rebuilt the first time they're needed
+        dg.next_rank = n
+        dg.acyclic = None
+        dg.invalidate()
+        return dg
+
+    # Saves to_arrays() and any extra arrays to a compressed .npz file.
+    # Extra arrays can't have names starting with "dg_"
+    def save(self, path: str, **extra: np.ndarray) -> None:
+        np.savez_compressed(path, **self.to_arrays(), **extra)
+
+    # Reads a file written by save. Returns the graph and a dict of the
+    # extra arrays saved with it. Raises ValueError if path isn't a
+    # readable file written by save, and OSError if it can't be opened
+    @classmethod
+    def load(cls, path: str) -> tuple["DepGraph", dict]:
+        try:
+            loaded = np.load(path, allow_pickle=False)
+            if not isinstance(loaded, np.lib.npyio.NpzFile):
+                raise ValueError("not an .npz archive")
+            with loaded as npz:
+                arrays = dict(npz)
+        except (zipfile.BadZipFile, zlib.error, EOFError, ValueError) as e:
+            raise ValueError(f"{path} isn't a saved graph: {e}") from e
+
+        extra = { name : arr for name, arr in arrays.items() if not name.startswith("dg_") }
+        try:
+            return cls.from_arrays(arrays), extra
+        except KeyError as e:
+            raise ValueError(f"{path} isn't a saved graph, missing {e}") from e
+
+    # A what-if overlay on this graph, see DepGraphFork
+    def fork(self) -> "DepGraphFork":
+        return DepGraphFork(self)
+
+# A what-if view of a DepGraph that shares the base graph's arrays
+# and only records what changed: direct risks and edge weights, keyed
+# by vertex. Changes to the base show through. calc_r gives what the
+# base's calc_r would after the changes, without touching the base:
+#   with only direct risks changed, through base.calc_r_batch
+#   with SWEEP_DAGS on and the changed edges acyclic, by sweeping
+#   over them
+#   otherwise the closure is needed, so the base is copied and the
+#   edge changes are replayed on the copy
+class DepGraphFork:
+    def __init__(self, base: DepGraph) -> None:
+        self.base = base
+        # Maps vertex keys to their new direct risk
+        self.r0_changes = {}
+        # Maps edges (a, b) to their new weight, 0 if removed
+        self.edge_changes = {}
+
+        # Bumped by every change to the overlay
+        self.version = 0
+        # self.r and the (base, overlay) versions it was computed at
+        self.r = None
+        self.r_key = None
+        # The base with the edge changes applied, if it was needed
+        self.replayed = None
+        self.replayed_key = None
+
+    def update_vertex(self, ref: Hashable, new_weight: float) -> None:
+        self.r0_changes[ref] = new_weight
+        self.version += 1
+
+    # edge is a tuple (a, b) where a -> b. This also adds edges
+    def update_edge(self, edge: tuple[Hashable], new_weight: float) -> None:
+        self.edge_changes[tuple(edge)] = new_weight
+        self.version += 1
+
+    def add_edge(self, edge: tuple[Hashable], weight: float=DepGraph.DEFAULT_EDGE_WEIGHT) -> None:
+        self.update_edge(edge, weight)
+
+    def delete_edge(self, edge: tuple[Hashable]) -> None:
+        self.update_edge(edge, 0)
+
+    # A fork of base with the same changes as this one
+    def rebase(self, base: DepGraph) -> "DepGraphFork":
+        fork = DepGraphFork(base)
+        fork.r0_changes = dict(self.r0_changes)
+        fork.edge_changes = dict(self.edge_changes)
+        return fork
+
+    # Drops every change
+    def reset(self) -> None:
+        self.r0_changes.clear()
+        self.edge_changes.clear()
+        self.version += 1
+
+    def get_vertex_weight(self, ref: Hashable) -> float:
+        return self.r0_changes.get(ref, self.base.get_vertex_weight(ref))
+
+    # edge_changes as indices into the base, skipping deleted vertices
+    def edge_changes_i(self) -> tuple[np.ndarray]:
+        refi = self.base.refi
+        changes = [(refi[b], refi[a], w) for (a, b), w in self.edge_changes.items() if a in refi and b in refi]
+        heads, tails, weights = zip(*changes) if changes else ((), (), ())
+        return np.array(heads, int), np.array(tails, int), np.array(weights, np.double)
+
+    # The base's edges with the changes applied, as edge_coo gives them
+    def edge_coo(self) -> tuple[np.ndarray]:
+        n = self.base.n
+        b, a, w = self.base.storage.edge_coo(n)
+        heads, tails, weights = self.edge_changes_i()
+        keep = np.logical_not(np.isin(b * n + a, heads * n + tails))
+        added = weights != 0
+        return (
+            np.concatenate((b[keep], heads[added])),
+            np.concatenate((a[keep], tails[added])),
+            np.concatenate((w[keep], weights[added])),
+        )
+
+    # A copy of the base with the edge changes made through the
+    # incremental closure updates, rebuilt when either side changes
+    def replay(self) -> DepGraph:
+        key = (self.base.version, self.version)
+        if key != self.replayed_key:
+            dg = self.base.copy()
+            for b, a, w in zip(*(arr.tolist() for arr in self.edge_changes_i())):
+                if dg.storage.get_edge(b, a):
+                    dg.update_edge_i((a, b), w)
+                elif w:
+                    dg.add_edge_i((a, b), w)
+
+            self.replayed = dg
+            self.replayed_key = key
+        return self.replayed
+
+    def calc_r(self) -> np.ndarray:
+        base = self.base
+        key = (base.version, self.version)
+        if key == self.r_key:
+            return self.r
+
+        n = base.n
+        R0 = base.r0[:n][np.newaxis].copy()
+        for ref, w in self.r0_changes.items():
+            if ref in base.refi:
+                R0[0, base.refi[ref]] = w
+
+        plan = None
+        if self.edge_changes and base.SWEEP_DAGS:
+            plan = base.make_sweep_plan(self.edge_coo())
+
+        if not self.edge_changes:
+            self.r = base.calc_r_batch(R0)[0]
+        elif plan is not None:
+            self.r = base.calc_r_sweep(R0, plan)[0]
+        else:
+            self.r = self.replay().calc_r_batch(R0)[0]
+
+        self.r_key = key
+        return self.r
+
+    def get_r_dict(self) -> dict:
+        base = self.base
+        n = base.n
+        components = np.logical_and(base.active[:n], np.logical_not(base.is_AND[:n]))
+        return { base.iref[i] : risk for i, risk in compress(enumerate(self.calc_r()), components) }
 
 if __name__ == "__main__":
     ########### Testing code ################
@@ -504,4 +1541,16 @@ if __name__ == "__main__":
         print(dg.calc_Ac_full()[:n, :n])
         print(dg.calc_r())
 
+        print("\nTEST3")
+        # a and b only reach c through the AND gate, so they're
+        # missing from c's closure row but still matter to it
+        dg = DepGraph()
+        dg.add_vertices(['a', 'b', 'c'], [0.5, 0.5, 0.1])
+        dg.add_AND_gate('G')
+        dg.add_edges([('a', 'G'), ('b', 'G'), ('G', 'c')], [1, 1, 1])
+
+        # a and b each matter 0.5 * 0.9 = 0.45
+        print("Birnbaum for c:", dg.importance('c')["birnbaum"])
+        print("Fussell-Vesely for c:", dg.importance('c')["fussell_vesely"])
+
     test_suite_2()
\ No newline at end of file
@@ -0,0 +1,182 @@
+# @file monte_carlo.py
+# @author Evan Brody
+# @brief Estimates DepGraph risks by sampling failures instead of combining path weights
+
+import os, sys, time
+import numpy as np
+from multiprocessing import Pool
+from statistics import NormalDist
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph.dep_graph import DepGraph
+
+# Trials simulated together. Each chunk holds an n x trials and
+# an edges x trials boolean matrix
+CHUNK_TRIALS = 8192
+
+# The parts of a DepGraph the simulation needs, as plain arrays so
+# they're cheap to send to worker processes.
+# In each trial:
+#   a component fails directly with probability r0
+#   a failure crosses each edge a -> b with probability equal to its weight
+#   a component fails if it fails directly or a failure reaches it
+#   an AND gate fails if failures reach it through all of its in-edges
+#   a k-of-n gate fails if failures reach it through k or more in-edges
+class MonteCarloModel:
+    def __init__(self, dg: DepGraph) -> None:
+        n = dg.n
+        self.n = n
+        self.is_AND = dg.is_AND[:n].copy()
+        self.vote_k = dg.vote_k[:n].copy()
+        self.r0 = np.where(self.is_AND, 0, dg.r0[:n])
+
+        # Edges a -> b, sorted by b so each vertex's in-edges are contiguous
+        b, a, w = dg.storage.edge_coo(n)
+        order = np.argsort(b, kind="stable")
+        self.src, self.dst, self.weight = a[order], b[order], w[order]
+        self.in_start = np.searchsorted(self.dst, np.arange(n + 1))
+
+        self.order, self.acyclic = self.topological_order()
+
+    # Vertices with in-edges, sources of their in-edges first where the
+    # graph allows. Vertices left over are on or below a cycle
+    def topological_order(self) -> tuple[np.ndarray, bool]:
+        n = self.n
+        in_degree = np.diff(self.in_start)
+        out_edges = [[] for _ in range(n)]
+        for a, b in zip(self.src.tolist(), self.dst.tolist()):
+            out_edges[a].append(b)
+
+        ready = np.flatnonzero(0 == in_degree).tolist()
+        in_degree = in_degree.copy()
+        order = []
+        while ready:
+            v = ready.pop()
+            order.append(v)
+            for b in out_edges[v]:
+                in_degree[b] -= 1
+                if 0 == in_degree[b]:
+                    ready.append(b)
+
+        acyclic = len(order) == n
+        if not acyclic:
+            placed = np.zeros(n, bool)
+            placed[order] = True
+            order += np.flatnonzero(np.logical_not(placed)).tolist()
+
+        has_in_edges = np.diff(self.in_start) > 0
+        return np.array([v for v in order if has_in_edges[v]], int), acyclic
+
+    # Number of trials in which each vertex failed, out of trials
+    def simulate(self, trials: int, rng: np.random.Generator) -> np.ndarray:
+        fails = np.zeros(self.n, np.int64)
+        for start in range(0, trials, CHUNK_TRIALS):
+            fails += np.count_nonzero(self.simulate_chunk(min(CHUNK_TRIALS, trials - start), rng), axis=1)
+        return fails
+
+    # Failure states, n x trials. Rows are vertices so that
+    # each step below works on contiguous memory
+    def simulate_chunk(self, trials: int, rng: np.random.Generator) -> np.ndarray:
+        state = rng.random((self.n, trials)) < self.r0[:, np.newaxis]
+        crosses = rng.random((len(self.weight), trials)) < self.weight[:, np.newaxis]
+
+        # One pass in topological order settles an acyclic graph. With
+        # cycles, failures can only spread, so sweep until nothing changes
+        changed = True
+        while changed:
+            changed = False
+            for v in self.order:
+                lo, hi = self.in_start[v], self.in_start[v + 1]
+                reached = np.logical_and(state[self.src[lo:hi]], crosses[lo:hi])
+                if self.vote_k[v]:
+                    new = np.count_nonzero(reached, axis=0) >= self.vote_k[v]
+                elif self.is_AND[v]:
+                    new = np.all(reached, axis=0)
+                else:
+                    new = np.logical_or(state[v], np.any(reached, axis=0))
+
+                if not self.acyclic and not changed:
+                    changed = np.any(new != state[v])
+                state[v] = new
+
+        return state
+
+# Runs one shard in a worker process
+def simulate_shard(model: MonteCarloModel, trials: int, seed: np.random.SeedSequence) -> np.ndarray:
+    return model.simulate(trials, np.random.default_rng(seed))
+
+# Estimated failure probabilities with confidence intervals
+class MonteCarloResult:
+    def __init__(self, dg: DepGraph, fails: np.ndarray, trials: int, seconds: float, confidence: float) -> None:
+        n = dg.n
+        self.iref = dg.iref[:n].copy()
+        self.is_component = np.logical_and(dg.active[:n], np.logical_not(dg.is_AND[:n]))
+
+        self.trials = trials
+        self.seconds = seconds
+        self.trials_per_sec = trials / seconds if seconds > 0 else float("inf")
+        self.confidence = confidence
+
+        # Wilson score interval, which stays inside [0, 1]
+        # even for probabilities near 0 or 1
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        p = fails / trials
+        center = (p + z * z / (2 * trials)) / (1 + z * z / trials)
+        half = z * np.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / (1 + z * z / trials)
+
+        self.r = p
+        self.low = np.maximum(center - half, 0)
+        self.high = np.minimum(center + half, 1)
+
+    # Maps components to their estimated total risk, like DepGraph.get_r_dict
+    def get_r_dict(self) -> dict:
+        return { self.iref[i] : self.r[i] for i in np.flatnonzero(self.is_component) }
+
+    # Maps components to (low, high) bounds on their total risk
+    def get_interval_dict(self) -> dict:
+        return { self.iref[i] : (self.low[i], self.high[i]) for i in np.flatnonzero(self.is_component) }
+
+# Estimates every vertex's total risk from trials simulated failures.
+# Trials are split across processes worker processes, each with its
+# own generator spawned from seed, so results only depend on seed
+# and processes
+def monte_carlo(dg: DepGraph, trials: int=100_000, seed: int=None,
+                processes: int=1, confidence: float=0.95) -> MonteCarloResult:
+    model = MonteCarloModel(dg)
+    processes = max(1, min(processes or os.cpu_count(), trials))
+    seeds = np.random.SeedSequence(seed).spawn(processes)
+    shards = [trials // processes + (k < trials % processes) for k in range(processes)]
+
+    start = time.perf_counter()
+    if 1 == processes:
+        fails = simulate_shard(model, trials, seeds[0])
+    else:
+        with Pool(processes) as pool:
+            fails = sum(pool.starmap(simulate_shard, zip([model] * processes, shards, seeds)))
+
+    return MonteCarloResult(dg, fails, trials, time.perf_counter() - start, confidence)
+
+if __name__ == "__main__":
+    # On the chain a -> b -> c, c is exactly 1 - 0.7 * 0.82 = 0.426.
+    # calc_r treats the paths a -> b -> c and b -> c as independent,
+    # so it comes out a little higher unless SWEEP_DAGS is on
+    dg = DepGraph()
+    dg.add_vertices(['a', 'b', 'c', 'd'], [0.1, 0.2, 0.3, 0.4])
+    dg.add_edges([('a', 'b'), ('b', 'c')], [0.5, 0.75])
+    print("calc_r:     ", dg.calc_r())
+
+    res = monte_carlo(dg, 200_000, seed=0, processes=2)
+    print("monte_carlo:", res.r)
+    print("95% low:    ", res.low)
+    print("95% high:   ", res.high)
+    print(f"{res.trials_per_sec:,.0f} trials/sec")
+
+    # a reaches d along two paths that share a, which calc_r
+    # treats as independent
+    dg.add_edges([('a', 'd'), ('c', 'd')], [1, 1])
+    print("\ncalc_r:     ", dg.calc_r())
+    res = monte_carlo(dg, 200_000, seed=0, processes=2)
+    print("monte_carlo:", res.r)
+    print("95% low:    ", res.low)
+    print("95% high:   ", res.high)
@@ -0,0 +1,586 @@
+# @file storage.py
+# @author Evan Brody
+# @brief Storage backends for the adjacency and closure matrices of DepGraph
+
+import numpy as np
+
+# P(a U b)
+def scl_or_scl(a: float, b: float) -> float:
+    return 1 - (1 - a) * (1 - b)
+
+# a is the probability of OR{b, ...}
+# b is the event to remove
+def or_inv(a: float, b: float) -> float:
+    return (a - b) / (1 - b)
+
+# Both backends store, for a graph with vertex indices 0..n-1,
+#   A:          [b, a] = weight of the edge a -> b
+#   A_collapse: [i, j] = OR of the weights of paths j -> i with weight < 1
+#   one_count:  [i, j] = count of paths j -> i with weight = 1, never below 0
+# and are driven by DepGraph through the same set of methods.
+# The diagonal of the closure is always 0
+
+# Bits are packed little-endian: bit j of a row is bit j % 64 of word j // 64
+BIT_WORD = np.dtype("<u8")
+
+# Number of 64-bit words needed to hold n bits
+def bit_words(n: int) -> int:
+    return (n + 63) // 64
+
+# Packs the last axis of a boolean array into words
+def pack_bits(mask: np.ndarray, words: int) -> np.ndarray:
+    padded = np.zeros(mask.shape[:-1] + (words * 64,), bool)
+    padded[..., :mask.shape[-1]] = mask
+    return np.packbits(padded, axis=-1, bitorder="little").view(BIT_WORD)
+
+# Unpacks the first n bits of each row of words
+def unpack_bits(words: np.ndarray, n: int) -> np.ndarray:
+    return np.unpackbits(
+        np.ascontiguousarray(words).view(np.uint8), axis=-1, count=n, bitorder="little"
+    ).astype(bool)
+
+# Key for pair [i, j] in one_refs
+def pair_key(i: np.ndarray, j: np.ndarray) -> np.ndarray:
+    return (np.asarray(i, np.int64) << 32) | np.asarray(j, np.int64)
+
+def key_pair(keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    return keys >> 32, keys & 0xFFFF_FFFF
+
+# Keeps A and A_collapse in capacity x capacity arrays.
+# one_count is split into one_bits, a packed bitset with [i, j] set
+# when there's at least one path j -> i of weight 1, and one_refs,
+# sorted pair keys with the extra count for pairs with more than one
+class DenseStorage:
+    sparse = False
+
+    def __init__(self, capacity: int) -> None:
+        self.A = np.zeros((capacity, capacity), np.double)
+        self.A_collapse = np.zeros((capacity, capacity), np.double)
+        self.one_bits = np.zeros((capacity, bit_words(capacity)), BIT_WORD)
+        self.set_refs(np.zeros(0, np.int64), np.zeros(0, np.int64))
+
+    def set_refs(self, keys: np.ndarray, extra: np.ndarray) -> None:
+        order = np.argsort(keys, kind="stable")
+        self.one_refs = (keys[order], extra[order])
+
+    # Extra counts for keys, 0 where a key has none
+    def find_refs(self, keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        ref_keys, ref_extra = self.one_refs
+        pos = np.minimum(np.searchsorted(ref_keys, keys), max(len(ref_keys) - 1, 0))
+        found = ref_keys[pos] == keys if len(ref_keys) else np.zeros(len(keys), bool)
+        return pos, np.where(found, ref_extra[pos] if len(ref_keys) else 0, 0)
+
+    # Keeps only the refs selected by the boolean mask keep
+    def filter_refs(self, keep: np.ndarray) -> None:
+        ref_keys, ref_extra = self.one_refs
+        self.one_refs = (ref_keys[keep], ref_extra[keep])
+
+    def resize(self, capacity: int, n: int) -> None:
+        if capacity == len(self.A):
+            return
+
+        def resized(old: np.ndarray) -> np.ndarray:
+            new = np.zeros((capacity, capacity), old.dtype)
+            new[:n, :n] = old[:n, :n]
+            return new
+
+        self.A = resized(self.A)
+        self.A_collapse = resized(self.A_collapse)
+
+        words = bit_words(capacity)
+        one_bits = np.zeros((capacity, words), BIT_WORD)
+        keep = min(words, self.one_bits.shape[1])
+        one_bits[:n, :keep] = self.one_bits[:n, :keep]
+        self.one_bits = one_bits
+
+    # Sets or clears the bits in columns cols of rows
+    def set_bit_cols(self, rows: np.ndarray, cols: np.ndarray, value: bool) -> None:
+        mask = np.zeros(self.one_bits.shape[1] * 64, bool)
+        mask[cols] = True
+        col_words = pack_bits(mask, self.one_bits.shape[1])
+        if value:
+            self.one_bits[rows] |= col_words
+        else:
+            self.one_bits[rows] &= ~col_words
+
+    # Zeroes everything touching the new vertices lo..hi-1
+    def clear(self, lo: int, hi: int) -> None:
+        for mat in (self.A, self.A_collapse):
+            mat[lo:hi, :hi] = 0
+            mat[:lo, lo:hi] = 0
+
+        self.one_bits[lo:hi] = 0
+        self.set_bit_cols(slice(None, lo), slice(lo, hi), False)
+        ref_i, ref_j = key_pair(self.one_refs[0])
+        self.filter_refs(np.maximum(ref_i, ref_j) < lo)
+
+    def one_mask(self, n: int) -> np.ndarray:
+        return unpack_bits(self.one_bits[:n], n)
+
+    # Number of connected pairs in the closure
+    def nnz(self, n: int) -> int:
+        return np.count_nonzero(np.logical_or(self.A_collapse[:n, :n], self.one_mask(n)))
+
+    # The stored matrix called name, for inspection. one_count
+    # is rebuilt from one_bits and one_refs
+    def dense(self, name: str, n: int) -> np.ndarray:
+        if "one_count" != name:
+            return getattr(self, name)
+
+        one_count = self.one_mask(n).astype(np.uint64)
+        ref_i, ref_j = key_pair(self.one_refs[0])
+        one_count[ref_i, ref_j] += self.one_refs[1].astype(np.uint64)
+        return one_count
+
+    def get_edge(self, b: int, a: int) -> float:
+        return self.A[b, a]
+
+    def set_edge(self, b: int, a: int, weight: float) -> None:
+        self.A[b, a] = weight
+
+    # Vertices with an edge into v
+    def in_edges(self, v: int, n: int) -> np.ndarray:
+        return np.flatnonzero(self.A[v, :n])
+
+    # Vertices with an edge out of v
+    def out_edges(self, v: int, n: int) -> np.ndarray:
+        return np.flatnonzero(self.A[:n, v])
+
+    def one_bit(self, i: int, j: int) -> bool:
+        j = int(j)
+        return bool((int(self.one_bits[i, j >> 6]) >> (j & 63)) & 1)
+
+    # Column j of the bitset, for rows 0..n-1
+    def one_col(self, j: int, n: int) -> np.ndarray:
+        return ((self.one_bits[:n, j >> 6] >> np.uint64(j & 63)) & np.uint64(1)).astype(bool)
+
+    # (A_collapse[i, j], one_count[i, j])
+    def get_path(self, i: int, j: int) -> tuple[float, int]:
+        _, extra = self.find_refs(pair_key([i], [j]))
+        return self.A_collapse[i, j], int(self.one_bit(i, j)) + int(extra[0])
+
+    def Ac_full_entry(self, i: int, j: int) -> float:
+        return max(self.A_collapse[i, j], int(self.one_bit(i, j)))
+
+    def Ac_full_col(self, j: int, n: int) -> np.ndarray:
+        return np.maximum(self.A_collapse[:n, j], self.one_col(j, n))
+
+    def Ac_full_row(self, i: int, n: int) -> np.ndarray:
+        return np.maximum(self.A_collapse[i, :n], unpack_bits(self.one_bits[i], n))
+
+    def Ac_full_rows(self, rows: np.ndarray, n: int) -> np.ndarray:
+        return np.maximum(self.A_collapse[rows, :n], unpack_bits(self.one_bits[rows], n))
+
+    # Adds one weight-1 path for each True entry of ones, a boolean
+    # matrix over rows x (the first ones.shape[1] columns)
+    def add_ones(self, rows: np.ndarray, ones: np.ndarray) -> None:
+        if not np.any(ones):
+            return
+
+        new_words = pack_bits(ones, self.one_bits.shape[1])
+        old_words = self.one_bits[rows]
+
+        # Pairs that were already reachable take an extra reference
+        k, j = np.nonzero(unpack_bits(old_words & new_words, ones.shape[1]))
+        if len(k):
+            keys = pair_key(rows[k], j)
+            pos, extra = self.find_refs(keys)
+            shared = extra > 0
+            ref_extra = self.one_refs[1].copy()
+            ref_extra[pos[shared]] += 1
+
+            # keys comes out sorted since rows is increasing
+            new = np.logical_not(shared)
+            at = np.searchsorted(self.one_refs[0], keys[new])
+            self.one_refs = (
+                np.insert(self.one_refs[0], at, keys[new]),
+                np.insert(ref_extra, at, 1)
+            )
+
+        self.one_bits[rows] = old_words | new_words
+
+    # Inverse of add_ones. Counts stop at zero
+    def remove_ones(self, rows: np.ndarray, ones: np.ndarray) -> None:
+        if not np.any(ones):
+            return
+
+        # Pairs with extra references drop one and stay reachable
+        k, j = np.nonzero(ones)
+        pos, extra = self.find_refs(pair_key(rows[k], j))
+        shared = extra > 0
+        if np.any(shared):
+            ref_extra = self.one_refs[1].copy()
+            ref_extra[pos[shared]] -= 1
+            self.one_refs = (self.one_refs[0], ref_extra)
+            self.filter_refs(ref_extra > 0)
+            ones[k[shared], j[shared]] = False
+
+        self.one_bits[rows] &= ~pack_bits(ones, self.one_bits.shape[1])
+
+    # OR a single path of weight w into [i, j]
+    def combine_path(self, i: int, j: int, w: float) -> None:
+        if 1 == w:
+            ones = np.zeros((1, j + 1), bool)
+            ones[0, j] = True
+            self.add_ones(np.array([i]), ones)
+        elif w > 0:
+            self.A_collapse[i, j] = scl_or_scl(self.A_collapse[i, j], w)
+
+    # Inverse of combine_path
+    def remove_path(self, i: int, j: int, w: float) -> None:
+        if 1 == w:
+            ones = np.zeros((1, j + 1), bool)
+            ones[0, j] = True
+            self.remove_ones(np.array([i]), ones)
+        elif w > 0:
+            self.A_collapse[i, j] = or_inv(self.A_collapse[i, j], w)
+
+    # Paths of weight u[j] * (v[i] if through[j] else 1) for i -> j,
+    # restricted to the block selected by the boolean masks rows x cols
+    def outer_paths(self, rows: np.ndarray, cols: np.ndarray,
+                    u: np.ndarray, v: np.ndarray, through: np.ndarray) -> np.ndarray:
+        return u[cols][np.newaxis, :] * np.where(
+            through[cols][np.newaxis, :], v[rows][:, np.newaxis], 1.0
+        )
+
+    # Weight-1 entries of a rows x cols block, spread over all n columns
+    def block_ones(self, paths: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        ones = np.zeros((paths.shape[0], len(cols)), bool)
+        ones[:, cols] = 1 == paths
+        return ones
+
+    # Restores the zero diagonal inside the block rows x cols
+    def clear_block_diagonal(self, rows: np.ndarray, cols: np.ndarray) -> None:
+        both = np.flatnonzero(np.logical_and(rows, cols))
+        self.A_collapse[both, both] = 0
+        if len(both):
+            self.one_bits[both, both >> 6] &= ~(np.uint64(1) << (both & 63).astype(np.uint64))
+            pos, extra = self.find_refs(pair_key(both, both))
+            if np.any(extra):
+                keep = np.ones(len(self.one_refs[0]), bool)
+                keep[pos[extra > 0]] = False
+                self.filter_refs(keep)
+
+    # OR outer_paths(...) into the closure. Paths of weight 1 go into
+    # the bitset instead, and paths of weight 0 are skipped
+    def combine_outer(self, rows: np.ndarray, cols: np.ndarray,
+                      u: np.ndarray, v: np.ndarray, through: np.ndarray) -> None:
+        block = np.ix_(rows, cols)
+        paths = self.outer_paths(rows, cols, u, v, through)
+
+        ones = 1 == paths
+        self.add_ones(np.flatnonzero(rows), self.block_ones(paths, cols))
+
+        Ac_block = self.A_collapse[block]
+        to_or = np.logical_and(np.logical_not(ones), paths > 0)
+        Ac_block[to_or] = scl_or_scl(Ac_block[to_or], paths[to_or])
+        self.A_collapse[block] = Ac_block
+
+        self.clear_block_diagonal(rows, cols)
+
+    # Inverse of combine_outer
+    def remove_outer(self, rows: np.ndarray, cols: np.ndarray,
+                     u: np.ndarray, v: np.ndarray, through: np.ndarray) -> None:
+        block = np.ix_(rows, cols)
+        paths = self.outer_paths(rows, cols, u, v, through)
+
+        ones = 1 == paths
+        self.remove_ones(np.flatnonzero(rows), self.block_ones(paths, cols))
+
+        Ac_block = self.A_collapse[block]
+        to_remove = np.logical_and(np.logical_not(ones), paths > 0)
+        Ac_block[to_remove] = or_inv(Ac_block[to_remove], paths[to_remove])
+        self.A_collapse[block] = Ac_block
+
+        self.clear_block_diagonal(rows, cols)
+
+    # Zeroes the rows and columns of the vertices in slots
+    def clear_slots(self, slots: np.ndarray) -> None:
+        for mat in (self.A, self.A_collapse):
+            mat[slots] = 0
+            mat[:, slots] = 0
+
+        self.one_bits[slots] = 0
+        self.set_bit_cols(slice(None), slots, False)
+        ref_i, ref_j = key_pair(self.one_refs[0])
+        self.filter_refs(np.logical_not(np.logical_or(np.isin(ref_i, slots), np.isin(ref_j, slots))))
+
+    # Moves the vertices in keep, an increasing array of indices
+    # below n, to 0..len(keep)-1 and zeroes the rest
+    def compact(self, keep: np.ndarray, n: int) -> None:
+        m = len(keep)
+        block = np.ix_(keep, keep)
+        for mat in (self.A, self.A_collapse):
+            mat[:m, :m] = mat[block]
+            mat[m:n, :n] = 0
+            mat[:m, m:n] = 0
+
+        one_mask = self.one_mask(n)[block]
+        self.one_bits[:n] = 0
+        self.one_bits[:m] = pack_bits(one_mask, self.one_bits.shape[1])
+
+        new_index = np.full(n, -1, np.int64)
+        new_index[keep] = np.arange(m)
+        ref_i, ref_j = key_pair(self.one_refs[0])
+        self.filter_refs(np.logical_and(new_index[ref_i] >= 0, new_index[ref_j] >= 0))
+        ref_i, ref_j = key_pair(self.one_refs[0])
+        self.one_refs = (pair_key(new_index[ref_i], new_index[ref_j]), self.one_refs[1])
+
+    # Nonzero entries as coordinate arrays, for converting between backends
+    # Edges as coordinate arrays (b, a, weight of a -> b)
+    def edge_coo(self, n: int) -> tuple[np.ndarray]:
+        A_rows, A_cols = np.nonzero(self.A[:n, :n])
+        return A_rows, A_cols, self.A[A_rows, A_cols]
+
+    def export(self, n: int) -> dict:
+        one_count = self.dense("one_count", n)
+        P_rows, P_cols = np.nonzero(np.logical_or(self.A_collapse[:n, :n], one_count))
+        return {
+            "A": self.edge_coo(n),
+            "paths": (
+                P_rows, P_cols,
+                self.A_collapse[P_rows, P_cols],
+                one_count[P_rows, P_cols]
+            ),
+        }
+
+    def load(self, entries: dict) -> None:
+        A_rows, A_cols, A_vals = entries["A"]
+        self.A[A_rows, A_cols] = A_vals
+
+        P_rows, P_cols, P_Ac, P_ones = entries["paths"]
+        self.A_collapse[P_rows, P_cols] = P_Ac
+
+        reached = P_ones > 0
+        n = max(P_rows.max(initial=-1), P_cols.max(initial=-1)) + 1
+        one_mask = np.zeros((n, n), bool)
+        one_mask[P_rows[reached], P_cols[reached]] = True
+        self.one_bits[:n] = pack_bits(one_mask, self.one_bits.shape[1])
+        shared = P_ones > 1
+        self.set_refs(
+            pair_key(P_rows[shared], P_cols[shared]),
+            P_ones[shared].astype(np.int64) - 1
+        )
+
+# Keeps A as dict-of-keys rows and columns, and keeps closure
+# entries only for connected pairs. Memory and the cost of most
+# operations scale with the number of reachable pairs, not n^2
+class SparseStorage:
+    sparse = True
+
+    # Closure entries smaller than this with no weight-1 paths are dropped
+    PRUNE_TOL = 1e-12
+
+    def __init__(self) -> None:
+        # A_in[b][a] = A_out[a][b] = weight of the edge a -> b
+        self.A_in = {}
+        self.A_out = {}
+        # rows[i][j] = cols[j][i] = [A_collapse[i, j], one_count[i, j]]
+        # Both dicts share the same list, so each entry is stored once
+        self.rows = {}
+        self.cols = {}
+        self.cells = 0
+
+    # Nothing is preallocated
+    def resize(self, capacity: int, n: int) -> None:
+        pass
+
+    # Deleted vertices take their entries with them, so new ones start empty
+    def clear(self, lo: int, hi: int) -> None:
+        pass
+
+    def nnz(self, n: int) -> int:
+        return self.cells
+
+    # A dense n x n copy of the matrix called name, for inspection
+    def dense(self, name: str, n: int) -> np.ndarray:
+        if "A" == name:
+            res = np.zeros((n, n), np.double)
+            for b, row in self.A_in.items():
+                for a, w in row.items():
+                    res[b, a] = w
+            return res
+
+        dtype = np.uint64 if "one_count" == name else np.double
+        k = 1 if "one_count" == name else 0
+        res = np.zeros((n, n), dtype)
+        for i, row in self.rows.items():
+            for j, cell in row.items():
+                res[i, j] = cell[k]
+        return res
+
+    def get_edge(self, b: int, a: int) -> float:
+        return self.A_in.get(b, {}).get(a, 0.0)
+
+    def set_edge(self, b: int, a: int, weight: float) -> None:
+        if weight:
+            self.A_in.setdefault(b, {})[a] = weight
+            self.A_out.setdefault(a, {})[b] = weight
+        else:
+            self.A_in.get(b, {}).pop(a, None)
+            self.A_out.get(a, {}).pop(b, None)
+
+    def in_edges(self, v: int, n: int) -> np.ndarray:
+        return np.array(sorted(self.A_in.get(v, ())), int)
+
+    def out_edges(self, v: int, n: int) -> np.ndarray:
+        return np.array(sorted(self.A_out.get(v, ())), int)
+
+    def get_path(self, i: int, j: int) -> tuple[float, int]:
+        cell = self.rows.get(i, {}).get(j)
+        return (cell[0], cell[1]) if cell else (0.0, 0)
+
+    def cell(self, i: int, j: int) -> list:
+        row = self.rows.setdefault(i, {})
+        cell = row.get(j)
+        if cell is None:
+            cell = row[j] = [0.0, 0]
+            self.cols.setdefault(j, {})[i] = cell
+            self.cells += 1
+        return cell
+
+    def prune(self, i: int, j: int, cell: list) -> None:
+        if 0 == cell[1] and abs(cell[0]) < self.PRUNE_TOL:
+            del self.rows[i][j]
+            del self.cols[j][i]
+            self.cells -= 1
+
+    @staticmethod
+    def cell_full(cell: list) -> float:
+        return max(cell[0], int(bool(cell[1])))
+
+    def Ac_full_entry(self, i: int, j: int) -> float:
+        cell = self.rows.get(i, {}).get(j)
+        return self.cell_full(cell) if cell else 0
+
+    def Ac_full_col(self, j: int, n: int) -> np.ndarray:
+        res = np.zeros(n, np.double)
+        for i, cell in self.cols.get(j, {}).items():
+            res[i] = self.cell_full(cell)
+        return res
+
+    def Ac_full_row(self, i: int, n: int) -> np.ndarray:
+        res = np.zeros(n, np.double)
+        for j, cell in self.rows.get(i, {}).items():
+            res[j] = self.cell_full(cell)
+        return res
+
+    def Ac_full_rows(self, rows: np.ndarray, n: int) -> np.ndarray:
+        res = np.zeros((len(rows), n), np.double)
+        for k, i in enumerate(rows):
+            for j, cell in self.rows.get(i, {}).items():
+                res[k, j] = self.cell_full(cell)
+        return res
+
+    # Nonzero entries of the full collapse matrix as coordinate arrays
+    def Ac_full_coo(self, n: int) -> tuple[np.ndarray]:
+        rows, cols, vals = [], [], []
+        for i, row in self.rows.items():
+            for j, cell in row.items():
+                rows.append(i)
+                cols.append(j)
+                vals.append(self.cell_full(cell))
+        return np.array(rows, int), np.array(cols, int), np.array(vals, np.double)
+
+    def combine_path(self, i: int, j: int, w: float) -> None:
+        if i == j or not w > 0:
+            return
+
+        cell = self.cell(i, j)
+        if 1 == w:
+            cell[1] += 1
+        else:
+            cell[0] = scl_or_scl(cell[0], w)
+
+    def remove_path(self, i: int, j: int, w: float) -> None:
+        if i == j or not w > 0:
+            return
+
+        cell = self.cell(i, j)
+        if 1 == w:
+            cell[1] = max(cell[1] - 1, 0)
+        else:
+            cell[0] = or_inv(cell[0], w)
+        self.prune(i, j, cell)
+
+    # Calls apply(i, j, path) for every nonzero path of DenseStorage.outer_paths
+    def for_outer_paths(self, rows: np.ndarray, cols: np.ndarray,
+                        u: np.ndarray, v: np.ndarray, through: np.ndarray, apply) -> None:
+        through_to = np.flatnonzero(np.logical_and(rows, v > 0))
+        through_v = v[through_to]
+        all_to = None
+
+        for j in np.flatnonzero(np.logical_and(cols, u > 0)).tolist():
+            if through[j]:
+                to, paths = through_to, u[j] * through_v
+            else:
+                if all_to is None:
+                    all_to = np.flatnonzero(rows)
+                to, paths = all_to, np.full(len(all_to), u[j])
+
+            for i, path in zip(to.tolist(), paths.tolist()):
+                apply(i, j, path)
+
+    def combine_outer(self, rows: np.ndarray, cols: np.ndarray,
+                      u: np.ndarray, v: np.ndarray, through: np.ndarray) -> None:
+        self.for_outer_paths(rows, cols, u, v, through, self.combine_path)
+
+    def remove_outer(self, rows: np.ndarray, cols: np.ndarray,
+                     u: np.ndarray, v: np.ndarray, through: np.ndarray) -> None:
+        self.for_outer_paths(rows, cols, u, v, through, self.remove_path)
+
+    def clear_slots(self, slots: np.ndarray) -> None:
+        for v in slots.tolist():
+            for a in self.A_in.pop(v, {}):
+                del self.A_out[a][v]
+            for b in self.A_out.pop(v, {}):
+                del self.A_in[b][v]
+
+            for j in self.rows.pop(v, {}):
+                del self.cols[j][v]
+                self.cells -= 1
+            for i in self.cols.pop(v, {}):
+                del self.rows[i][v]
+                self.cells -= 1
+
+    def compact(self, keep: np.ndarray, n: int) -> None:
+        entries = self.export(n)
+        new_index = np.full(n, -1, np.int64)
+        new_index[keep] = np.arange(len(keep))
+
+        A_rows, A_cols, A_vals = entries["A"]
+        A_rows, A_cols = new_index[A_rows], new_index[A_cols]
+        k = np.logical_and(A_rows >= 0, A_cols >= 0)
+        entries["A"] = (A_rows[k], A_cols[k], A_vals[k])
+
+        P_rows, P_cols, P_Ac, P_ones = entries["paths"]
+        P_rows, P_cols = new_index[P_rows], new_index[P_cols]
+        k = np.logical_and(P_rows >= 0, P_cols >= 0)
+        entries["paths"] = (P_rows[k], P_cols[k], P_Ac[k], P_ones[k])
+
+        self.__init__()
+        self.load(entries)
+
+    def edge_coo(self, n: int) -> tuple[np.ndarray]:
+        A = [(b, a, w) for b, row in self.A_in.items() for a, w in row.items()]
+        A_rows, A_cols, A_vals = zip(*A) if A else ((), (), ())
+        return np.array(A_rows, int), np.array(A_cols, int), np.array(A_vals, np.double)
+
+    def export(self, n: int) -> dict:
+        paths = [(i, j, c[0], c[1]) for i, row in self.rows.items() for j, c in row.items()]
+        P_rows, P_cols, P_Ac, P_ones = zip(*paths) if paths else ((), (), (), ())
+        return {
+            "A": self.edge_coo(n),
+            "paths": (
+                np.array(P_rows, int), np.array(P_cols, int),
+                np.array(P_Ac, np.double), np.array(P_ones, np.uint64)
+            ),
+        }
+
+    def load(self, entries: dict) -> None:
+        for b, a, w in zip(*(arr.tolist() for arr in entries["A"])):
+            self.set_edge(b, a, w)
+
+        for i, j, ac, ones in zip(*(arr.tolist() for arr in entries["paths"])):
+            cell = self.cell(i, j)
+            cell[0], cell[1] = ac, ones
@@ -0,0 +1,83 @@
+# @file test_bdd.py
+# @author Evan Brody
+# @brief Checks BDDEvaluator against exhaustive enumeration on small graphs
+
+import os, sys
+import numpy as np
+import pytest
+from itertools import product
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph.dep_graph import DepGraph
+from graph.bdd import BDDEvaluator
+
+# Each vertex's failure probability, found by trying every combination
+# of direct failures and edges carrying them. Each combination is
+# settled to its least fixed point, as the simulation describes
+def enumerate_risks(dg: DepGraph) -> np.ndarray:
+    n = dg.n
+    is_AND, vote_k = dg.is_AND[:n], dg.vote_k[:n]
+    comps = np.flatnonzero(np.logical_and(dg.active[:n], np.logical_not(is_AND)))
+    b, a, w = dg.storage.edge_coo(n)
+
+    risks = np.zeros(n, np.double)
+    for outcome in product((False, True), repeat=len(comps) + len(w)):
+        direct = np.zeros(n, bool)
+        direct[comps] = outcome[:len(comps)]
+        crosses = np.array(outcome[len(comps):], bool)
+        p = np.prod(np.where(direct[comps], dg.r0[comps], 1 - dg.r0[comps]))
+        p *= np.prod(np.where(crosses, w, 1 - w))
+        if 0 == p:
+            continue
+
+        fails = np.zeros(n, bool)
+        changed = True
+        while changed:
+            reached = np.zeros(n, int)
+            np.add.at(reached, b, np.logical_and(fails[a], crosses))
+            in_degree = np.bincount(b, minlength=n)
+            new = np.where(vote_k > 0, reached >= vote_k,
+                  np.where(is_AND, np.logical_and(in_degree > 0, reached == in_degree),
+                           np.logical_or(direct, reached > 0)))
+            changed = np.any(new != fails)
+            fails = new
+        risks[fails] += p
+    return risks
+
+# A random graph with n vertices and m edges, cycles allowed
+def random_graph(seed: int, n: int=6, m: int=8) -> DepGraph:
+    rng = np.random.default_rng(seed)
+    edges = set()
+    while len(edges) < m:
+        a, b = rng.choice(n, 2, replace=False).tolist()
+        edges.add((a, b))
+    gates = rng.random(n) < 0.3
+    dg = DepGraph.build(list(range(n)), sorted(edges), rng.choice([1, 0.5, 0.75], m).tolist(),
+                        and_flags=gates.tolist(), direct_risks=rng.uniform(0, 0.6, n).tolist())
+    for g in np.flatnonzero(gates)[::2]:
+        dg.vote_k[g] = rng.integers(1, 3)
+    dg.invalidate()
+    return dg
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_enumeration(seed):
+    dg = random_graph(seed)
+    assert BDDEvaluator(dg).evaluate() == pytest.approx(enumerate_risks(dg), abs=1e-12)
+
+# s fails out through both a and b, so the AND gate's inputs aren't
+# independent: P(s OR (a AND b)) = 0.5 + 0.5 * 0.01
+def test_shared_input():
+    dg = DepGraph()
+    dg.add_vertices(['s', 'a', 'b', 'out'], [0.5, 0.1, 0.1, 0.0])
+    dg.add_AND_gate('AND')
+    dg.add_edges([('s', 'a'), ('s', 'b'), ('a', 'AND'), ('b', 'AND'), ('AND', 'out')], [1, 1, 1, 1, 1])
+    assert BDDEvaluator(dg).get_r_dict()['out'] == pytest.approx(0.5 + 0.5 * 0.01)
+
+def test_batch_matches_single():
+    dg = random_graph(0)
+    ev = BDDEvaluator(dg)
+    R0 = np.random.default_rng(1).random((4, dg.n))
+    batch = ev.evaluate_batch(R0)
+    for s in range(len(R0)):
+        assert batch[s] == pytest.approx(ev.evaluate(R0[s]), abs=1e-12)
@@ -0,0 +1,246 @@
+# @file test_dep_graph.py
+# @author Evan Brody
+# @brief Checks DepGraph against small graphs with known answers
+
+import os, sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph.dep_graph import DepGraph
+from graph import bench_dep_graph
+
+STORAGES = ("dense", "sparse")
+
+# The vectorized closure and AND gate weights match the loops they
+# replaced, with some inputs at zero risk and some gates unconnected
+@pytest.mark.parametrize("seed", range(5))
+def test_vectorized_matches_loops(seed):
+    rng = np.random.default_rng(seed)
+    dg = bench_dep_graph.random_graph(12, rng)
+    gates = np.flatnonzero(dg.is_AND[:dg.n])
+    inputs = np.flatnonzero(np.logical_and(np.any(dg.calc_Ac_full()[gates[::2]], axis=0), np.logical_not(dg.is_AND[:dg.n])))
+    dg.r0[inputs[::3]] = 0
+    dg.add_AND_gate('unconnected')
+    assert np.array_equal(dg.calc_Ac_full(), bench_dep_graph.loop_calc_Ac_full(dg))
+    assert bench_dep_graph.vec_update_AND_weights(dg) == pytest.approx(bench_dep_graph.loop_update_AND_weights(dg), rel=1e-9, abs=0)
+
+    dg.set_storage("sparse")
+    assert bench_dep_graph.vec_update_AND_weights(dg) == pytest.approx(bench_dep_graph.loop_update_AND_weights(dg), rel=1e-9, abs=0)
+
+# A slot freed by delete_vertex and reused by add_vertex must come back
+# empty, even if edge updates ran while it was free
+@pytest.mark.parametrize("storage", STORAGES)
+def test_reused_slot_has_no_paths(storage):
+    dg = DepGraph(storage=storage)
+    dg.add_vertices(['x'] + list("abcdefg"))
+    dg.add_edge(('a', 'b'), 0.5)
+    dg.delete_vertex('x')
+    dg.add_edge(('c', 'd'), 1)
+    dg.update_edge(('a', 'b'), 0.3)
+    dg.add_vertex('new')
+
+    i = dg.refi['new']
+    Ac_full = dg.calc_Ac_full()
+    assert not np.any(Ac_full[i])
+    assert not np.any(Ac_full[:, i])
+    assert not np.any(dg.one_count[i])
+    assert not np.any(dg.one_count[:, i])
+
+# Updating an edge only changes paths through it
+@pytest.mark.parametrize("storage", STORAGES)
+def test_update_edge_keeps_other_paths(storage):
+    dg = DepGraph(storage=storage)
+    dg.add_vertices(list("abcdef"))
+    dg.add_edges([('a', 'b'), ('b', 'c'), ('c', 'd'), ('e', 'f')], [0.5, 0.5, 0.5, 0.5])
+    dg.update_edge(('b', 'c'), 0.2)
+
+    path = lambda a, b: dg.calc_Ac_full()[dg.refi[b], dg.refi[a]]
+    assert path('a', 'd') == pytest.approx(0.5 * 0.2 * 0.5)
+    assert path('b', 'c') == pytest.approx(0.2)
+    assert path('e', 'f') == pytest.approx(0.5)
+    assert path('a', 'e') == 0
+    assert path('e', 'a') == 0
+
+# a, b -> AND gate G -> c, with a and b only reaching c through G
+def gate_graph(vote_k: int=0) -> DepGraph:
+    dg = DepGraph()
+    dg.add_vertices(['a', 'b', 'c'], [0.5, 0.5, 0.1])
+    if vote_k:
+        dg.add_vote_gate('G', vote_k)
+    else:
+        dg.add_AND_gate('G')
+    dg.add_edges([('a', 'G'), ('b', 'G'), ('G', 'c')], [1, 1, 1])
+    return dg
+
+def test_importance_through_AND_gate():
+    imp = gate_graph().importance('c')
+    for ref in ('a', 'b'):
+        assert imp["birnbaum"][ref] == pytest.approx(0.5 * 0.9)
+        assert imp["birnbaum"][ref] > 0
+        assert 0 <= imp["fussell_vesely"][ref] <= 1
+        assert 0 <= imp["criticality"][ref] <= 1
+
+# 1-of-2: a failing always fails G, a never failing leaves b's 0.5
+def test_importance_through_vote_gate():
+    imp = gate_graph(vote_k=1).importance('c')
+    assert imp["birnbaum"]['a'] == pytest.approx(1 - (1 - 0.9 * 0.5))
+    assert 0 <= imp["fussell_vesely"]['a'] <= 1
+
+def test_zero_risk_input_zeroes_AND_gate():
+    dg = gate_graph()
+    dg.update_vertex('a', 0)
+    assert dg.get_r_dict()['c'] == pytest.approx(0.1)
+
+# A random acyclic graph on 0..n-1, with some AND and 1-of-n gates
+def random_dag(seed: int, n: int=9, m: int=12, storage: str="dense") -> DepGraph:
+    rng = np.random.default_rng(seed)
+    edges = set()
+    while len(edges) < m:
+        a, b = sorted(rng.choice(n, 2, replace=False).tolist())
+        edges.add((a, b))
+    gates = rng.random(n) < 0.3
+    dg = DepGraph.build(list(range(n)), sorted(edges), and_flags=gates.tolist(),
+                        direct_risks=rng.random(n).tolist(), storage=storage)
+    for g in np.flatnonzero(gates)[::2]:
+        dg.vote_k[g] = 1
+    dg.invalidate()
+    return dg
+
+# Every measure matches perturbing each component on its own copy
+@pytest.mark.parametrize("seed", range(10))
+def test_importance_matches_perturbation(seed):
+    dg = random_dag(seed)
+    gates = dg.is_AND[:dg.n]
+    t = int(np.flatnonzero(np.logical_not(gates))[-1])
+    r_t = dg.calc_r()[t]
+    imp = dg.importance(t)
+    for j in imp["birnbaum"]:
+        r_t_j = []
+        for r0_j in (1, 0):
+            perturbed = dg.copy()
+            perturbed.update_vertex(j, r0_j)
+            r_t_j.append(perturbed.calc_r()[t])
+        assert imp["birnbaum"][j] == pytest.approx(r_t_j[0] - r_t_j[1], abs=1e-12)
+        assert imp["fussell_vesely"][j] == pytest.approx((r_t - r_t_j[1]) / r_t, abs=1e-12)
+
+# Updating only the rows a direct risk change reaches gives the same
+# risks as recomputing all of them, including through gates
+@pytest.mark.parametrize("storage", STORAGES)
+@pytest.mark.parametrize("seed", range(5))
+def test_dirty_calc_r_matches_full(storage, seed):
+    dg = random_dag(seed, storage=storage)
+    dg.RECALC_ALL_ABOVE = 1
+    dg.calc_r()
+    rng = np.random.default_rng(seed)
+    comps = np.flatnonzero(np.logical_not(dg.is_AND[:dg.n]))
+    for step in range(4):
+        for j in rng.choice(comps, 2, replace=False):
+            dg.update_vertex(int(j), 0 if 0 == step else rng.random())
+        assert dg.dirty
+        dirty_r = dg.calc_r().copy()
+        dg.invalidate()
+        assert dirty_r == pytest.approx(dg.calc_r(), abs=1e-12)
+
+# By default, a cycle elsewhere in the graph doesn't change c's risk
+def test_unrelated_cycle_keeps_risks():
+    dg = DepGraph()
+    dg.add_vertices(['a', 'b', 'c', 'x', 'y'], [0.5] * 5)
+    dg.add_AND_gate('G')
+    dg.add_edges([('a', 'b'), ('b', 'c'), ('a', 'G'), ('b', 'G'), ('G', 'c')], [1] * 5)
+    before = dg.get_r_dict()['c']
+    dg.add_edges([('x', 'y'), ('y', 'x')], [1, 1])
+    assert dg.get_r_dict()['c'] == pytest.approx(before)
+
+# The sweep can be turned on after the graph is built, and is exact on
+# a chain: c fails with 1 - 0.7 * (1 - 0.75 * 0.24)
+def test_sweep_turned_on_later():
+    dg = DepGraph()
+    dg.add_vertices(['a', 'b', 'c'], [0.1, 0.2, 0.3])
+    dg.add_edges([('a', 'b'), ('b', 'c')], [0.5, 0.75])
+    dg.SWEEP_DAGS = True
+    dg.invalidate()
+    assert dg.use_sweep()
+    assert dg.get_r_dict()['c'] == pytest.approx(1 - 0.7 * 0.82)
+
+    dg.add_edge(('c', 'a'), 1)
+    assert not dg.is_acyclic
+    assert not dg.use_sweep()
+
+# Everything save writes comes back from load, free slots included
+@pytest.mark.parametrize("storage", STORAGES)
+def test_save_load_round_trip(storage, tmp_path):
+    dg = DepGraph(storage=storage)
+    dg.add_vertices(list("abcdef"), [0.1, 0.2, 0.3, 0.4, 0.5, 0.6])
+    dg.add_AND_gate('G')
+    dg.add_vote_gate('V', 2)
+    dg.add_edges([('a', 'b'), ('b', 'c'), ('c', 'G'), ('d', 'G'), ('G', 'e'),
+                  ('a', 'V'), ('d', 'V'), ('f', 'V'), ('V', 'f')], [0.5, 1, 1, 0.75, 1, 1, 0.5, 1, 0.25])
+    dg.delete_vertex('b')
+
+    path = tmp_path / "graph.npz"
+    dg.save(path, scene_names=np.array(["x"]))
+    loaded, extra = DepGraph.load(path)
+
+    assert list(extra) == ["scene_names"]
+    assert loaded.refi == dg.refi
+    assert np.array_equal(loaded.calc_Ac_full(), dg.calc_Ac_full())
+    assert np.array_equal(loaded.vote_k[:dg.n], dg.vote_k[:dg.n])
+    assert loaded.get_r_dict() == pytest.approx(dg.get_r_dict())
+
+def test_save_rejects_mixed_keys(tmp_path):
+    dg = DepGraph()
+    dg.add_vertices([1, 'a'])
+    with pytest.raises(ValueError):
+        dg.save(tmp_path / "graph.npz")
+
+@pytest.mark.parametrize("contents", [b"", b"not a zip file", b"PK\x03\x04truncated"])
+def test_load_rejects_bad_files(contents, tmp_path):
+    path = tmp_path / "graph.npz"
+    path.write_bytes(contents)
+    with pytest.raises(ValueError):
+        DepGraph.load(path)
+
+def test_load_rejects_truncated_and_foreign_files(tmp_path):
+    dg = DepGraph()
+    dg.add_vertices(['a', 'b'])
+    dg.add_edge(('a', 'b'))
+    path = tmp_path / "graph.npz"
+    dg.save(path)
+
+    truncated = tmp_path / "truncated.npz"
+    data = path.read_bytes()
+    truncated.write_bytes(data[:len(data) // 2])
+    foreign = tmp_path / "foreign.npz"
+    np.savez(foreign, x=np.arange(3))
+    for bad in (truncated, foreign):
+        with pytest.raises(ValueError):
+            DepGraph.load(bad)
+
+# A snapshot keeps the graph as it was, and shares storage until the
+# graph changes an edge while the snapshot is still held
+@pytest.mark.parametrize("storage", STORAGES)
+def test_snapshot_is_isolated(storage):
+    dg = DepGraph(storage=storage)
+    dg.add_vertices(['a', 'b', 'c'], [0.1, 0.2, 0.3])
+    dg.add_edges([('a', 'b'), ('b', 'c')], [0.5, 0.5])
+    before = dg.get_r_dict()
+
+    snap = dg.snapshot()
+    dg.update_vertex('a', 0.9)
+    assert snap.storage is dg.storage
+    dg.add_vertex('d')
+    dg.add_edge(('c', 'a'), 1)
+    dg.update_edge(('a', 'b'), 1)
+    assert snap.storage is not dg.storage
+    snap.invalidate()
+    assert snap.get_r_dict() == pytest.approx(before)
+    assert dg.get_r_dict()['c'] > before['c']
+    snap.release()
+
+    snap = dg.snapshot()
+    snap.release()
+    storage = dg.storage
+    dg.add_edge(('d', 'a'), 0.5)
+    assert dg.storage is storage
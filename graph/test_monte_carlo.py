@@ -0,0 +1,29 @@
+# @file test_monte_carlo.py
+# @author Evan Brody
+# @brief Checks monte_carlo against exhaustive enumeration on small graphs
+
+import os, sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph.monte_carlo import monte_carlo
+from graph.test_bdd import enumerate_risks, random_graph
+
+# Every vertex's exact risk lands inside its confidence interval
+@pytest.mark.parametrize("seed", range(5))
+def test_interval_covers_enumeration(seed):
+    dg = random_graph(seed)
+    exact = enumerate_risks(dg)
+    res = monte_carlo(dg, 100_000, seed=seed, confidence=0.9999)
+    assert np.all(res.low <= exact + 1e-12)
+    assert np.all(exact <= res.high + 1e-12)
+    assert res.r == pytest.approx(exact, abs=0.01)
+
+# The same seed gives the same estimate across worker processes
+def test_seed_is_reproducible():
+    dg = random_graph(0)
+    first = monte_carlo(dg, 10_000, seed=1, processes=2)
+    second = monte_carlo(dg, 10_000, seed=1, processes=2)
+    assert np.array_equal(first.r, second.r)
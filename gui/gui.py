@@ -33,11 +33,11 @@ TODO: UI Bug fixes
     TODO: fix dependency arrow snapping when dragging rectangles over each other
 
 TODO:
-    # Success criteria: fails if n or more components fail
     # Eraser cursor
 """
 
 import os, sys, sqlite3, logging, torch
+from collections.abc import Callable
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -105,11 +105,262 @@ class DepQAction(QAction):
         else:
             QApplication.restoreOverrideCursor()
 
+# Connects the scene's QGraphicsRectItems to a DepGraph
+# The graph itself only sees integer keys, so it never holds Qt objects
+class DepQGraph:
+    DEFAULT_DR = DepGraph.DEFAULT_DR
+    DEFAULT_EDGE_WEIGHT = DepGraph.DEFAULT_EDGE_WEIGHT
+
+    def __init__(self) -> None:
+        self.dg = DepGraph()
+
+        # Maps rectangles to their keys in self.dg and back
+        self.rect_keys = {}
+        self.key_rects = {}
+        self.next_key = 0
+
+        # get_r_dict() and the graph version it was made at
+        self.r_dict = None
+        self.r_dict_version = None
+        # importance(), and the target and graph version it was made at
+        self.importance_dicts = None
+        self.importance_key = None
+        # What-if overlay on self.dg, or None. See DepGraph.fork
+        self.what_if = None
+        # get_what_if_r_dict(), and the graph and overlay versions it was made at
+        self.what_if_r_dict = None
+        self.what_if_r_dict_key = None
+
+    def new_key(self, rect_item: QGraphicsRectItem) -> int:
+        key = self.next_key
+        self.next_key += 1
+        self.rect_keys[rect_item] = key
+        self.key_rects[key] = rect_item
+        return key
+
+    # Links rect_item to a key that's already in self.dg
+    def attach(self, rect_item: QGraphicsRectItem, key: int) -> None:
+        self.rect_keys[rect_item] = key
+        self.key_rects[key] = rect_item
+
+    def add_vertex(self, rect_item: QGraphicsRectItem, direct_risk: float=DEFAULT_DR) -> None:
+        self.dg.add_vertex(self.new_key(rect_item), direct_risk)
+
+    def add_AND_gate(self, rect_item: QGraphicsRectItem) -> None:
+        self.dg.add_AND_gate(self.new_key(rect_item))
+
+    def add_vote_gate(self, rect_item: QGraphicsRectItem, k: int) -> None:
+        self.dg.add_vote_gate(self.new_key(rect_item), k)
+
+    def delete_vertex(self, rect_item: QGraphicsRectItem) -> None:
+        key = self.rect_keys.pop(rect_item)
+        del self.key_rects[key]
+        self.dg.delete_vertex(key)
+
+    def delete_vertices(self, rect_items: list[QGraphicsRectItem]) -> None:
+        keys = [self.rect_keys.pop(rect_item) for rect_item in rect_items]
+        for key in keys:
+            del self.key_rects[key]
+        self.dg.delete_vertices(keys)
+
+    # edge is a tuple (a, b) where a -> b
+    def add_edge(self, edge: tuple[QGraphicsRectItem], weight: float=DEFAULT_EDGE_WEIGHT) -> None:
+        self.dg.add_edge(tuple(self.rect_keys[rect] for rect in edge), weight)
+
+    def delete_edge(self, edge: tuple[QGraphicsRectItem]) -> None:
+        self.dg.delete_edge(tuple(self.rect_keys[rect] for rect in edge))
+
+    def update_vertex(self, rect_item: QGraphicsRectItem, new_weight: float) -> None:
+        self.dg.update_vertex(self.rect_keys[rect_item], new_weight)
+
+    def get_vertex_weight(self, rect_item: QGraphicsRectItem) -> float:
+        return self.dg.get_vertex_weight(self.rect_keys[rect_item])
+
+    # Maps component rectangles to their total risk
+    def get_r_dict(self) -> dict:
+        if self.dg.version == self.r_dict_version:
+            return self.r_dict
+
+        self.r_dict = { self.key_rects[key] : risk for key, risk in self.dg.get_r_dict().items() }
+        self.r_dict_version = self.dg.version
+        return self.r_dict
+
+    # Hardens rect_item in the what-if overlay, as if it couldn't fail on its own
+    def what_if_harden(self, rect_item: QGraphicsRectItem) -> None:
+        if self.what_if is None:
+            self.what_if = self.dg.fork()
+        self.what_if.update_vertex(self.rect_keys[rect_item], 0)
+
+    # Removes edge from the what-if overlay. edge is a tuple (a, b) where a -> b
+    def what_if_delete_edge(self, edge: tuple[QGraphicsRectItem]) -> None:
+        if self.what_if is None:
+            self.what_if = self.dg.fork()
+        self.what_if.delete_edge(tuple(self.rect_keys[rect] for rect in edge))
+
+    def clear_what_if(self) -> None:
+        self.what_if = None
+
+    # Maps component rectangles to their total risk in the what-if
+    # overlay, or None if there isn't one
+    def get_what_if_r_dict(self) -> dict:
+        if self.what_if is None:
+            return None
+        if (self.dg.version, self.what_if.version) == self.what_if_r_dict_key:
+            return self.what_if_r_dict
+
+        self.what_if_r_dict = { self.key_rects[key] : risk for key, risk in self.what_if.get_r_dict().items() }
+        self.what_if_r_dict_key = (self.dg.version, self.what_if.version)
+        return self.what_if_r_dict
+
+    # Returns a function computing what the scene colors by, on a
+    # snapshot of the graph taken now: total risks, what-if risks, and
+    # importance for target_rect if it isn't None. The function only
+    # touches the snapshot, so it can run on another thread while the
+    # graph changes. Its result goes to store_risks
+    def risk_job(self, target_rect: QGraphicsRectItem) -> Callable[[], tuple]:
+        versions = (self.dg.version, None if self.what_if is None else self.what_if.version)
+        snapshot = self.dg.snapshot()
+        what_if = None if self.what_if is None else self.what_if.rebase(snapshot)
+        target = None if target_rect is None else self.rect_keys[target_rect]
+
+        def job() -> tuple:
+            try:
+                return (
+                    versions,
+                    snapshot.get_r_dict(),
+                    None if what_if is None else what_if.get_r_dict(),
+                    target_rect,
+                    None if target is None else snapshot.importance(target),
+                )
+            finally:
+                snapshot.release()
+        return job
+
+    # Fills the caches behind get_r_dict, get_what_if_r_dict and
+    # importance from a risk_job result. Results from before the graph
+    # or overlay last changed are ignored
+    def store_risks(self, results: tuple) -> None:
+        versions, r_dict, what_if_r_dict, target_rect, importance = results
+        if versions != (self.dg.version, None if self.what_if is None else self.what_if.version):
+            return
+
+        to_rects = lambda values: { self.key_rects[key] : value for key, value in values.items() }
+        self.r_dict = to_rects(r_dict)
+        self.r_dict_version = self.dg.version
+        if what_if_r_dict is not None:
+            self.what_if_r_dict = to_rects(what_if_r_dict)
+            self.what_if_r_dict_key = versions
+        if importance is not None:
+            self.importance_dicts = { name : to_rects(values) for name, values in importance.items() }
+            self.importance_key = (target_rect, self.dg.version)
+
+    # Saves the graph and any extra arrays, see DepGraph.save
+    def save(self, path: str, **extra: np.ndarray) -> None:
+        self.dg.save(path, **extra)
+
+    # Replaces the graph with one written by save and returns the extra
+    # arrays saved with it. Rectangles have to be attached afterwards.
+    # check, if given, is called with the new graph and extra arrays
+    # before anything is replaced, and can raise to keep the old graph
+    def load(self, path: str, check: Callable[[DepGraph, dict], None]=None) -> dict:
+        dg, extra = DepGraph.load(path)
+        if check is not None:
+            check(dg, extra)
+
+        self.dg = dg
+        self.rect_keys = {}
+        self.key_rects = {}
+        self.next_key = max(dg.refi, default=-1) + 1
+        self.r_dict = None
+        self.r_dict_version = None
+        self.importance_dicts = None
+        self.importance_key = None
+        self.what_if = None
+        self.what_if_r_dict = None
+        self.what_if_r_dict_key = None
+        return extra
+
+    # Maps each importance measure to a dict of component rectangles
+    # and their importance for target_rect, see DepGraph.importance
+    def importance(self, target_rect: QGraphicsRectItem) -> dict:
+        if (target_rect, self.dg.version) == self.importance_key:
+            return self.importance_dicts
+
+        self.importance_dicts = {
+            name : { self.key_rects[key] : value for key, value in values.items() }
+            for name, values in self.dg.importance(self.rect_keys[target_rect]).items()
+        }
+        self.importance_key = (target_rect, self.dg.version)
+        return self.importance_dicts
+
+# Recomputes risks for a DepQGraphicsScene off the GUI thread.
+# Requests made within one event loop tick are coalesced into one
+# recompute, which runs on a worker thread against a copy of the
+# graph. Every request bumps a generation counter, and results from
+# an older generation are dropped, since a newer recompute is coming.
+# A recompute that fails is logged, and the scene recolors on the GUI
+# thread instead
+class DepQRiskScheduler(QObject):
+    # The generation a recompute started at, and its DepQGraph.risk_job
+    # result, or None if the job raised
+    results_ready = pyqtSignal(int, object)
+
+    def __init__(self, parent_scene: QGraphicsScene) -> None:
+        super().__init__()
+
+        self.parent_scene = parent_scene
+        self.generation = 0
+        self.queued = False
+
+        # One worker, so recomputes finish in the order they started
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(1)
+
+        # The scheduler lives on the GUI thread, so this is delivered there
+        self.results_ready.connect(self.apply)
+
+    def request(self) -> None:
+        self.generation += 1
+        if not self.queued:
+            self.queued = True
+            QTimer.singleShot(0, self.start)
+
+    def start(self) -> None:
+        self.queued = False
+        generation = self.generation
+        job = self.parent_scene.dg.risk_job(self.parent_scene.color_target)
+
+        def run() -> None:
+            try:
+                results = job()
+            except Exception:
+                logging.exception("Risk recompute failed")
+                results = None
+            self.results_ready.emit(generation, results)
+        self.pool.start(run)
+
+    def apply(self, generation: int, results: tuple) -> None:
+        if generation != self.generation:
+            return
+
+        # Without results, apply_rect_colors computes what it needs itself
+        if results is not None:
+            self.parent_scene.dg.store_risks(results)
+        self.parent_scene.apply_rect_colors()
+
 class DepQMenu(QMenu):
-    def __init__(self, dg: DepGraph, parent_rect: QGraphicsRectItem, pos: QPoint) -> None:
+    # Importance measures rectangles can be colored by, and their labels
+    IMPORTANCE_MEASURES = {
+        "birnbaum" : "Birnbaum",
+        "criticality" : "Criticality",
+        "fussell_vesely" : "Fussell-Vesely",
+    }
+
+    def __init__(self, parent_scene: QGraphicsScene, parent_rect: QGraphicsRectItem, pos: QPoint) -> None:
         super().__init__()
 
-        self.dg = dg
+        self.parent_scene = parent_scene
+        self.dg = parent_scene.dg
         self.parent_rect = parent_rect
 
         # Removes icons
@@ -126,9 +377,138 @@ class DepQMenu(QMenu):
 
         self.dr_action = self.addAction(f"Direct Risk: {self.dg.get_vertex_weight(self.parent_rect):.3f}")
 
-        self.exec(pos)
+        # Coloring every component by its importance for this one
+        self.addSeparator()
+        self.importance_menu = self.addMenu("Color by Importance to This")
+        self.importance_actions = {
+            self.importance_menu.addAction(label) : measure
+            for measure, label in self.IMPORTANCE_MEASURES.items()
+        }
+        self.total_risk_action = self.addAction("Color by Total Risk")
+        self.importance_menu.setEnabled(bool(self.parent_rect.data(self.parent_scene.IS_COMPONENT)))
+
+        # What-if changes, shown next to the current total risks
+        self.addSeparator()
+        self.harden_action = self.addAction("What If: Harden This")
+        self.harden_action.setEnabled(bool(self.parent_rect.data(self.parent_scene.IS_COMPONENT)))
+        self.cut_inputs_action = self.addAction("What If: Cut Links Into This")
+        self.clear_what_if_action = self.addAction("Clear What If")
+        self.clear_what_if_action.setEnabled(self.dg.what_if is not None)
+
+        chosen = self.exec(pos)
+        if chosen in self.importance_actions:
+            self.parent_scene.color_by_importance(self.importance_actions[chosen], self.parent_rect)
+        elif chosen == self.total_risk_action:
+            self.parent_scene.color_by_importance(None, None)
+        elif chosen == self.harden_action:
+            self.dg.what_if_harden(self.parent_rect)
+            self.parent_scene.update_rect_colors()
+        elif chosen == self.cut_inputs_action:
+            for source in self.parent_scene.rect_influences[self.parent_rect]:
+                self.dg.what_if_delete_edge((source, self.parent_rect))
+            self.parent_scene.update_rect_colors()
+        elif chosen == self.clear_what_if_action:
+            self.dg.clear_what_if()
+            self.parent_scene.update_rect_colors()
+
+# Component and AND gate rectangles. Their text is painted straight
+# onto the rectangle, since embedded widgets are the most expensive
+# thing a scene can hold. Components show their name and risk, gates
+# their label. Names are edited through a DepQNameEdit made on demand
+class DepQRectItem(QGraphicsRectItem):
+    # Shown in place of an empty component name
+    PLACEHOLDER = "Double-click to name"
+
+    # Below this zoom level, no text is painted
+    TEXT_LOD = 0.3
+    # Below this zoom level, rectangles are painted as flat tiles of
+    # their fill color, without outlines or selection marks
+    TILE_LOD = 0.1
+
+    def __init__(self, w: float, h: float, title: str, is_component: bool) -> None:
+        super().__init__(0, 0, w, h)
+
+        self.title = title
+        self.is_component = is_component
+        self.risk_text = ''
+        # Whether a DepQNameEdit is covering the name
+        self.editing = False
+
+        self.title_font = QFont()
+        if not is_component:
+            self.title_font.setBold(True)
+            self.title_font.setPointSize(16)
+        self.risk_font = QFont()
+        self.risk_font.setBold(True)
+
+    def set_title(self, title: str) -> None:
+        self.title = title
+        self.update()
+
+    def set_risk_text(self, text: str) -> None:
+        if text != self.risk_text:
+            self.risk_text = text
+            self.update()
+
+    def set_editing(self, editing: bool) -> None:
+        self.editing = editing
+        self.update()
+
+    def paint(self, painter: QPainter, option: QStyleOptionGraphicsItem, widget: QWidget=None) -> None:
+        lod = option.levelOfDetailFromTransform(painter.worldTransform())
+        if lod < self.TILE_LOD:
+            painter.fillRect(self.rect(), self.brush())
+            return
+
+        super().paint(painter, option, widget)
+        if lod < self.TEXT_LOD:
+            return
+
+        rect = self.rect()
+        painter.setPen(Qt.black)
+        if not self.is_component:
+            painter.setFont(self.title_font)
+            painter.drawText(rect, Qt.AlignCenter | Qt.TextWordWrap, self.title)
+            return
+
+        if not self.editing:
+            font = QFont(self.title_font)
+            if not self.title:
+                font.setItalic(True)
+                painter.setPen(Qt.darkGray)
+            painter.setFont(font)
+            painter.drawText(rect, Qt.AlignCenter | Qt.TextWordWrap, self.title or self.PLACEHOLDER)
+            painter.setPen(Qt.black)
+
+        # Centered in the bottom half of the rectangle
+        painter.setFont(self.risk_font)
+        risk_rect = QRectF(rect.x(), rect.y() + rect.height() / 2, rect.width(), rect.height() / 2)
+        painter.drawText(risk_rect, Qt.AlignCenter, self.risk_text)
+
+# Straight lines standing in for a scene's arrows when it's zoomed too
+# far out to see them, drawn in one call instead of one item per arrow
+class DepQEdgeOverview(QGraphicsItem):
+    def __init__(self, lines: list[QLineF]) -> None:
+        super().__init__()
+
+        self.lines = lines
+        self.pen = QPen(Qt.darkGray, 0)
+
+        bounds = QRectF()
+        for line in lines:
+            bounds = bounds.united(QRectF(line.p1(), line.p2()).normalized())
+        self.bounds = bounds
+
+    def boundingRect(self) -> QRectF:
+        return self.bounds
+
+    def paint(self, painter: QPainter, option: QStyleOptionGraphicsItem, widget: QWidget=None) -> None:
+        painter.setPen(self.pen)
+        painter.drawLines(self.lines)
 
-class DepQComboBox(QComboBox):
+# Edits a component's name. There's at most one of these at a time,
+# see DepQGraphicsScene.edit_component_name
+class DepQNameEdit(QLineEdit):
     def __init__(self, parent_rect: QGraphicsRectItem, 
                  parent_scene: QGraphicsScene, 
                  parent_window: QMainWindow) -> None:
@@ -138,11 +518,14 @@ class DepQComboBox(QComboBox):
         self.parent_scene = parent_scene
         self.parent_window = parent_window
 
-        self.setEditable(True)
-        self.setSizeAdjustPolicy(QComboBox.AdjustToContents)
-        self.setMinimumContentsLength(25)
-        self.addItems(self.parent_window.components["name"])
-        self.textActivated.connect(self.update_comp_fail_rate)
+        self.setMinimumWidth(25 * self.fontMetrics().averageCharWidth())
+        self.setCompleter(self.parent_scene.name_completer)
+        self.setText(self.parent_rect.title)
+
+        # Choosing a name predicts its failure rate, leaving just keeps the text
+        self.returnPressed.connect(lambda: self.update_comp_fail_rate(self.text()))
+        self.completer().activated[str].connect(self.update_comp_fail_rate)
+        self.editingFinished.connect(self.parent_scene.finish_component_name)
 
     def get_prob_from_fpmh(self, fpmh_list: list[float]) -> float:
         one_dist = (sum(fpmh_list) / 3 - 1) / 15
@@ -153,14 +536,88 @@ class DepQComboBox(QComboBox):
         return zero_prob
 
     def update_comp_fail_rate(self, comp_str: str) -> None:
+        # The completer is shared, so only the open editor should react
+        if self.parent_scene.name_editor is None or self.parent_scene.name_editor.widget() != self:
+            return
+
         # Predict the failure rate using the RNN
         lstm_res = [ e.item() for e in train_lstm.predict(comp_str) ]
         new_weight = min(max(0, self.get_prob_from_fpmh(lstm_res)), 1)
+        self.setText(comp_str)
+        self.parent_scene.finish_component_name()
         self.parent_scene.dg.update_vertex(self.parent_rect, new_weight)
         self.parent_scene.update_rect_colors()
 
-    def wheelEvent(self, event: QWheelEvent) -> None:
-        event.ignore()
+# Uniform grid over the scene holding component and AND gate
+# rectangles, so the rectangle under a point can be found without
+# asking the scene, whose own index is rebuilt whenever items change.
+# Each rectangle is listed in every cell its bounds touch
+class DepQRectIndex:
+    def __init__(self, cell_w: float, cell_h: float) -> None:
+        self.cell_w = cell_w
+        self.cell_h = cell_h
+
+        # Maps (column, row) to the set of rectangles listed there
+        self.cells = {}
+        # Maps rectangles to the cells they're listed in
+        self.rect_cells = {}
+        # Maps rectangles to when they were inserted. Among rectangles
+        # with equal z values, the scene draws later ones on top
+        self.rect_order = {}
+        self.next_order = 0
+
+    def cells_of(self, bounds: QRectF) -> list[tuple[int]]:
+        col_lo = int(bounds.left() // self.cell_w)
+        col_hi = int(bounds.right() // self.cell_w)
+        row_lo = int(bounds.top() // self.cell_h)
+        row_hi = int(bounds.bottom() // self.cell_h)
+        return [
+            (col, row) for col in range(col_lo, col_hi + 1) for row in range(row_lo, row_hi + 1)
+        ]
+
+    def insert(self, rect_item: QGraphicsRectItem) -> None:
+        self.rect_order[rect_item] = self.next_order
+        self.next_order += 1
+        self.rect_cells[rect_item] = []
+        self.move(rect_item)
+
+    def remove(self, rect_item: QGraphicsRectItem) -> None:
+        for cell in self.rect_cells.pop(rect_item):
+            self.cells[cell].discard(rect_item)
+        del self.rect_order[rect_item]
+
+    # Call after rect_item's position or size changes
+    def move(self, rect_item: QGraphicsRectItem) -> None:
+        old_cells = self.rect_cells[rect_item]
+        new_cells = self.cells_of(rect_item.sceneBoundingRect())
+        if new_cells == old_cells:
+            return
+
+        for cell in old_cells:
+            self.cells[cell].discard(rect_item)
+        for cell in new_cells:
+            self.cells.setdefault(cell, set()).add(rect_item)
+        self.rect_cells[rect_item] = new_cells
+
+    def clear(self) -> None:
+        self.cells.clear()
+        self.rect_cells.clear()
+        self.rect_order.clear()
+
+    # The topmost rectangle containing pos, or None
+    def top_at(self, pos: QPointF) -> QGraphicsRectItem:
+        cell = (int(pos.x() // self.cell_w), int(pos.y() // self.cell_h))
+        top_rect = None
+        top_key = None
+        for rect_item in self.cells.get(cell, ()):
+            if not rect_item.sceneBoundingRect().contains(pos):
+                continue
+
+            key = (rect_item.zValue(), self.rect_order[rect_item])
+            if top_key is None or key > top_key:
+                top_rect, top_key = rect_item, key
+
+        return top_rect
 
 # Custom QGraphicsScene class for the dependency tab
 class DepQGraphicsScene(QGraphicsScene):
@@ -169,7 +626,7 @@ class DepQGraphicsScene(QGraphicsScene):
     IS_COMPONENT = 1
     IS_AND_GATE = 2
     EDGES_VERTICES = 3
-    RISK_LABEL = 4
+    ARROW_TIP = 4
 
     # The tip of a dependency arrow is an isosceles triangle
     ARR_LONG = 30  # The length of the middle axis
@@ -179,6 +636,12 @@ class DepQGraphicsScene(QGraphicsScene):
 
     ERASER_RADIUS = 50
 
+    # Below this zoom level, arrowheads are hidden
+    ARROWHEAD_LOD = 0.2
+    # Below this zoom level, arrows are replaced by one path of straight
+    # lines between the centers of the rectangles they join
+    ARROW_LOD = 0.15
+
     SCENE_WIDTH = 5_000
     SCENE_HEIGHT = 1_000
 
@@ -188,7 +651,10 @@ class DepQGraphicsScene(QGraphicsScene):
         self.setSceneRect(0, 0, self.SCENE_WIDTH, self.SCENE_HEIGHT)
 
         self.parent_window = parent_window
-        self.dg = DepGraph()
+        self.dg = DepQGraph()
+
+        # Component and AND gate rectangles, for hit-testing
+        self.rect_index = DepQRectIndex(*self.RECT_DIMS)
 
         # For the selection box
         self.select_rect_item = None
@@ -219,24 +685,45 @@ class DepQGraphicsScene(QGraphicsScene):
         self.rect_arrs_out = {}
         self.rect_risks = {}
 
-    def items_at(self, pos: QPointF) -> list:
-        collision_line = self.addLine(QLineF(pos, pos), QPen(Qt.NoPen))
-        colliding_items = self.collidingItems(collision_line)
-        self.removeItem(collision_line)
-
-        return colliding_items
-
+        # Registries of what's in the diagram, so nothing has to scan
+        # every item in the scene
+        self.components = set()
+        self.gates = set()
+        self.arrows = set()
+        # Maps components to the (label, value, what-if risk) they show
+        self.rect_shown = {}
+
+        # One completer of component names, shared by every name editor
+        self.name_model = QStringListModel(list(self.parent_window.components["name"]))
+        self.name_completer = QCompleter(self.name_model)
+        self.name_completer.setCaseSensitivity(Qt.CaseInsensitive)
+        self.name_completer.setFilterMode(Qt.MatchContains)
+        # The proxy holding the open DepQNameEdit, if any
+        self.name_editor = None
+
+        # What's shown at the current zoom level, see set_level_of_detail
+        self.show_arrowheads = True
+        self.show_arrows = True
+        self.show_tiles = False
+        # The path shown instead of arrows, and whether it's due to be redrawn
+        self.edge_overview = None
+        self.edge_overview_queued = False
+
+        # Components are colored by total risk, or if color_target is
+        # set, by their color_measure importance for color_target
+        self.color_measure = None
+        self.color_target = None
+
+        self.risk_scheduler = DepQRiskScheduler(self)
+
+    # The topmost component or AND gate at pos, or None
     def top_rect_at(self, pos: QPointF) -> QGraphicsRectItem:
-        top_rect = None
-        maxz = float("-inf")
-        for item in self.items_at(pos):
-            if isinstance(item, QGraphicsRectItem) and item.zValue() > maxz:
-                top_rect, maxz = item, item.zValue()
-
-        return top_rect
+        return self.rect_index.top_at(pos)
 
+    # end_rect is the rectangle under end_pos, if the caller knows it
     def draw_arr(
-        self, origin_rect: QGraphicsRectItem, end_pos: QPointF, pen: QPen
+        self, origin_rect: QGraphicsRectItem, end_pos: QPointF, pen: QPen,
+        end_rect: QGraphicsRectItem=None
     ) -> QGraphicsItemGroup:
         self.del_dyn_arr()
 
@@ -274,7 +761,7 @@ class DepQGraphicsScene(QGraphicsScene):
             arr_start_pos.setX((left_bound + right_bound) / 2)
             elbow = QPointF(start_pos.x(), end_pos.y())
 
-        moused_over = self.top_rect_at(end_pos)
+        moused_over = end_rect if end_rect is not None else self.top_rect_at(end_pos)
         if moused_over:
             left_bound = moused_over.scenePos().x()
             right_bound = left_bound + moused_over.rect().width()
@@ -326,124 +813,191 @@ class DepQGraphicsScene(QGraphicsScene):
             QPolygonF([arr_tip_pos, arr_bot_l, arr_bot_r]), QPen(), QBrush(Qt.black)
         )
 
+        arr_tip.setVisible(self.show_arrowheads)
+
         arr = self.createItemGroup([arr_v, arr_h, arr_tip])
         arr.setZValue(-1)
+        arr.setData(self.ARROW_TIP, arr_tip)
 
         return arr
 
     def add_component(self, event: QGraphicsSceneMouseEvent) -> None:
+        rect_item = self.add_component_rect(event.scenePos())
+        self.edit_component_name(rect_item)
+
+        self.dg.add_vertex(rect_item)
+        self.update_rect_colors()
+
+    # Adds the rectangle for a component named name, centered on center
+    def add_component_rect(self, center: QPointF, name: str='') -> QGraphicsRectItem:
         # Create and add rectangle
         rect_w, rect_h = self.RECT_DIMS
-        rect_x = event.scenePos().x() - rect_w // 2
-        rect_y = event.scenePos().y() - rect_h // 2
+        rect_x = center.x() - rect_w // 2
+        rect_y = center.y() - rect_h // 2
         brush = QBrush(self.parent_window.WPI_RED)
 
-        rect_item = self.addRect(0, 0, rect_w, rect_h, QPen(), brush)
+        rect_item = DepQRectItem(rect_w, rect_h, name, True)
+        rect_item.setPen(QPen())
+        rect_item.setBrush(brush)
         rect_item.setPos(rect_x, rect_y)
         rect_item.setFlags(QGraphicsItem.ItemIsSelectable)
         rect_item.setData(self.IS_COMPONENT, True)
+        rect_item.set_risk_text(f"Total Risk: {self.dg.DEFAULT_DR:.3f}")
+        if self.show_tiles:
+            rect_item.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
+        self.addItem(rect_item)
+        self.grow_to_fit(rect_item)
+
+        self.rect_index.insert(rect_item)
+        self.components.add(rect_item)
         self.rect_depends_on[rect_item] = []
         self.rect_influences[rect_item] = []
         self.rect_arrs_in[rect_item] = []
         self.rect_arrs_out[rect_item] = []
 
-        # Create text input box
-        comp_name_input = DepQComboBox(rect_item, self, self.parent_window)
-        comp_name_input.setCurrentText('')
+        return rect_item
 
-        # This gives the input box keyboard focus
-        QTimer.singleShot(
-            0, lambda: comp_name_input.setFocus(Qt.OtherFocusReason)
-        )
+    def add_AND_gate(self, event: QGraphicsSceneMouseEvent) -> None:
+        rect_item = self.add_gate_rect(event.scenePos(), "AND")
+        self.dg.add_AND_gate(rect_item)
 
-        # Set up proxy for binding to scene
-        input_proxy = QGraphicsProxyWidget(parent=rect_item)
-        input_proxy.setWidget(comp_name_input)
-    
-        # Center input box within rectangle
-        input_pos = rect_item.mapFromScene(rect_item.pos())
-        input_w = input_proxy.boundingRect().width()
-        input_h = input_proxy.boundingRect().height()
-        input_pos += QPointF((rect_w - input_w) / 2, (rect_h - input_h) / 2)
-        input_proxy.setPos(input_pos)
-
-        # Create risk info label
-        comp_risk_label = QLabel(f"Total Risk: {self.dg.DEFAULT_DR:.3f}")
-        comp_risk_label.setAlignment(Qt.AlignHCenter)
-        comp_risk_label.setMargin(3)
-
-        # Customize font
-        font = comp_risk_label.font()
-        font.setBold(True)
-        comp_risk_label.setFont(font)
-
-        # Customize color palette
-        pal = comp_risk_label.palette()
-        pal.setColor(QPalette.Window, QColor(0, 0, 0, alpha=0))
-        comp_risk_label.setPalette(pal)
-
-        # Create proxy for risk label
-        text_proxy = QGraphicsProxyWidget(parent=rect_item)
-        text_proxy.setWidget(comp_risk_label)
-
-        # Center in bottom half of rectangle
-        text_pos = rect_item.mapFromScene(rect_item.pos())
-        text_w = text_proxy.boundingRect().width()
-        text_h = text_proxy.boundingRect().height()
-        text_pos += QPointF((rect_w - text_w) / 2, (rect_h - text_h) * 3 / 4)
-        text_proxy.setPos(text_pos)
-        text_proxy.setZValue(-1)
-
-        rect_item.setData(self.RISK_LABEL, comp_risk_label)
+    # Asks for k, then adds a gate that fails once k of its inputs fail
+    def add_vote_gate(self, event: QGraphicsSceneMouseEvent) -> None:
+        k, ok = QInputDialog.getInt(
+            self.parent_window, "Add k-of-n Gate", "Fails once this many inputs fail:", 2, 1
+        )
+        if not ok:
+            return
 
-        self.dg.add_vertex(rect_item)
-        self.update_rect_colors()
+        rect_item = self.add_gate_rect(event.scenePos(), f"{k}-of-n")
+        self.dg.add_vote_gate(rect_item, k)
 
-    def add_AND_gate(self, event: QGraphicsSceneMouseEvent) -> None:
+    # Adds the rectangle for a gate labeled with text, centered on center
+    def add_gate_rect(self, center: QPointF, text: str) -> QGraphicsRectItem:
         # Create and add rectangle
         rect_w, rect_h = self.RECT_DIMS
-        rect_x = event.scenePos().x() - rect_w // 2
-        rect_y = event.scenePos().y() - rect_h // 2
+        rect_x = center.x() - rect_w // 2
+        rect_y = center.y() - rect_h // 2
         brush = QBrush(Qt.white)
 
-        rect_item = self.addRect(0, 0, rect_w, rect_h, QPen(), brush)
+        rect_item = DepQRectItem(rect_w, rect_h, text, False)
+        rect_item.setPen(QPen())
+        rect_item.setBrush(brush)
         rect_item.setPos(rect_x, rect_y)
         rect_item.setFlags(QGraphicsItem.ItemIsSelectable)
         rect_item.setData(self.IS_AND_GATE, True)
+        if self.show_tiles:
+            rect_item.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
+        self.addItem(rect_item)
+        self.grow_to_fit(rect_item)
 
+        self.rect_index.insert(rect_item)
+        self.gates.add(rect_item)
         self.rect_depends_on[rect_item] = []
         self.rect_influences[rect_item] = []
         self.rect_arrs_in[rect_item] = []
         self.rect_arrs_out[rect_item] = []
-        self.dg.add_AND_gate(rect_item)
 
-        # Create text
-        text_widg = QLabel("AND")
-        text_widg.setWordWrap(True)
-        text_widg.setAlignment(Qt.AlignHCenter)
+        return rect_item
 
-        # Edit font to be bold and brash
-        font = text_widg.font()
-        font.setBold(True)
-        font.setPointSize(16)
-        text_widg.setFont(font)
+    # Opens a DepQNameEdit over rect_item's name, closing any other
+    def edit_component_name(self, rect_item: QGraphicsRectItem) -> None:
+        self.finish_component_name()
 
-        # Match background color to rectangle
-        pal = text_widg.palette()
-        pal.setBrush(QPalette.Window, QBrush(Qt.NoBrush))
-        text_widg.setPalette(pal)
-
-        # Set up proxy for binding to scene
+        name_input = DepQNameEdit(rect_item, self, self.parent_window)
         proxy = QGraphicsProxyWidget(parent=rect_item)
-        proxy.setWidget(text_widg)
+        proxy.setWidget(name_input)
+
+        # Center input box within rectangle
+        rect_w, rect_h = self.RECT_DIMS
+        input_w = proxy.boundingRect().width()
+        input_h = proxy.boundingRect().height()
+        proxy.setPos((rect_w - input_w) / 2, (rect_h - input_h) / 2)
 
-        # Center within rectangle
-        text_pos = rect_item.mapFromScene(rect_item.pos())
-        text_w = proxy.boundingRect().width()
-        text_h = proxy.boundingRect().height()
-        text_pos += QPointF((rect_w - text_w) / 2, (rect_h - text_h) / 2)
-        proxy.setPos(text_pos)
-        proxy.setZValue(-1)
+        rect_item.set_editing(True)
+        self.name_editor = proxy
+
+        # This gives the input box keyboard focus
+        QTimer.singleShot(
+            0, lambda: name_input.setFocus(Qt.OtherFocusReason)
+        )
+
+    # Closes the open DepQNameEdit, if any, keeping its text as the name
+    def finish_component_name(self) -> None:
+        if self.name_editor is None:
+            return
+
+        # Cleared first, since hiding the editor finishes editing again
+        proxy = self.name_editor
+        self.name_editor = None
+
+        rect_item = proxy.parentItem()
+        rect_item.set_title(proxy.widget().text())
+        rect_item.set_editing(False)
+
+        # This can run inside the editor's own signals, so it's deleted later
+        proxy.hide()
+        proxy.deleteLater()
+
+    # Grows the scene rectangle so rect_item has room around it. It
+    # never shrinks, so the view doesn't jump around under the mouse
+    def grow_to_fit(self, rect_item: QGraphicsRectItem) -> None:
+        margin = max(self.RECT_DIMS)
+        bounds = rect_item.sceneBoundingRect().adjusted(-margin, -margin, margin, margin)
+        if not self.sceneRect().contains(bounds):
+            self.setSceneRect(self.sceneRect().united(bounds))
+
+    # Drops details too small to see at zoom level lod: arrowheads,
+    # then whole arrows, and the name editor. Rectangles drop their own
+    # text, see DepQRectItem.paint, and once they're flat tiles they're
+    # cached as pixmaps so panning doesn't repaint them
+    def set_level_of_detail(self, lod: float) -> None:
+        show_arrowheads = lod >= self.ARROWHEAD_LOD
+        if show_arrowheads != self.show_arrowheads:
+            self.show_arrowheads = show_arrowheads
+            for arr in self.arrows:
+                arr.data(self.ARROW_TIP).setVisible(show_arrowheads)
+
+        show_arrows = lod >= self.ARROW_LOD
+        if show_arrows != self.show_arrows:
+            self.show_arrows = show_arrows
+            for arr in self.arrows:
+                arr.setVisible(show_arrows)
+            self.update_edge_overview()
+
+        show_tiles = lod < DepQRectItem.TILE_LOD
+        if show_tiles != self.show_tiles:
+            self.show_tiles = show_tiles
+            cache_mode = QGraphicsItem.DeviceCoordinateCache if show_tiles else QGraphicsItem.NoCache
+            for rect_item in self.components | self.gates:
+                rect_item.setCacheMode(cache_mode)
+
+        if lod < DepQRectItem.TEXT_LOD:
+            self.finish_component_name()
+
+    # Redraws the path shown instead of arrows, or removes it if arrows are shown
+    def update_edge_overview(self) -> None:
+        self.edge_overview_queued = False
+        if self.edge_overview is not None:
+            self.removeItem(self.edge_overview)
+            self.edge_overview = None
+        if self.show_arrows:
+            return
+
+        lines = []
+        for arr in self.arrows:
+            origin, dependent = arr.data(self.EDGES_VERTICES)
+            lines.append(QLineF(origin.sceneBoundingRect().center(), dependent.sceneBoundingRect().center()))
+
+        self.edge_overview = DepQEdgeOverview(lines)
+        self.edge_overview.setZValue(-1)
+        self.addItem(self.edge_overview)
+
+    # Redraws the edge overview once this event loop tick is done, if it's shown
+    def queue_edge_overview(self) -> None:
+        if not self.show_arrows and not self.edge_overview_queued:
+            self.edge_overview_queued = True
+            QTimer.singleShot(0, self.update_edge_overview)
 
     def del_select_rect_item(self) -> None:
         # Remove selection box
@@ -456,48 +1010,97 @@ class DepQGraphicsScene(QGraphicsScene):
             self.removeItem(self.dyn_arr)
             self.dyn_arr = None
 
+    # Recolors components once risks have been recomputed, see DepQRiskScheduler
     def update_rect_colors(self) -> None:
+        self.risk_scheduler.request()
+
+    # Colors components right away. Whatever self.dg hasn't cached
+    # is computed on this thread
+    def apply_rect_colors(self) -> None:
         self.rect_risks = self.dg.get_r_dict()
-        for rect in filter(lambda x: x.data(self.IS_COMPONENT), self.items()):
-            risk = self.rect_risks[rect]
+        if self.color_target is not None:
+            values = self.dg.importance(self.color_target)[self.color_measure]
+            label = DepQMenu.IMPORTANCE_MEASURES[self.color_measure]
+        else:
+            values = self.rect_risks
+            label = "Total Risk"
+        what_if_risks = self.dg.get_what_if_r_dict()
+
+        # Only components showing something new are repainted
+        shown = {}
+        for rect in self.components:
+            value = values[rect]
+            what_if_risk = None if what_if_risks is None else what_if_risks[rect]
+            shown[rect] = (label, value, what_if_risk)
+            if shown[rect] == self.rect_shown.get(rect):
+                continue
+
             brush = rect.brush()
             bcolor = brush.color()
-            bcolor.setAlphaF(risk)
+            bcolor.setAlphaF(min(max(value, 0), 1))
             brush.setColor(bcolor)
             rect.setBrush(brush)
 
-            risk_label = rect.data(self.RISK_LABEL)
-            risk_label.setText(f"Total Risk: {risk:.3f}")
+            # With a what-if overlay, its total risk goes alongside
+            text = f"{label}: {value:.3f}"
+            if what_if_risk is not None:
+                text += f" | What If: {what_if_risk:.3f}"
+            rect.set_risk_text(text)
+
+        self.rect_shown = shown
+
+    # Colors components by their measure importance for target, or
+    # by total risk if measure is None
+    def color_by_importance(self, measure: str, target: QGraphicsRectItem) -> None:
+        self.color_measure = measure
+        self.color_target = target if measure is not None else None
+        self.update_rect_colors()
 
     # Properly deletes components and AND gates
     def delete_rect(self, rect_item: QGraphicsRectItem) -> None:
-        for arr in self.rect_arrs_out[rect_item] + self.rect_arrs_in[rect_item]:
-            if arr.scene():
-                self.removeItem(arr)
-        self.rect_arrs_out[rect_item].clear()
-        self.rect_arrs_in[rect_item].clear()
+        self.delete_rects([rect_item])
 
-        self.rect_depends_on[rect_item].clear()
-        self.rect_influences[rect_item].clear()
+    # Deletes rect_items and their arrows, with a single update to the graph
+    def delete_rects(self, rect_items: list[QGraphicsRectItem]) -> None:
+        if not rect_items:
+            return
+
+        for rect_item in rect_items:
+            for arr in self.rect_arrs_out[rect_item] + self.rect_arrs_in[rect_item]:
+                self.remove_arrow(arr)
+            self.rect_arrs_out[rect_item].clear()
+            self.rect_arrs_in[rect_item].clear()
+
+            self.rect_depends_on[rect_item].clear()
+            self.rect_influences[rect_item].clear()
 
-        self.dg.delete_vertex(rect_item)
-        self.removeItem(rect_item)
+            if rect_item == self.color_target:
+                self.color_measure = None
+                self.color_target = None
 
+            if self.name_editor is not None and self.name_editor.parentItem() == rect_item:
+                self.finish_component_name()
+
+        self.dg.delete_vertices(rect_items)
+        for rect_item in rect_items:
+            self.rect_index.remove(rect_item)
+            self.components.discard(rect_item)
+            self.gates.discard(rect_item)
+            self.rect_shown.pop(rect_item, None)
+            self.removeItem(rect_item)
+
+    # The eraser is only a shape to test items against, so nothing
+    # is added to the scene for it
     def erase_in_circle(self, pos: QPointF) -> None:
-        eraser = self.addEllipse(
-            pos.x(), pos.y(),
-            self.ERASER_RADIUS,
-            self.ERASER_RADIUS,
-            QPen(Qt.NoPen),
-            QBrush(Qt.NoBrush)
-        )
+        eraser = QPainterPath()
+        eraser.addEllipse(QRectF(pos.x(), pos.y(), self.ERASER_RADIUS, self.ERASER_RADIUS))
 
         something_erased = False
 
         # Clear out edges first to make sure
         # we don't trigger an error trying to
         # delete an edge that's already been deleted
-        to_erase = self.collidingItems(eraser)
+        to_erase = self.items(eraser)
         for item in to_erase:
             # This will always be true for edges
             if item.data(self.EDGES_VERTICES):
@@ -507,20 +1110,17 @@ class DepQGraphicsScene(QGraphicsScene):
                 self.rect_influences[end].remove(start)
                 self.dg.delete_edge((start, end))
 
-                self.removeItem(item)
+                self.remove_arrow(item)
                 something_erased = True
         
         # Now deal with components and AND gates
-        for item in to_erase:
-            if item.data(self.IS_COMPONENT) or item.data(self.IS_AND_GATE):
-                self.delete_rect(item)
-                something_erased = True
+        rects = [item for item in to_erase if item.data(self.IS_COMPONENT) or item.data(self.IS_AND_GATE)]
+        self.delete_rects(rects)
+        something_erased = something_erased or bool(rects)
 
         if something_erased:
             self.update_rect_colors()
 
-        self.removeItem(eraser)
-                
     def mousePressEvent(self, event: QGraphicsSceneMouseEvent) -> None:
         match event.button():
             case Qt.LeftButton:
@@ -587,6 +1187,8 @@ class DepQGraphicsScene(QGraphicsScene):
             for item in selected:
                 delta = item.data(self.MOUSE_DELTA)
                 item.setPos(pos + delta)
+                self.rect_index.move(item)
+                self.grow_to_fit(item)
 
             # Redraw arrows
             for item in selected:
@@ -594,8 +1196,7 @@ class DepQGraphicsScene(QGraphicsScene):
                     continue
 
                 for arr in self.rect_arrs_out[item] + self.rect_arrs_in[item]:
-                    if arr.scene():
-                        self.removeItem(arr)
+                    self.remove_arrow(arr)
                 self.rect_arrs_out[item].clear()
                 self.rect_arrs_in[item].clear()
 
@@ -606,17 +1207,7 @@ class DepQGraphicsScene(QGraphicsScene):
                     if not dependency.scene():
                         continue
 
-                    dep_center = dependency.scenePos()
-                    dep_center += QPointF(
-                        dependency.rect().width() / 2, dependency.rect().height() / 2
-                    )
-
-                    new_arr = self.draw_arr(item, dep_center, QPen())
-                    new_arr.setData(self.EDGES_VERTICES, (item, dependency))
-
-                    self.rect_arrs_out[item].append(new_arr)
-                    self.rect_arrs_in[dependency].append(new_arr)
-
+                    self.draw_edge_arr(item, dependency)
                     redrawn.add((item, dependency))
 
                 # Redraw the arrows that are going into the item
@@ -624,21 +1215,7 @@ class DepQGraphicsScene(QGraphicsScene):
                     if not influence.scene() or (influence, item) in redrawn:
                         continue
 
-                    inf_center = influence.scenePos()
-                    inf_center += QPointF(
-                        influence.rect().width() / 2, influence.rect().height() / 2
-                    )
-
-                    item_center = item.scenePos()
-                    item_center += QPointF(
-                        item.rect().width() / 2, item.rect().height() / 2
-                    )
-
-                    new_arr = self.draw_arr(influence, item_center, QPen())
-                    new_arr.setData(self.EDGES_VERTICES, (influence, item))
-
-                    self.rect_arrs_out[influence].append(new_arr)
-                    self.rect_arrs_in[item].append(new_arr)
+                    self.draw_edge_arr(influence, item)
 
             return
 
@@ -687,14 +1264,10 @@ class DepQGraphicsScene(QGraphicsScene):
         self.select_end = pos
         single_click = self.select_start == self.select_end
 
-        # Cancel click if we're just selecting
-        # a component from the dropdown
-        released_on_l_all = self.items_at(pos)
-        for item in released_on_l_all:
-            if isinstance(item, QGraphicsProxyWidget) and \
-               isinstance(item.widget(), QFrame) and not \
-               isinstance(item.widget(), QLabel):
-                return
+        # Cancel click if we're just clicking
+        # into the name editor
+        if self.name_editor is not None and self.name_editor.sceneBoundingRect().contains(pos):
+            return
 
         self.released_on_1 = self.top_rect_at(pos)
         if single_click:
@@ -713,6 +1286,9 @@ class DepQGraphicsScene(QGraphicsScene):
                 case self.parent_window.AND_gate_button:
                     if not self.released_on_1:
                         self.add_AND_gate(event)
+                case self.parent_window.vote_gate_button:
+                    if not self.released_on_1:
+                        self.add_vote_gate(event)
                 case self.parent_window.eraser_button:
                     self.erase_in_circle(pos)
             return
@@ -747,7 +1323,7 @@ class DepQGraphicsScene(QGraphicsScene):
         
         global_pos = event.screenPos()
         
-        self.context_menu = DepQMenu(self.dg, self.released_on_r, global_pos)
+        self.context_menu = DepQMenu(self, self.released_on_r, global_pos)
 
     def mouseReleaseEventEdge(self, event: QGraphicsSceneMouseEvent) -> None:
         self.mouse_down_r = False
@@ -764,27 +1340,7 @@ class DepQGraphicsScene(QGraphicsScene):
                     self.dep_origin != dependent
                     and dependent not in self.rect_depends_on[self.dep_origin]
                 ):
-                    arr_start_pos = self.dep_origin.scenePos()
-                    arr_start_pos += QPointF(
-                        self.dep_origin.rect().width() / 2,
-                        self.dep_origin.rect().height() / 2,
-                    )
-
-                    arr_end_pos = dependent.scenePos()
-                    arr_end_pos += QPointF(
-                        dependent.rect().width() / 2,
-                        dependent.rect().height() / 2,
-                    )
-
-                    arr = self.draw_arr(self.dep_origin, arr_end_pos, QPen())
-                    arr.setData(self.EDGES_VERTICES, (self.dep_origin, dependent))
-
-                    self.rect_arrs_out[self.dep_origin].append(arr)
-                    self.rect_arrs_in[dependent].append(arr)
-
-                    self.rect_depends_on[self.dep_origin].append(dependent)
-                    self.rect_influences[dependent].append(self.dep_origin)
-
+                    self.add_arrow(self.dep_origin, dependent)
                     self.dg.add_edge((self.dep_origin, dependent))
                     self.update_rect_colors()
 
@@ -792,20 +1348,257 @@ class DepQGraphicsScene(QGraphicsScene):
                 self.dep_origin = None
                 self.del_dyn_arr()
 
+    # Draws and registers the arrow for the edge origin -> dependent
+    def draw_edge_arr(self, origin: QGraphicsRectItem, dependent: QGraphicsRectItem) -> QGraphicsItemGroup:
+        arr_end_pos = dependent.scenePos()
+        arr_end_pos += QPointF(
+            dependent.rect().width() / 2,
+            dependent.rect().height() / 2,
+        )
+
+        arr = self.draw_arr(origin, arr_end_pos, QPen(), dependent)
+        arr.setData(self.EDGES_VERTICES, (origin, dependent))
+
+        self.rect_arrs_out[origin].append(arr)
+        self.rect_arrs_in[dependent].append(arr)
+        self.arrows.add(arr)
+
+        arr.setVisible(self.show_arrows)
+        self.queue_edge_overview()
+        return arr
+
+    # Takes an edge arrow out of the scene, if it's still there
+    def remove_arrow(self, arr: QGraphicsItemGroup) -> None:
+        if arr.scene():
+            self.removeItem(arr)
+        self.arrows.discard(arr)
+        self.queue_edge_overview()
+
+    # Adds the edge origin -> dependent to the diagram, but not the graph
+    def add_arrow(self, origin: QGraphicsRectItem, dependent: QGraphicsRectItem) -> None:
+        self.draw_edge_arr(origin, dependent)
+
+        self.rect_depends_on[origin].append(dependent)
+        self.rect_influences[dependent].append(origin)
+
+    # Saves the diagram to a compressed .npz file: the graph as
+    # DepGraph.save stores it, plus each rectangle's key, center and name
+    def save_diagram(self, path: str) -> None:
+        keys = sorted(self.dg.key_rects)
+        rects = [self.dg.key_rects[key] for key in keys]
+        centers = [rect.sceneBoundingRect().center() for rect in rects]
+        self.finish_component_name()
+        names = [rect.title if rect.data(self.IS_COMPONENT) else '' for rect in rects]
+
+        self.dg.save(
+            path,
+            scene_keys=np.array(keys, np.int64),
+            scene_centers=np.array([(c.x(), c.y()) for c in centers], np.double).reshape(-1, 2),
+            scene_names=np.array(names, str),
+        )
+
+    # Raises ValueError unless extra holds the arrays save_diagram
+    # writes, with one rectangle for every vertex of dg
+    @staticmethod
+    def check_diagram(dg: DepGraph, extra: dict) -> None:
+        missing = [name for name in ("scene_keys", "scene_centers", "scene_names") if name not in extra]
+        if missing:
+            raise ValueError(f"Not a diagram file, missing {', '.join(missing)}")
+
+        keys = extra["scene_keys"].tolist()
+        if extra["scene_centers"].shape != (len(keys), 2) or len(extra["scene_names"]) != len(keys):
+            raise ValueError("The diagram's scene arrays don't have one entry per rectangle")
+        if len(set(keys)) != len(keys) or set(keys) != set(dg.refi):
+            raise ValueError("The diagram's rectangles don't match its graph")
+
+    # Replaces the diagram with one written by save_diagram. The graph's
+    # arrays are restored as saved, so nothing is recomputed but risks
+    def load_diagram(self, path: str) -> None:
+        extra = self.dg.load(path, self.check_diagram)
+
+        self.finish_component_name()
+        self.clear()
+        self.edge_overview = None
+        self.setSceneRect(0, 0, self.SCENE_WIDTH, self.SCENE_HEIGHT)
+        self.rect_index.clear()
+        self.select_rect_item = None
+        self.dep_origin = None
+        self.dyn_arr = None
+        self.rect_depends_on = {}
+        self.rect_influences = {}
+        self.rect_arrs_in = {}
+        self.rect_arrs_out = {}
+        self.rect_risks = {}
+        self.components = set()
+        self.gates = set()
+        self.arrows = set()
+        self.rect_shown = {}
+        self.color_measure = None
+        self.color_target = None
+
+        dg = self.dg.dg
+        for key, (x, y), name in zip(
+            extra["scene_keys"].tolist(), extra["scene_centers"].tolist(), extra["scene_names"].tolist()
+        ):
+            vi = dg.refi[key]
+            if not dg.is_AND[vi]:
+                rect_item = self.add_component_rect(QPointF(x, y), name)
+            elif dg.vote_k[vi]:
+                rect_item = self.add_gate_rect(QPointF(x, y), f"{dg.vote_k[vi]}-of-n")
+            else:
+                rect_item = self.add_gate_rect(QPointF(x, y), "AND")
+            self.dg.attach(rect_item, key)
+
+        b, a, _ = dg.storage.edge_coo(dg.n)
+        for ai, bi in zip(a.tolist(), b.tolist()):
+            self.add_arrow(self.dg.key_rects[dg.iref[ai]], self.dg.key_rects[dg.iref[bi]])
+
+        self.update_rect_colors()
+
+    def mouseDoubleClickEvent(self, event: QGraphicsSceneMouseEvent) -> None:
+        if Qt.LeftButton == event.button():
+            rect_item = self.top_rect_at(event.scenePos())
+            if rect_item is not None and rect_item.data(self.IS_COMPONENT):
+                self.edit_component_name(rect_item)
+
+        super().mouseDoubleClickEvent(event)
+
     def keyReleaseEvent(self, event) -> None:
         match event.key():
             case Qt.Key_Delete:
-                something_deleted = False
-                for item in self.selectedItems():
-                    self.delete_rect(item)
-                    something_deleted = True
+                rects = [item for item in self.selectedItems() if item.data(self.IS_COMPONENT) or item.data(self.IS_AND_GATE)]
+                self.delete_rects(rects)
 
                 self.dep_origin = None
                 self.del_dyn_arr()
 
-                if something_deleted:
+                if rects:
                     self.update_rect_colors()
 
+# The view of the dependency tab. Ctrl + scroll zooms, and details
+# too small to see are dropped as it zooms out, see
+# DepQGraphicsScene.set_level_of_detail
+class DepQGraphicsView(QGraphicsView):
+    ZOOM_STEP = 1.25
+    MIN_ZOOM = 0.02
+    MAX_ZOOM = 4
+
+    def __init__(self, parent_scene: QGraphicsScene) -> None:
+        super().__init__(parent_scene)
+
+        self.parent_scene = parent_scene
+
+        self.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
+        self.setOptimizationFlags(
+            QGraphicsView.DontSavePainterState | QGraphicsView.DontAdjustForAntialiasing
+        )
+        self.setCacheMode(QGraphicsView.CacheBackground)
+
+        self.minimap = DepQMiniMap(self)
+
+    def zoom(self) -> float:
+        return self.transform().m11()
+
+    def zoom_by(self, factor: float) -> None:
+        factor = min(max(factor, self.MIN_ZOOM / self.zoom()), self.MAX_ZOOM / self.zoom())
+        self.scale(factor, factor)
+        self.parent_scene.set_level_of_detail(self.zoom())
+        self.minimap.update()
+
+    def wheelEvent(self, event: QWheelEvent) -> None:
+        if not event.modifiers() & Qt.ControlModifier:
+            super().wheelEvent(event)
+            return
+
+        steps = event.angleDelta().y() / 120
+        self.zoom_by(self.ZOOM_STEP ** steps)
+
+    def scrollContentsBy(self, dx: int, dy: int) -> None:
+        super().scrollContentsBy(dx, dy)
+        self.minimap.update()
+
+    def resizeEvent(self, event: QResizeEvent) -> None:
+        super().resizeEvent(event)
+        self.minimap.place()
+
+# An overview of the whole scene in the corner of a DepQGraphicsView,
+# outlining the part the view shows. Clicking or dragging on it moves
+# the view there. Components and gates are drawn as flat tiles into a
+# cached pixmap, redrawn only after the scene changes, so scrolling
+# the view just outlines a new part of it
+class DepQMiniMap(QWidget):
+    SIZE = (240, 120)
+    MARGIN = 10
+
+    def __init__(self, main_view: QGraphicsView) -> None:
+        super().__init__(main_view)
+
+        self.main_view = main_view
+        self.parent_scene = main_view.scene()
+
+        self.setFixedSize(*self.SIZE)
+        self.setFocusPolicy(Qt.NoFocus)
+
+        # Scene to minimap coordinates, and the tiles drawn with it
+        self.transform = QTransform()
+        self.pixmap = None
+        self.parent_scene.changed.connect(self.invalidate)
+        self.parent_scene.sceneRectChanged.connect(self.invalidate)
+
+        self.place()
+
+    def invalidate(self) -> None:
+        self.pixmap = None
+        self.update()
+
+    # Moves to the bottom right corner of the main view
+    def place(self) -> None:
+        viewport = self.main_view.viewport().geometry()
+        self.move(
+            viewport.right() - self.width() - self.MARGIN,
+            viewport.bottom() - self.height() - self.MARGIN,
+        )
+
+    def render_tiles(self) -> None:
+        scene_rect = self.parent_scene.sceneRect()
+        scale = min(self.width() / scene_rect.width(), self.height() / scene_rect.height())
+        self.transform = QTransform.fromScale(scale, scale).translate(-scene_rect.x(), -scene_rect.y())
+
+        self.pixmap = QPixmap(self.size())
+        self.pixmap.fill(Qt.white)
+        painter = QPainter(self.pixmap)
+        painter.setTransform(self.transform)
+        for rect_item in self.parent_scene.components | self.parent_scene.gates:
+            painter.fillRect(rect_item.sceneBoundingRect(), rect_item.brush())
+        painter.end()
+
+    def paintEvent(self, event: QPaintEvent) -> None:
+        if self.pixmap is None:
+            self.render_tiles()
+
+        painter = QPainter(self)
+        painter.drawPixmap(0, 0, self.pixmap)
+
+        painter.setTransform(self.transform)
+        painter.setPen(QPen(Qt.blue, 0))
+        painter.setBrush(Qt.NoBrush)
+        painter.drawRect(self.main_view.mapToScene(self.main_view.viewport().rect()).boundingRect())
+
+        painter.resetTransform()
+        painter.setPen(QPen(Qt.black, 0))
+        painter.drawRect(0, 0, self.width() - 1, self.height() - 1)
+
+    def center_main_view(self, pos: QPoint) -> None:
+        inverse, _ = self.transform.inverted()
+        self.main_view.centerOn(inverse.map(QPointF(pos)))
+
+    def mousePressEvent(self, event: QMouseEvent) -> None:
+        self.center_main_view(event.pos())
+
+    def mouseMoveEvent(self, event: QMouseEvent) -> None:
+        if event.buttons() & Qt.LeftButton:
+            self.center_main_view(event.pos())
+
 """
 
 Name: MainWindow
@@ -1241,7 +2034,7 @@ class MainWindow(QMainWindow):
         self.system_vis_scene = DepQGraphicsScene(self)
         self.system_vis_scene.setBackgroundBrush(QBrush(Qt.white, Qt.SolidPattern))
 
-        self.system_vis_view = QGraphicsView(self.system_vis_scene)
+        self.system_vis_view = DepQGraphicsView(self.system_vis_scene)
         self.system_vis_view.setMouseTracking(True)
         self.system_vis_view.setFrameStyle(QFrame.Panel | QFrame.Plain)
         self.system_vis_view.setLineWidth(2)
@@ -1267,6 +2060,12 @@ class MainWindow(QMainWindow):
             self.AND_gate_icon, "Add AND Gate", self.dep_toolbar, self.system_vis_scene, self
         )
 
+        # k-of-n gate button. It has no icon, so the toolbar shows its text
+        self.vote_gate_button = DepQAction(
+            QIcon(), "k/n", self.dep_toolbar, self.system_vis_scene, self
+        )
+        self.vote_gate_button.setToolTip("Add k-of-n Gate")
+
         # Eraser button
         self.eraser_icon = QIcon(os.path.join(self.IMAGES_PATH, "eraser.png"))
         self.eraser_button = DepQAction(
@@ -1274,6 +2073,15 @@ class MainWindow(QMainWindow):
         )
         self.eraser_cursor = QCursor(QPixmap(os.path.join(self.IMAGES_PATH, "eraser_cursor.png")))
 
+        # Saving and opening diagrams
+        self.dep_toolbar.addSeparator()
+        self.save_diagram_action = self.dep_toolbar.addAction("Save")
+        self.save_diagram_action.setToolTip("Save Diagram")
+        self.save_diagram_action.triggered.connect(self.save_diagram)
+        self.open_diagram_action = self.dep_toolbar.addAction("Open")
+        self.open_diagram_action.setToolTip("Open Diagram")
+        self.open_diagram_action.triggered.connect(self.open_diagram)
+
         # Add widgets separate from setup
         self.dep_layout.addWidget(self.dep_toolbar)
         self.dep_layout.addWidget(self.system_vis_view)
@@ -1831,6 +2639,34 @@ class MainWindow(QMainWindow):
         self.main_figure
         figure.savefig(file_path, format="jpg", dpi=300)
 
+    """
+    Saves the dependency diagram to a file, or opens one saved before.
+    """
+
+    def save_diagram(self):
+        file_path, _ = QFileDialog.getSaveFileName(
+            self, "Save Diagram", "", "Dependency Diagrams (*.npz)"
+        )
+        if not file_path:
+            return
+
+        try:
+            self.system_vis_scene.save_diagram(file_path)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Save Error", str(e))
+
+    def open_diagram(self):
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "Open Diagram", "", "Dependency Diagrams (*.npz)"
+        )
+        if not file_path:
+            return
+
+        try:
+            self.system_vis_scene.load_diagram(file_path)
+        except (OSError, ValueError, KeyError) as e:
+            QMessageBox.warning(self, "Open Error", str(e))
+
     def filter_components(self, pop_comp_func, field):
         def f(search_query):
             filtered_components = [